@@ -2,52 +2,118 @@
 
 # Used by mininet for the tcp command (testing tcp connectivity between
 # hosts)
+#
+# Connects to several echo servers at once, sends each of them some
+# data and checks that it is echoed back, then reports a line
+#   HOST:PORT RESULT
+# for each server, where RESULT is OK, NODATA, CONN TIMEOUT,
+# CONN ERROR, XFER TIMEOUT or XFER ERROR.
 
-import socket
+import datetime
+import errno
+import os
+import select
 import socket
 import sys
-import datetime
+import time
+
+if len( sys.argv ) < 3:
+    sys.stderr.write( "Internal command for mininet's tcp testing\n" )
+    sys.stderr.write( "Usage: %s TIMEOUT HOST:PORT [HOST:PORT...]\n" %
+                      sys.argv[ 0 ] )
+    sys.exit( 2 )
+
+TIMEOUT = float( sys.argv[ 1 ] )
+TARGETS = sys.argv[ 2: ]
 
-if len(sys.argv)!=4:
-    sys.stderr.write("Internal command for mininet's tcp testing\n")
-    sys.stderr.write("Usage: %s TIMEOUT IP PORT\n", sys.argv[0])
-    sys.exit(2)
-
-TIMEOUT = float(sys.argv[1])
-HOST = sys.argv[2]
-PORT = sys.argv[3]  
-try:
-    s = socket.create_connection((HOST,PORT), timeout=TIMEOUT)
-except socket.timeout:
-    print "CONN TIMEOUT"
-    sys.exit(1)
-except socket.error, msg:
-    print "CONN ERROR", msg
-    sys.exit(1)
-
-s.settimeout(TIMEOUT)
 # A somewhat random string to send to the server
-data = str(datetime.datetime.today())
-# Make sure its just over 2000 bytes long ==> 
+DATA = str( datetime.datetime.today() )
+# Make sure its just over 2000 bytes long ==>
 # more than 1 pkt
-data = data * (2000/len(data)+1)
-
-try: 
-    s.sendall(data)
-    while 1:
-        indata = s.recv(1024)
-        if not indata: break
-        if not data.startswith(indata): break
-        data = data[len(indata):]
-        if len(data)== 0: break
-    s.close()
-    if len(data) != 0:
-        print "NODATA"
-        sys.exit(1)
-except socket.timeout:
-    print "XFER TIMEOUT"
-    sys.exit(1)
-except socket.error, msg:
-    print "XFER ERROR", msg
-    sys.exit(1)
-print "OK"
+DATA = DATA * ( 2000 / len( DATA ) + 1 )
+
+class Probe( object ):
+    "Connection to one echo server."
+
+    def __init__( self, target ):
+        self.target = target
+        host, port = target.rsplit( ':', 1 )
+        self.sock = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        self.sock.setblocking( 0 )
+        self.connected = False
+        self.sent = 0  # bytes of DATA sent
+        self.received = 0  # bytes of DATA echoed back
+        self.deadline = time.time() + TIMEOUT
+        self.result = None
+        err = self.sock.connect_ex( ( host, int( port ) ) )
+        if err not in ( 0, errno.EINPROGRESS ):
+            self.finish( 'CONN ERROR %s' % os.strerror( err ) )
+
+    def events( self ):
+        "Return the poll events we are waiting for."
+        if not self.connected or self.sent < len( DATA ):
+            return select.POLLOUT
+        return select.POLLIN
+
+    def ready( self ):
+        "Make progress once the socket is ready."
+        if not self.connected:
+            err = self.sock.getsockopt( socket.SOL_SOCKET, socket.SO_ERROR )
+            if err:
+                return self.finish( 'CONN ERROR %s' % os.strerror( err ) )
+            self.connected = True
+        try:
+            if self.sent < len( DATA ):
+                self.sent += self.sock.send( DATA[ self.sent: ] )
+            else:
+                data = self.sock.recv( 65536 )
+                if ( not data or not
+                     DATA.startswith( data, self.received ) ):
+                    return self.finish( 'NODATA' )
+                self.received += len( data )
+                if self.received == len( DATA ):
+                    return self.finish( 'OK' )
+        except socket.error, e:
+            if e.args[ 0 ] == errno.EAGAIN:
+                return
+            return self.finish( 'XFER ERROR %s' % e )
+        self.deadline = time.time() + TIMEOUT
+
+    def timeout( self ):
+        "Give up on the server."
+        self.finish( 'XFER TIMEOUT' if self.connected else 'CONN TIMEOUT' )
+
+    def finish( self, result ):
+        "Record our result and close the connection."
+        self.result = result
+        self.sock.close()
+
+probes = [ Probe( target ) for target in TARGETS ]
+active = dict( ( probe.sock.fileno(), probe ) for probe in probes
+               if probe.result is None )
+poller = select.poll()
+for fd, probe in active.items():
+    poller.register( fd, probe.events() )
+
+while active:
+    now = time.time()
+    for fd, probe in active.items():
+        if probe.deadline <= now:
+            probe.timeout()
+            poller.unregister( fd )
+            del active[ fd ]
+    if not active:
+        break
+    deadline = min( probe.deadline for probe in active.values() )
+    for fd, _event in poller.poll( max( 0, int( ( deadline - now ) * 1000 ) )
+                                   + 1 ):
+        probe = active[ fd ]
+        probe.ready()
+        if probe.result is None:
+            poller.modify( fd, probe.events() )
+        else:
+            poller.unregister( fd )
+            del active[ fd ]
+
+for probe in probes:
+    print probe.target, probe.result
@@ -2,44 +2,140 @@
 
 # Used by mininet for the tcp command (testing tcp connectivity between
 # hosts)
+#
+# Echo server which listens on several ports at once and reports, for
+# each port, the result of the first connection to it as a line
+#   PORT RESULT
+# where RESULT is OK, CONN TIMEOUT, CONN ERROR, XFER TIMEOUT or
+# XFER ERROR. It exits once every port has a result; SIGTERM makes it
+# stop waiting for connections that haven't been made yet.
+#
+# With -o FILE, the server goes into the background once it is
+# listening: it prints "LISTENING PID" and writes its results to
+# FILE.part, which it renames to FILE when it is done.
 
+import errno
+import os
+import select
+import signal
 import socket
 import sys
+import time
 
-if len(sys.argv)!=3:
-    sys.stderr.write("Internal command for mininet's tcp testing\n")
-    sys.stderr.write("Usage: %s TIMEOUT PORT\n", sys.argv[0])
-    sys.exit(2)
+args = sys.argv[ 1: ]
+outfile = None
+if args[ :1 ] == [ '-o' ] and len( args ) > 1:
+    outfile = args[ 1 ]
+    args = args[ 2: ]
+if len( args ) < 2:
+    sys.stderr.write( "Internal command for mininet's tcp testing\n" )
+    sys.stderr.write( "Usage: %s [-o FILE] TIMEOUT PORT [PORT...]\n" %
+                      sys.argv[ 0 ] )
+    sys.exit( 2 )
 
-TIMEOUT = float(sys.argv[1])
+TIMEOUT = float( args[ 0 ] )
 HOST = ''    # listen on all ifaces
-PORT = int(sys.argv[2])
+PORTS = [ int( port ) for port in args[ 1: ] ]
 
-try:
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.bind((HOST, PORT))
-    s.listen(1)
-    s.settimeout(TIMEOUT)
+results = {}  # port -> result
+listeners = {}  # fd -> listening socket, port
+conns = {}  # fd -> connected socket, port
+deadlines = {}  # fd -> time at which the socket times out
+poller = select.poll()
+
+for port in PORTS:
+    try:
+        s = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        s.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+        s.bind( ( HOST, port ) )
+        s.listen( 1 )
+    except socket.error, msg:
+        results[ port ] = 'CONN ERROR %s' % msg
+        continue
+    listeners[ s.fileno() ] = s, port
+    deadlines[ s.fileno() ] = time.time() + TIMEOUT
+    poller.register( s.fileno(), select.POLLIN )
+
+if outfile:
+    pid = os.fork()
+    if pid:
+        print "LISTENING", pid
+        sys.stdout.flush()
+        os._exit( 0 )
+    # Detach from the node's shell and its terminal
+    os.setsid()
+    out = os.open( outfile + '.part',
+                   os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644 )
+    null = os.open( os.devnull, os.O_RDONLY )
+    os.dup2( null, 0 )
+    os.dup2( out, 1 )
+    os.dup2( out, 2 )
+    os.close( null )
+    os.close( out )
+else:
     print "LISTENING"
-    conn, addr = s.accept()
-except socket.timeout:
-    print "CONN TIMEOUT"
-    sys.exit(1)
-except socket.error, msg:
-    print "CONN ERROR", msg
-    sys.exit(1)
-
-try:
-    conn.settimeout(TIMEOUT)
-    while 1:
-        data = conn.recv(1024)
-        if not data: break
-        conn.sendall(data)
-    conn.close()
-except socket.timeout:
-    print "XFER TIMEOUT"
-    sys.exit(1)
-except socket.error, msg:
-    print "XFER ERROR", msg
-    sys.exit(1)
-print "OK"
+    sys.stdout.flush()
+
+def stopListening( _signum, _frame ):
+    "Time out all ports which haven't been connected to yet."
+    for fd in listeners:
+        deadlines[ fd ] = 0
+
+signal.signal( signal.SIGTERM, stopListening )
+
+def finish( fd, result ):
+    "Record the result for the socket on fd and close it."
+    sock, port = listeners.pop( fd, None ) or conns.pop( fd )
+    del deadlines[ fd ]
+    poller.unregister( fd )
+    sock.close()
+    results[ port ] = result
+
+while listeners or conns:
+    now = time.time()
+    for fd, deadline in deadlines.items():
+        if deadline <= now:
+            finish( fd, 'CONN TIMEOUT' if fd in listeners
+                    else 'XFER TIMEOUT' )
+    if not deadlines:
+        break
+    timeoutms = max( 0, int( ( min( deadlines.values() ) - now ) * 1000 ) )
+    try:
+        ready = poller.poll( timeoutms + 1 )
+    except select.error, e:
+        if e.args[ 0 ] == errno.EINTR:
+            continue
+        raise
+    for fd, _event in ready:
+        if fd in listeners:
+            s, port = listeners[ fd ]
+            try:
+                conn, _addr = s.accept()
+            except socket.error, msg:
+                finish( fd, 'CONN ERROR %s' % msg )
+                continue
+            # One connection per port: stop listening
+            finish( fd, None )
+            conn.settimeout( TIMEOUT )
+            conns[ conn.fileno() ] = conn, port
+            deadlines[ conn.fileno() ] = time.time() + TIMEOUT
+            poller.register( conn.fileno(), select.POLLIN )
+        elif fd in conns:
+            conn, port = conns[ fd ]
+            try:
+                data = conn.recv( 65536 )
+                if not data:
+                    finish( fd, 'OK' )
+                    continue
+                conn.sendall( data )
+                deadlines[ fd ] = time.time() + TIMEOUT
+            except socket.timeout:
+                finish( fd, 'XFER TIMEOUT' )
+            except socket.error, msg:
+                finish( fd, 'XFER ERROR %s' % msg )
+
+for port in PORTS:
+    print port, results.get( port ) or 'CONN TIMEOUT'
+if outfile:
+    sys.stdout.flush()
+    os.rename( outfile + '.part', outfile )
@@ -0,0 +1,38 @@
+#!/usr/bin/python
+
+"""
+Measure how fast a host's command output can be read back.
+
+This runs a command which prints a large amount of output (100 MB by
+default) on a host, first over a pty and then over a socketpair, and
+reports the throughput of Node.cmd() in each case.
+"""
+
+import sys
+from time import time
+
+from mininet.log import setLogLevel, info
+from mininet.net import init
+from mininet.node import Host
+
+def cmdThroughput( size, usePty ):
+    """Time the output of a size-byte command.
+       size: number of bytes of output
+       usePty: use a pty for the host's shell?
+       returns: bytes read, elapsed seconds"""
+    host = Host( 'h1', usePty=usePty )
+    start = time()
+    output = host.cmd( 'head -c %d /dev/zero | tr "\\000" x' % size )
+    elapsed = time() - start
+    host.terminate()
+    return len( output ), elapsed
+
+if __name__ == '__main__':
+    setLogLevel( 'info' )
+    init()
+    size = int( sys.argv[ 1 ] ) if len( sys.argv ) > 1 else 100 * 1000000
+    for usePty in True, False:
+        count, elapsed = cmdThroughput( size, usePty )
+        info( '*** %s: read %d bytes in %.3f seconds (%.1f MB/s)\n' %
+              ( 'pty' if usePty else 'socketpair', count, elapsed,
+                count / elapsed / 1e6 ) )
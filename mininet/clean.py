@@ -32,6 +32,8 @@ def cleanup():
     # are already (un)dead. Then again,
     # you can't connect to them either, so they're mostly harmless.
     sh( 'killall -9 ' + zombies + ' 2> /dev/null' )
+    # mnexec -w processes holding the namespaces of lazy node shells
+    sh( "pkill -9 -f '(^|/)mnexec -[a-z]*w' 2> /dev/null" )
 
     info( "*** Removing junk from /tmp\n" )
     sh( 'rm -f /tmp/vconn* /tmp/vlogs* /tmp/*.out /tmp/*.log /tmp/mn-*sock' )
@@ -28,13 +28,13 @@ and bandwidth ('iperf'.)
 from subprocess import call
 from cmd import Cmd
 from os import isatty
-from select import poll, POLLIN
 import sys
 import re
 
 from mininet.log import info, output, error
+from mininet.reactor import reactor
 from mininet.term import makeTerms
-from mininet.util import quietRun, isShellBuiltin
+from mininet.util import run, isShellBuiltin
 
 class CLI( Cmd ):
     "Simple command-line interface to talk to nodes."
@@ -49,8 +49,6 @@ class CLI( Cmd ):
             self.nodemap[ node.name ] = node
         # Attempt to handle input
         self.stdin = stdin
-        self.inPoller = poll()
-        self.inPoller.register( stdin )
         self.inputFile = script
         Cmd.__init__( self )
         info( '*** Starting CLI:\n' )
@@ -65,7 +63,8 @@ class CLI( Cmd ):
                         node.sendInt()
                         node.monitor()
                 if self.isatty():
-                    quietRun( 'stty sane' )
+                    # stty must run on our own terminal, not in the root helper
+                    run( 'stty sane' )
                 self.cmdloop()
                 break
             except KeyboardInterrupt:
@@ -319,10 +318,10 @@ class CLI( Cmd ):
     def do_noecho( self, line ):
         "Run an interactive command with echoing turned off."
         if self.isatty():
-            quietRun( 'stty -echo' )
-        self.default( line )
+            run( 'stty -echo' )
+        self.default( line, interactive=True )
         if self.isatty():
-            quietRun( 'stty echo' )
+            run( 'stty echo' )
 
     def do_source( self, line ):
         "Read commands from an input file."
@@ -377,11 +376,12 @@ class CLI( Cmd ):
         host.addvlan(vlan)
 
 
-    def default( self, line ):
+    def default( self, line, interactive=False ):
         """Called on an input line when the command prefix is not recognized.
         Overridden to run shell commands when a node is the first CLI argument.
         Past the first CLI argument, node names are automatically replaced with
-        corresponding IP addrs."""
+        corresponding IP addrs.
+        interactive: command needs a terminal (see do_noecho)"""
 
         first, args, line = self.parseline( line )
         if args and len(args) > 0 and args[ -1 ] == '\n':
@@ -405,7 +405,8 @@ class CLI( Cmd ):
             rest = ' '.join( rest )
             # Run cmd on node:
             builtin = isShellBuiltin( first )
-            node.sendCmd( rest, printPid=( not builtin ) )
+            node.sendCmd( rest, printPid=( not builtin ),
+                          interactive=interactive )
             self.waitForNode( node )
         else:
             error( '*** Unknown command: %s\n' % first )
@@ -414,38 +415,18 @@ class CLI( Cmd ):
 
     def waitForNode( self, node ):
         "Wait for a node to finish, and  print its output."
-        # Pollers
-        nodePoller = poll()
-        nodePoller.register( node.stdout )
-        bothPoller = poll()
-        bothPoller.register( self.stdin )
-        bothPoller.register( node.stdout )
-        while True:
-            try:
-                bothPoller.poll()
-                # XXX BL: this doesn't quite do what we want.
-                if False and self.inputFile:
-                    key = self.inputFile.read( 1 )
-                    if key is not '':
-                        node.write(key)
-                    else:
-                        self.inputFile = None
-                if isReadable( self.inPoller ):
-                    key = self.stdin.read( 1 )
-                    node.write( key )
-                if isReadable( nodePoller ):
-                    data = node.monitor()
-                    output( data )
-                if not node.waiting:
-                    break
-            except KeyboardInterrupt:
-                node.sendInt()
-
-# Helper functions
-
-def isReadable( poller ):
-    "Check whether a Poll object has a readable fd."
-    for fdmask in poller.poll( 0 ):
-        mask = fdmask[ 1 ]
-        if mask & POLLIN:
-            return True
+        # Keystrokes are passed on to the node from the reactor,
+        # while we wait for the node's output
+        stdin = self.stdin.fileno()
+        reactor.addReader( stdin,
+                           lambda: node.write( self.stdin.read( 1 ) ) )
+        try:
+            while True:
+                try:
+                    output( node.monitor() )
+                    if not node.waiting:
+                        break
+                except KeyboardInterrupt:
+                    node.sendInt()
+        finally:
+            reactor.removeReader( stdin )
@@ -0,0 +1,152 @@
+"""
+Client for the mnexec fork server.
+
+Starting a node shell the usual way runs sudo, env and mnexec before
+bash even starts, and sudo alone costs a fork/exec and PAM processing.
+Instead, we start 'mnexec -s' once (as root), and then ask it to start
+each node over a unix socket: the server creates the node's pty or
+socketpair, forks, moves the child into its network namespace and
+execs the requested program, and sends back the child's pid along
+with our end of the pty or socketpair (as SCM_RIGHTS ancillary data).
+See mnexec.c for the protocol.
+
+Older mnexec binaries don't support -s; in that case forkServer()
+returns None, and nodes are started the usual way.
+"""
+
+import ctypes
+import os
+import socket
+import struct
+from errno import ESRCH
+from subprocess import Popen
+
+from mininet.log import debug
+
+SOL_SOCKET = 1
+SCM_RIGHTS = 1
+
+class Iovec( ctypes.Structure ):
+    "struct iovec, for recvmsg(2)"
+    _fields_ = [ ( 'iov_base', ctypes.c_void_p ),
+                 ( 'iov_len', ctypes.c_size_t ) ]
+
+class Msghdr( ctypes.Structure ):
+    "struct msghdr, for recvmsg(2)"
+    _fields_ = [ ( 'msg_name', ctypes.c_void_p ),
+                 ( 'msg_namelen', ctypes.c_uint32 ),
+                 ( 'msg_iov', ctypes.POINTER( Iovec ) ),
+                 ( 'msg_iovlen', ctypes.c_size_t ),
+                 ( 'msg_control', ctypes.c_void_p ),
+                 ( 'msg_controllen', ctypes.c_size_t ),
+                 ( 'msg_flags', ctypes.c_int ) ]
+
+_libc = None
+
+def recvFd( sock, bufsize=64 ):
+    """Receive a message, along with a file descriptor if one was sent.
+       (Python 2 has no socket.recvmsg().)
+       sock: socket
+       bufsize: maximum message size
+       returns: message, fd or None"""
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL( None, use_errno=True )
+    align = ctypes.sizeof( ctypes.c_size_t )
+    header = struct.calcsize( '@Lii' )  # struct cmsghdr
+    buf = ctypes.create_string_buffer( bufsize )
+    control = ctypes.create_string_buffer( header + align )
+    iov = Iovec( ctypes.cast( buf, ctypes.c_void_p ), bufsize )
+    msg = Msghdr( None, 0, ctypes.pointer( iov ), 1,
+                  ctypes.cast( control, ctypes.c_void_p ),
+                  ctypes.sizeof( control ), 0 )
+    count = _libc.recvmsg( sock.fileno(), ctypes.byref( msg ), 0 )
+    if count < 0:
+        errno = ctypes.get_errno()
+        raise OSError( errno, os.strerror( errno ) )
+    fd = None
+    if msg.msg_controllen >= header + 4:
+        length, level, kind = struct.unpack( '@Lii', control.raw[ :header ] )
+        if level == SOL_SOCKET and kind == SCM_RIGHTS and length >= header + 4:
+            fd = struct.unpack( '@i', control.raw[ header:header + 4 ] )[ 0 ]
+    return buf.raw[ :count ], fd
+
+class ServerChild( object ):
+    """A process started by the fork server. It isn't our child, so
+       we can only tell whether it is still running."""
+
+    def __init__( self, pid ):
+        "pid: process id"
+        self.pid = pid
+        self.returncode = None
+
+    def poll( self ):
+        """Check whether the process is still running.
+           returns: None if so, like Popen.poll()"""
+        if self.returncode is None:
+            try:
+                os.kill( self.pid, 0 )
+            except OSError, e:
+                if e.errno == ESRCH:
+                    # The server reaped it, so its status is lost
+                    self.returncode = -1
+        return self.returncode
+
+class ForkServer( object ):
+    "Client for an 'mnexec -s' process which starts node processes."
+
+    def __init__( self ):
+        self.sock, child = socket.socketpair( socket.AF_UNIX,
+                                              socket.SOCK_SEQPACKET )
+        # sudo is slow to start, so skip it if we're root already
+        sudo = [ 'sudo', '-E' ] if os.geteuid() != 0 else []
+        devnull = open( os.devnull, 'w' )
+        self.proc = Popen( sudo + [ 'env', 'PATH=%s' % os.environ[ 'PATH' ],
+                                    'mnexec', '-s' ],
+                           stdin=child, stdout=devnull, stderr=devnull,
+                           close_fds=True )
+        child.close()
+        devnull.close()
+        self.alive = self.sock.recv( 64 ) == 'mnexec'
+
+    def spawn( self, args, env=(), newNs=False, nsPid=None, usePty=True ):
+        """Start a process in a new session.
+           args: program and arguments
+           env: list of 'VAR=value' environment settings
+           newNs: start the process in a new network namespace?
+           nsPid: pid of a process whose network namespace to join
+           usePty: connect the process to a pty rather than a socketpair?
+           returns: ServerChild, fd of our end of its pty or socketpair"""
+        opts = ( 'n' if newNs else '' ) + ( 't' if usePty else '' )
+        fields = ( [ opts or '-', str( nsPid or 0 ), str( len( env ) ) ] +
+                   list( env ) + list( args ) )
+        self.sock.send( ''.join( field + '\0' for field in fields ) )
+        reply, fd = recvFd( self.sock )
+        if not reply:
+            self.alive = False
+            raise OSError( 'mnexec fork server exited unexpectedly' )
+        pid = int( reply )
+        if pid < 0:
+            raise OSError( -pid, '%s: %s' % ( args[ 0 ],
+                                              os.strerror( -pid ) ) )
+        return ServerChild( pid ), fd
+
+    def stop( self ):
+        "Shut down the server."
+        self.sock.close()
+        self.proc.wait()
+
+def forkServer():
+    """Return the shared fork server, starting it on first use.
+       returns: ForkServer, or None if mnexec doesn't support -s"""
+    if forkServer.server is None:
+        server = ForkServer()
+        if not server.alive:
+            debug( '*** mnexec has no fork server; starting nodes with '
+                   'sudo and mnexec\n' )
+            server.stop()
+            server = False
+        forkServer.server = server
+    return forkServer.server or None
+
+forkServer.server = None  # ForkServer, started on first use
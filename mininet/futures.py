@@ -0,0 +1,226 @@
+"""
+Futures for running commands on many nodes concurrently.
+
+Node.acmd() queues a command on a node and returns a CmdFuture right
+away; the command is sent as soon as the node's shell is free, and its
+output is collected later, when somebody waits for a future. Waiting
+for any future (via Future.result(), wait() or gather()) drives the
+commands of *all* nodes, using the shared reactor (see mininet.reactor)
+to read their output, so thousands of hosts can be scripted from one
+thread:
+
+    futures = [ h.acmd( 'ping -c1 %s' % dest.IP() ) for h in net.hosts ]
+    outputs = gather( futures ).result()
+
+Futures can be chained with then(): fut.then( fn ) returns a future for
+fn( result ), and if fn returns a future itself, for that future's
+result. This is how multi-step operations such as Mininet.atcptest()
+are built.
+
+While a node has queued commands, its synchronous API (cmd() etc.)
+must not be used.
+"""
+
+from collections import deque
+from time import time
+
+from mininet.reactor import reactor
+
+class Future( object ):
+    "Result of an operation which completes later."
+
+    def __init__( self ):
+        self.finished = False
+        self.value = None
+        self.callbacks = []
+
+    def done( self ):
+        "Has the operation completed?"
+        return self.finished
+
+    def set( self, value ):
+        """Complete the future.
+           value: result, or a future whose result to wait for"""
+        if isinstance( value, Future ):
+            value.addCallback( self.set )
+            return
+        self.finished = True
+        self.value = value
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback( value )
+
+    def addCallback( self, callback ):
+        """Call callback( result ) once the future completes.
+           callback: function of one argument"""
+        if self.finished:
+            callback( self.value )
+        else:
+            self.callbacks.append( callback )
+
+    def then( self, fn ):
+        """Chain another step after this one.
+           fn: function of our result, returning a value or a future
+           returns: future for fn's result"""
+        future = Future()
+        self.addCallback( lambda value: future.set( fn( value ) ) )
+        return future
+
+    def result( self, timeout=None ):
+        """Run commands until the future completes, and return its result.
+           timeout: seconds to wait, or None to wait indefinitely
+           returns: result, or None if the future didn't complete"""
+        wait( [ self ], timeout )
+        return self.value
+
+class CmdFuture( Future ):
+    "Output of a command queued on a node."
+
+    def __init__( self, node, args, kwargs ):
+        """node: node to run the command on
+           args, kwargs: arguments for node.sendCmd(); in addition,
+           exitcode=True makes the result ( output, exit status )"""
+        Future.__init__( self )
+        self.node = node
+        self.args = args
+        self.exitcode = kwargs.pop( 'exitcode', False )
+        self.kwargs = kwargs
+        self.output = []
+
+    def start( self ):
+        "Send the command to the node."
+        self.node.sendCmd( *self.args, **self.kwargs )
+
+    def read( self ):
+        """Read the command's output.
+           returns: True if the command is done"""
+        self.output.append( self.node.monitor( 0 ) )
+        return not self.node.waiting
+
+    def complete( self ):
+        "Complete the future with the output of the finished command."
+        output = ''.join( self.output )
+        self.set( ( output, self.node.lastStatus ) if self.exitcode
+                  else output )
+
+# Commands queued on each node; the first one is running
+queues = {}
+# Nodes with a running command
+running = set()
+
+def submit( node, *args, **kwargs ):
+    """Queue a command on a node.
+       node: node to run the command on
+       args, kwargs: arguments for node.sendCmd()
+       returns: CmdFuture for the command's output"""
+    future = CmdFuture( node, args, kwargs )
+    queue = queues.setdefault( node, deque() )
+    queue.append( future )
+    if len( queue ) == 1:
+        startNext( node )
+    return future
+
+def startNext( node ):
+    """Start the next command queued on a node.
+       node: node whose shell is free"""
+    queue = queues[ node ]
+    if not queue:
+        del queues[ node ]
+        return
+    queue[ 0 ].start()
+    running.add( node )
+
+def step( timeoutms=None ):
+    """Read output from the nodes with running commands, completing
+       the futures of commands which are done.
+       timeoutms: timeout in ms or None to wait indefinitely
+       returns: False if no commands are running"""
+    if not running:
+        return False
+    for node in reactor.ready( running, timeoutms ):
+        if node not in running:
+            # Finished by a nested wait() in a callback
+            continue
+        future = queues[ node ][ 0 ]
+        if future.read():
+            running.discard( node )
+            queues[ node ].popleft()
+            startNext( node )
+            # Callbacks may queue or wait for more commands
+            future.complete()
+    return True
+
+def wait( futures, timeout=None ):
+    """Run commands until a set of futures complete.
+       futures: list of futures
+       timeout: seconds to wait, or None to wait indefinitely
+       returns: list of futures which didn't complete"""
+    deadline = None if timeout is None else time() + timeout
+    pending = [ future for future in futures if not future.done() ]
+    while pending:
+        timeoutms = None
+        if deadline is not None:
+            timeoutms = int( ( deadline - time() ) * 1000 )
+            if timeoutms <= 0:
+                break
+        if not step( timeoutms ):
+            # Nothing left to run, so the rest can't complete
+            break
+        pending = [ future for future in pending if not future.done() ]
+    return pending
+
+def gather( futures ):
+    """Combine a list of futures.
+       futures: list of futures
+       returns: future for the list of their results"""
+    futures = list( futures )
+    combined = Future()
+    remaining = [ len( futures ) ]
+
+    def completed( _value ):
+        "Complete the combined future once all futures are done."
+        remaining[ 0 ] -= 1
+        if remaining[ 0 ] == 0:
+            combined.set( [ future.value for future in futures ] )
+
+    if not futures:
+        combined.set( [] )
+    for future in futures:
+        future.addCallback( completed )
+    return combined
+
+def runLimited( fn, items, limit=0 ):
+    """Start an operation for each of a list of items, with at most
+       limit of them running at once.
+       fn: function of an item, returning a future
+       items: list of items
+       limit: maximum number of running operations, or 0 for no limit
+       returns: future for the list of results, in order"""
+    items = list( items )
+    results = [ None ] * len( items )
+    combined = Future()
+    state = { 'next': 0, 'remaining': len( items ) }
+
+    def launch():
+        "Start the operation for the next item."
+        index = state[ 'next' ]
+        state[ 'next' ] += 1
+        fn( items[ index ] ).addCallback(
+            lambda value: finished( index, value ) )
+
+    def finished( index, value ):
+        "Record a result, and start the next operation."
+        results[ index ] = value
+        state[ 'remaining' ] -= 1
+        if state[ 'next' ] < len( items ):
+            launch()
+        elif state[ 'remaining' ] == 0:
+            combined.set( results )
+
+    if not items:
+        combined.set( [] )
+    for _ in range( limit or len( items ) ):
+        # Operations which complete at once start the next ones
+        if state[ 'next' ] < len( items ):
+            launch()
+    return combined
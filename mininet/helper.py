@@ -0,0 +1,127 @@
+"""
+Privileged command helper for Mininet.
+
+Mininet runs many short commands as root (ip, ifconfig, ovs-vsctl,
+kill, ...). Prefixing each of them with sudo costs a fork/exec of sudo
+and env plus PAM processing, so when we aren't root already we start
+this module once as a script under sudo, and then pass it commands
+over a pipe:
+
+    request:  '<argslen> <inputlen>\\n' args input
+    response: '<status> <outputlen>\\n' output
+
+where args is the command's argument list joined by NUL characters,
+input is sent to the command's stdin, and output is its stdout and
+stderr.
+
+This module only depends on the standard library, so that it can be
+run as a script by root without mininet on root's python path.
+"""
+
+import os
+import select
+import sys
+from subprocess import Popen, PIPE, STDOUT
+
+def runCmd( cmd, input=None ):
+    """Run a command, routing stderr to stdout.
+       cmd: list of command params
+       input: string to write to the command's stdin, or None
+              (the command's stdin is always a pipe of its own: in the
+              helper, our stdin carries requests)
+       returns: output, exit status"""
+    try:
+        popen = Popen( cmd, stdin=PIPE, stdout=PIPE, stderr=STDOUT )
+    except OSError, e:
+        return '%s: %s\n' % ( cmd[ 0 ], e.strerror ), 127
+    # We can't use Popen.communicate() because it uses
+    # select(), which can't handle
+    # high file descriptor numbers! poll() can, however.
+    poller = select.poll()
+    outfd = popen.stdout.fileno()
+    poller.register( outfd, select.POLLIN )
+    infd, offset = None, 0
+    if input:
+        infd = popen.stdin.fileno()
+        poller.register( infd, select.POLLOUT )
+    else:
+        popen.stdin.close()
+    output = []
+    while outfd is not None:
+        for fd, event in poller.poll():
+            if fd == outfd:
+                data = os.read( outfd, 65536 )
+                if data:
+                    output.append( data )
+                    continue
+                poller.unregister( outfd )
+                outfd = None
+            elif fd == infd:
+                if event & select.POLLOUT:
+                    try:
+                        offset += os.write( infd,
+                                            buffer( input, offset, 65536 ) )
+                    except OSError:
+                        # Command exited without reading all of its input
+                        offset = len( input )
+                if offset >= len( input ) or not event & select.POLLOUT:
+                    poller.unregister( infd )
+                    popen.stdin.close()
+                    infd = None
+    if infd is not None:
+        popen.stdin.close()
+    popen.wait()
+    return ''.join( output ), popen.returncode
+
+class RootHelper( object ):
+    "Client for a helper process which runs commands as root."
+
+    def __init__( self, sudo=True ):
+        "sudo: start the helper under sudo (False if we are root already)"
+        script = os.path.splitext( os.path.abspath( __file__ ) )[ 0 ] + '.py'
+        cmd = [ sys.executable, script ]
+        if sudo:
+            cmd = [ 'sudo', '-E', 'env',
+                    'PATH=%s' % os.environ[ 'PATH' ] ] + cmd
+        self.proc = Popen( cmd, stdin=PIPE, stdout=PIPE )
+
+    def run( self, cmd, input=None ):
+        """Run a command as root, routing stderr to stdout.
+           cmd: list of command params
+           input: string to write to the command's stdin, or None
+           returns: output, exit status"""
+        args = '\0'.join( cmd )
+        data = input if input is not None else ''
+        # A negative input length means no stdin for the command
+        self.proc.stdin.write( '%d %d\n' % ( len( args ),
+            len( data ) if input is not None else -1 ) + args + data )
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline()
+        if not header:
+            raise Exception( 'root helper exited unexpectedly' )
+        status, length = [ int( field ) for field in header.split() ]
+        return self.proc.stdout.read( length ), status
+
+    def stop( self ):
+        "Shut down the helper process."
+        self.proc.stdin.close()
+        self.proc.wait()
+
+def serve( infile, outfile ):
+    """Run commands received on infile, writing results to outfile,
+       until infile is closed.
+       infile: file to read requests from
+       outfile: file to write responses to"""
+    while True:
+        header = infile.readline()
+        if not header:
+            break
+        argsLen, inputLen = [ int( field ) for field in header.split() ]
+        cmd = infile.read( argsLen ).split( '\0' )
+        input = infile.read( inputLen ) if inputLen >= 0 else None
+        output, status = runCmd( cmd, input )
+        outfile.write( '%d %d\n' % ( status, len( output ) ) + output )
+        outfile.flush()
+
+if __name__ == '__main__':
+    serve( sys.stdin, sys.stdout )
@@ -87,17 +87,20 @@ method may be called to shut down the network.
 """
 
 import os
+import pipes
 import re
-import select
 import signal
-from time import sleep
+from time import sleep, time
 
 from mininet.cli import CLI
+from mininet.futures import gather, runLimited
 from mininet.log import info, error, debug, output
 from mininet.node import Host, Switch, UserSwitch, OVSKernelSwitch, OVSKernelSwitchNew, RemoteSwitch
 from mininet.node import Controller, ControllerParams
+from mininet.pingmatrix import PingMatrix, parsePing, recordPings
+from mininet.reactor import reactor
 from mininet.util import quietRun, fixLimits
-from mininet.util import createLink, macColonHex, ipStr, ipParse
+from mininet.util import createLink, createLinks, macColonHex, ipStr, ipParse
 from mininet.term import cleanUpScreens, makeTerms
 
 class Mininet( object ):
@@ -109,7 +112,8 @@ class Mininet( object ):
                  build=True, xterms=False, cleanup=False,
                  inNamespace=False,
                  autoSetMacs=False, autoStaticArp=False, listenPort=None,
-                 defVendor=False ):
+                 defVendor=False, usePty=True, spawnLimit=64,
+                 lazyShells=False ):
         """Create Mininet object.
            topo: Topo (topology) object or None
            switch: Switch class
@@ -123,7 +127,14 @@ class Mininet( object ):
            autoSetMacs: set MAC addrs from topo?
            autoStaticArp: set all-pairs static MAC addrs?
            listenPort: base listening port to open; will be incremented for
-               each additional switch in the net if inNamespace=False"""
+               each additional switch in the net if inNamespace=False
+           usePty: give hosts a pty? If False, host shells use a socketpair,
+               which is faster and not limited by kernel.pty.max
+           spawnLimit: maximum number of node shells to start at once
+               when building from topo (1 to start them one at a time)
+           lazyShells: only start a host's shell when it first runs a
+               command? Until then, its namespace is held by an idle
+               mnexec process (see Node)"""
         self.switch = switch
         self.host = host
         self.controller = controller
@@ -136,6 +147,9 @@ class Mininet( object ):
         self.autoStaticArp = autoStaticArp
         self.listenPort = listenPort
         self.defVendor = defVendor
+        self.usePty = usePty
+        self.spawnLimit = max( spawnLimit, 1 )
+        self.lazyShells = lazyShells
 
         self.hosts = []
         self.switches = []
@@ -158,21 +172,27 @@ class Mininet( object ):
         if topo and build:
             self.build()
 
-    def addHost( self, name, mac=None, ip=None, prefix='h'):
+    def addHost( self, name, mac=None, ip=None, prefix='h', **params ):
         """Add host.
            name: name of host to add
            mac: default MAC address for intf 0
            ip: default IP address for intf 0
+           params: additional parameters for host class (e.g. waitStart)
            returns: added host"""
-        host = self.host( name, defaultMAC=mac, defaultIP=ip, prefix=prefix )
+        if self.lazyShells:
+            params.setdefault( 'lazyShell', True )
+        host = self.host( name, defaultMAC=mac, defaultIP=ip, prefix=prefix,
+                          usePty=self.usePty, **params )
         self.hosts.append( host )
         self.nameToNode[ name ] = host
         return host
 
-    def addSwitch( self, name, mac=None, ip=None, prefix='s', switchClass=None ):
+    def addSwitch( self, name, mac=None, ip=None, prefix='s', switchClass=None,
+                   **params ):
         """Add switch.
            name: name of switch to add
            mac: default MAC address for kernel/OVS switch intf 0
+           params: additional parameters for switch class (e.g. waitStart)
            returns: added switch
            side effect: increments the listenPort member variable."""
         swCl = switchClass
@@ -182,12 +202,12 @@ class Mininet( object ):
             sw = swCl( name, listenPort=self.listenPort,
                        defaultMAC=mac, defaultIP=ip, 
                        inNamespace=self.inNamespace, prefix=prefix,
-                       defVendor=self.defVendor )
+                       defVendor=self.defVendor, **params )
         else:
             sw = swCl( name, listenPort=self.listenPort,
                        defaultMAC=mac, defaultIP=ip, dp=self.dps,
                        inNamespace=self.inNamespace , prefix=prefix,
-                       defVendor=self.defVendor )
+                       defVendor=self.defVendor, **params )
         if not self.inNamespace and self.listenPort:
             self.listenPort += 1
         self.dps += 1
@@ -255,9 +275,12 @@ class Mininet( object ):
         info( controller.name + ' <->' )
         cip = ip
         snum = ipParse( ip )
+        cintfs, sintfs = [], []
         for switch in self.switches:
             info( ' ' + switch.name )
             sintf, cintf = createLink( switch, controller )
+            cintfs.append( cintf )
+            sintfs.append( sintf )
             snum += 1
             while snum & 0xff in [ 0, 255 ]:
                 snum += 1
@@ -268,28 +291,82 @@ class Mininet( object ):
             switch.setHostRoute( cip, sintf )
         info( '\n' )
         info( '*** Testing control network\n' )
-        while not controller.intfIsUp( cintf ):
-            info( '*** Waiting for', cintf, 'to come up\n' )
-            sleep( 1 )
-        for switch in self.switches:
-            while not switch.intfIsUp( sintf ):
-                info( '*** Waiting for', sintf, 'to come up\n' )
-                sleep( 1 )
+        # Wait for the kernel to report each link up, rather than polling
+        info( '*** Waiting for control interfaces to come up\n' )
+        controller.waitLinkState( cintfs, 'up' )
+        for switch, sintf in zip( self.switches, sintfs ):
+            switch.waitLinkState( [ sintf ], 'up' )
             if self.ping( hosts=[ switch, controller ] ) != 0:
                 error( '*** Error: control network test failed\n' )
                 exit( 1 )
         info( '\n' )
 
+    @staticmethod
+    def waitStarted( nodes, limit=0 ):
+        """Wait for node shells to start, reading their pids via
+           the shared reactor.
+           nodes: list of nodes whose shells are starting
+           limit: return once at most this many are still starting
+           returns: list of nodes which are still starting"""
+        starting = set( node for node in nodes if node.pid is None )
+        while len( starting ) > limit:
+            for node in reactor.ready( starting ):
+                node.readItems( 0 )
+                if node.pid is None and not node.shellAlive():
+                    # Let the node report the error
+                    node.waitStarted()
+                if node.pid is not None:
+                    starting.discard( node )
+        return list( starting )
+
+    @staticmethod
+    def runBatches( batches, limit=0 ):
+        """Run a list of commands on each of several nodes concurrently:
+           send all of the commands, then collect their results via the
+           shared reactor. Each node runs its own commands in order.
+           batches: list of ( node, cmds ), with at most one per node
+           limit: maximum number of nodes running commands at once,
+                  or 0 for no limit
+           returns: dict of node -> list of outputs, one per command"""
+        waiting = set()
+        pending = list( reversed( batches ) )
+        while pending or waiting:
+            while pending and ( not limit or len( waiting ) < limit ):
+                node, cmds = pending.pop()
+                node.sendBatch( cmds )
+                waiting.add( node )
+            for node in reactor.ready( waiting ):
+                node.readBatch( 0 )
+                if not node.waiting:
+                    waiting.discard( node )
+        return dict( ( node, node.waitBatch() ) for node, _cmds in batches )
+
     def configHosts( self ):
         "Configure a set of hosts."
         # params were: hosts, ips
+        batches = []
+        ipCmds = {}  # number of setIP commands in each host's batch
         for host in self.hosts:
             hintf = host.intfs[ 0 ]
-            host.setIP( hintf, host.defaultIP, self.cparams.prefixLen )
-            host.setDefaultRoute( hintf )
-            # You're low priority, dude!
-            quietRun( 'renice +18 -p ' + repr( host.pid ) )
+            if host.nlSocket():
+                host.setIP( hintf, host.defaultIP, self.cparams.prefixLen )
+                host.setDefaultRoute( hintf )
+            else:
+                # Configure the hosts' shells concurrently
+                cmds = host.setIPCmds( hintf, host.defaultIP,
+                                       self.cparams.prefixLen )
+                ipCmds[ host ] = len( cmds )
+                batches.append( ( host,
+                                  cmds + host.setDefaultRouteCmds( hintf ) ) )
             info( host.name + ' ' )
+        for host, outputs in self.runBatches( batches ).iteritems():
+            # As setIP() does, only cache addresses which were set
+            if not ''.join( outputs[ :ipCmds[ host ] ] ):
+                host.ips[ host.intfs[ 0 ] ] = host.defaultIP
+        # You're low priority, dude!
+        if self.hosts:
+            quietRun( 'renice +18 -p ' +
+                      ' '.join( repr( host.pid ) for host in self.hosts ) )
         info( '\n' )
 
     def buildFromTopo( self, topo ):
@@ -297,12 +374,28 @@ class Mininet( object ):
            At the end of this function, everything should be connected
            and up."""
 
+        # Node shells are started in parallel: we launch up to
+        # spawnLimit of them and then collect their pids as they start
+        starting = []
+        spawnTimes = []  # times to start a few nodes on their own
+
         def addNode( prefix, addMethod, nodeId ):
             "Add a host or a switch."
             name = prefix + topo.name( nodeId )
             mac = macColonHex( nodeId ) if self.setMacs else None
             ip = topo.ip( nodeId )
-            node = addMethod( name, mac=mac, ip=ip )
+            if len( starting ) >= self.spawnLimit:
+                starting[ : ] = self.waitStarted( starting,
+                                                  self.spawnLimit - 1 )
+            start = time()
+            node = addMethod( name, mac=mac, ip=ip, waitStart=False )
+            if len( spawnTimes ) < 3:
+                # Time the first few nodes on their own, to estimate
+                # the time a serial build would take
+                node.waitStarted()
+                spawnTimes.append( time() - start )
+            else:
+                starting.append( node )
             self.idToNode[ nodeId ] = node
             info( name + ' ' )
 
@@ -315,6 +408,7 @@ class Mininet( object ):
         self.addController( 'c0' )
         info( '*** Creating network\n' )
         info( '*** Adding hosts:\n' )
+        spawnStart = time()
         for hostId in sorted( topo.hosts() ):
             node_info = topo.node_info [ hostId ]
             prefix = node_info.prefix
@@ -326,11 +420,29 @@ class Mininet( object ):
             prefix = switch_info.prefix
             addNode( prefix, self.addSwitch, switchId )
             #addNode( 's', self.addSwitch, switchId )
+        self.waitStarted( starting )
+        count = len( self.idToNode )
+        if count:
+            serial = count * sum( spawnTimes ) / len( spawnTimes )
+            info( '\n*** Started %i nodes in %.2fs '
+                  '(estimated %.2fs serially)' %
+                  ( count, time() - spawnStart, serial ) )
+        def intfMAC( node, port ):
+            "Return the MAC to create an interface with, if any."
+            if self.autoSetMacs and isinstance( node, Host ) and port == 0:
+                return node.defaultMAC
+
         info( '\n*** Adding links:\n' )
+        # Create all of the links at once
+        links = []
         for srcId, dstId in sorted( topo.edges() ):
             src, dst = self.idToNode[ srcId ], self.idToNode[ dstId ]
             srcPort, dstPort = topo.port( srcId, dstId )
-            createLink( src, dst, srcPort, dstPort )
+            params = dict( mac1=intfMAC( src, srcPort ),
+                           mac2=intfMAC( dst, dstPort ) )
+            links.append( ( src, dst, srcPort, dstPort, params ) )
+        createLinks( links )
+        for src, dst, _srcPort, _dstPort, _params in links:
             info( '(%s, %s) ' % ( src.name, dst.name ) )
         info( '\n' )
 
@@ -369,28 +481,106 @@ class Mininet( object ):
     def setMacs( self ):
         """Set MAC addrs to correspond to default MACs on hosts.
            Assume that the host only has one interface."""
+        batches = []
         for host in self.hosts:
-            host.setMAC( host.intfs[ 0 ], host.defaultMAC )
-
-    def staticArp( self ):
-        "Add all-pairs ARP entries to remove the need to handle broadcast."
+            intf = host.intfs[ 0 ]
+            # Skip interfaces which were created with the right MAC
+            if host.macs.get( intf ) == host.defaultMAC:
+                continue
+            if host.nlSocket():
+                host.setMAC( intf, host.defaultMAC )
+            else:
+                batches.append( ( host,
+                                  host.setMACCmds( intf, host.defaultMAC ) ) )
+        for host, outputs in self.runBatches( batches ).iteritems():
+            if not ''.join( outputs ):
+                host.macs[ host.intfs[ 0 ] ] = host.defaultMAC
+
+    def staticArp( self, hosts=None ):
+        """Add all-pairs ARP entries to remove the need to handle broadcast.
+           hosts: only add entries to and from these hosts (default: all)"""
+        # Collect the address table once, then load each host's
+        # neighbor table in one operation, concurrently across hosts
+        addrs = dict( ( host, ( host.IP(), host.MAC() ) )
+                      for host in self.hosts )
+        updated = self.hosts if hosts is None else hosts
+        isUpdated = set( updated )
+        batches = []
         for src in self.hosts:
-            for dst in self.hosts:
-                if src != dst:
-                    src.setARP( ip=dst.IP(), mac=dst.MAC() )
-
-    def start( self ):
-        "Start controller and switches."
+            dsts = self.hosts if src in isUpdated else updated
+            entries = [ addrs[ dst ] for dst in dsts if dst != src ]
+            if not entries:
+                continue
+            if src.nlSocket():
+                # The kernel handles netlink requests synchronously,
+                # so there is nothing to gain from overlapping them
+                result = src.setARPs( entries )
+                if result:
+                    error( '*** Error: %s: %s' % ( src.name, result ) )
+            else:
+                batches.append( ( src, src.setARPsCmds( entries ) ) )
+        for src, outputs in self.runBatches( batches ).iteritems():
+            if ''.join( outputs ):
+                error( '*** Error: %s: %s' % ( src.name, ''.join( outputs ) ) )
+
+    def start( self, wait=False, timeout=None ):
+        """Start controller and switches.
+           wait: wait until the controllers are listening before starting
+                 the switches, and until the switches are connected
+                 before returning (see waitConnected())
+           timeout: seconds to wait for each, or None to wait indefinitely"""
         if not self.built:
             self.build()
         info( '*** Starting controller\n' )
         for controller in self.controllers:
             controller.start()
+        if wait:
+            # Switches which find no controller back off before retrying
+            self.waitConnected( timeout, switches=[] )
         info( '*** Starting %s switches\n' % len( self.switches ) )
+        # Each switch class gets to start all of its switches at once
+        classes, byClass = [], {}
         for switch in self.switches:
             info( switch.name + ' ')
-            switch.start( self.controllers )
+            if type( switch ) not in byClass:
+                classes.append( type( switch ) )
+                byClass[ type( switch ) ] = []
+            byClass[ type( switch ) ].append( switch )
+        for cls in classes:
+            cls.batchStartup( byClass[ cls ], self.controllers )
         info( '\n' )
+        if wait:
+            self.waitConnected( timeout )
+
+    def waitConnected( self, timeout=None, switches=None ):
+        """Wait until the network is ready: every controller is listening,
+           and every switch is connected to a controller (see
+           Controller.listening() and Switch.connected()).
+           timeout: seconds to wait, or None to wait indefinitely
+           switches: switches to wait for (default: all of them)
+           returns: True if the network is ready, False on timeout"""
+        if switches is None:
+            switches = self.switches
+        info( '*** Waiting for %i controllers and %i switches\n' %
+              ( len( self.controllers ), len( switches ) ) )
+        controllers = list( self.controllers )
+        switches = list( switches )
+        deadline = None if timeout is None else time() + timeout
+        delay = .001
+        while True:
+            controllers = [ c for c in controllers if not c.listening() ]
+            if not controllers:
+                switches = [ s for s in switches
+                             if not s.connected( self.controllers ) ]
+                if not switches:
+                    return True
+            if deadline is not None and time() > deadline:
+                error( '*** Error: timed out waiting for %s\n' %
+                       ' '.join( node.name
+                                 for node in controllers + switches ) )
+                return False
+            sleep( delay )
+            delay = min( 2 * delay, .1 )
 
     def stop( self ):
         "Stop the controller(s), switches and hosts"
@@ -422,73 +612,95 @@ class Mininet( object ):
 
     def monitor( self, hosts=None, timeoutms=-1 ):
         """Monitor a set of hosts (or all hosts by default),
-           and return their output, a line at a time.
+           and return their output, a line at a time. Lines which
+           have been read from several hosts are returned in the
+           order they were read.
            hosts: (optional) set of hosts to monitor
            timeoutms: (optional) timeout value in ms
            returns: iterator which returns host, line"""
         if hosts is None:
             hosts = self.hosts
-        poller = select.poll()
-        Node = hosts[ 0 ]  # so we can call class method fdToNode
-        for host in hosts:
-            poller.register( host.stdout )
+        hosts = set( hosts )
         while True:
-            ready = poller.poll( timeoutms )
-            for fd, event in ready:
-                host = Node.fdToNode( fd )
-                if event & select.POLLIN:
-                    line = host.readline()
-                    if line is not None:
-                        yield host, line
+            lines = []
+            for host in reactor.pending.intersection( hosts ):
+                entry = host.readline( timestamp=True )
+                while entry is not None:
+                    lines.append( ( entry[ 0 ], host, entry[ 1 ] ) )
+                    entry = host.readline( timestamp=True )
+            if lines:
+                lines.sort( key=lambda line: line[ 0 ] )
+                for _stamp, host, line in lines:
+                    yield host, line
+                continue
+            ready = reactor.poll( timeoutms )
             # Return if non-blocking
             if not ready and timeoutms >= 0:
                 yield None, None
 
+    _parsePing = staticmethod( parsePing )
+
     @staticmethod
-    def _parsePing( pingOutput ):
-        "Parse ping output and return packets sent, received."
-        # Check for downed link
-        if 'connect: Network is unreachable' in pingOutput:
-            return (1, 0)
-        r = r'(\d+) packets transmitted, (\d+) received'
-        m = re.search( r, pingOutput )
-        if m == None:
-            error( '*** Error: could not parse ping output: %s\n' %
-                     pingOutput )
-            return (1, 0)
-        sent, received = int( m.group( 1 ) ), int( m.group( 2 ) )
-        return sent, received
+    def _pingAllCmd( dests, numPerPing, fanout ):
+        """Return a shell command which pings a list of destinations,
+           running up to fanout pings at once. Each ping's output is
+           printed as a single line, prefixed by its destination's key,
+           so that the lines of concurrent pings can't interleave.
+           dests: list of ( key, ip )
+           numPerPing: number of packets per ping
+           fanout: maximum number of concurrent pings"""
+        ping = ( 'echo "$0 $(ping -c%d -W 1 $1 2>&1 | tr \'\\n\' \' \')"' %
+                 numPerPing )
+        return ( 'xargs -P %d -n 2 sh -c %s <<EOF\n%s\nEOF' %
+                 ( fanout, pipes.quote( ping ),
+                   '\n'.join( '%s %s' % dest for dest in dests ) ) )
+
+    def apingMatrix( self, hosts=None, numPerPing=1, fanout=16,
+                     maxHosts=64 ):
+        """Start pinging between all specified hosts concurrently, as
+           pingMatrix() does, without waiting for the results.
+           returns: future for a PingMatrix"""
+        if not hosts:
+            hosts = self.hosts
+        matrix = PingMatrix( [ host.name for host in hosts ] )
+        ips = [ host.IP() for host in hosts ]
+
+        def pingFrom( src ):
+            "Ping all other hosts from hosts[ src ]."
+            dests = [ ( dst, ip ) for dst, ip in enumerate( ips )
+                      if dst != src ]
+            return hosts[ src ].acmd(
+                self._pingAllCmd( dests, numPerPing, fanout ) ).then(
+                lambda result: recordPings( matrix, src, result ) )
+
+        sources = range( len( hosts ) ) if len( hosts ) > 1 else []
+        return runLimited( pingFrom, sources, maxHosts ).then(
+            lambda _results: matrix )
+
+    def pingMatrix( self, hosts=None, numPerPing=1, fanout=16,
+                    maxHosts=64 ):
+        """Ping between all specified hosts concurrently: each host
+           pings all of the others in parallel, and the results are
+           gathered with a single poller.
+           hosts: list of hosts (default: all hosts)
+           numPerPing: number of packets per ping
+           fanout: maximum number of concurrent pings per host
+           maxHosts: maximum number of hosts pinging at once
+           returns: PingMatrix with the results"""
+        return self.apingMatrix( hosts, numPerPing, fanout,
+                                 maxHosts ).result()
 
     def ping( self, hosts=None, numPerPing=1 ):
         """Ping between all specified hosts.
            hosts: list of hosts
            returns: ploss packet loss percentage"""
         # should we check if running?
-        packets = 0
-        lost = 0
-        ploss = None
         if not hosts:
             hosts = self.hosts
             output( '*** Ping: testing ping reachability\n' )
-        for node in hosts:
-            output( '%s -> ' % node.name )
-            for dest in hosts:
-                if node != dest:
-                    result = node.cmd( 'ping -c%d -W 1 %s' % (numPerPing, dest.IP()) )
-                    sent, received = self._parsePing( result )
-                    packets += sent
-                    if received > sent:
-                        error( '*** Error: received too many packets' )
-                        error( '%s' % result )
-                        node.cmdPrint( 'route' )
-                        exit( 1 )
-                    lost += sent - received
-                    output( ( '%s ' % dest.name ) if received else 'X ' )
-            output( '\n' )
-            ploss = 100 * lost / packets
-        output( "*** Results: %i%% dropped (%d/%d lost)\n" %
-                ( ploss, lost, packets ) )
-        return ploss
+        matrix = self.pingMatrix( hosts, numPerPing=numPerPing )
+        output( matrix.summary() )
+        return matrix.loss()
 
     def pingAll( self, numPerPing=1):
         """Ping between all hosts.
@@ -523,76 +735,139 @@ class Mininet( object ):
             return "OK"
         return "?"
         
-    _listenRegex = re.compile("LISTENING")
+    @staticmethod
+    def _parseTcpResults( output ):
+        """Parse the output of mn-tcptest-srv.py or mn-tcptest-cli.py.
+           output: lines of 'key result'
+           returns: dict of key -> result code"""
+        results = {}
+        for line in output.splitlines():
+            key, _, result = line.partition( ' ' )
+            if result:
+                results[ key ] = Mininet._parseTcpOutput( result )
+        return results
+
     def tcptest( self, hosts=None, timeout=2 ):
         """TCP reachability test
            hosts: list of hosts. 
            timeout: TCP connection and read timeout in seconds
            returns: percentage of unsuccessful connections"""
+        return self.atcptest( hosts, timeout ).result()
+
+    def atcptest( self, hosts=None, timeout=2 ):
+        """Start a TCP reachability test, as tcptest() does, without
+           waiting for the results.
+           returns: future for the percentage of unsuccessful connections"""
         # We use custom TCP server and clients. We don't use netcat since 
         # netcat lacks the ability to fine-tune timeouts and to have 
         # time-outs < 1sec. We want both so we can fail-fast.
         #
-        # We also use a new TCP port for each test. This way we are really sure
-        # we are talking to the right endpoint. Alternatively we could also 
-        # send a magic number / token in the TCP payload....
+        # Each host runs a single server, which listens on one port per
+        # source host, and a single client, which connects to all of the
+        # other hosts at once; all hosts run them concurrently, so the
+        # whole test takes roughly one timeout period.
+        #
+        # We also use new TCP ports for each test. This way we are really
+        # sure we are talking to the right endpoint. Alternatively we could
+        # also send a magic number / token in the TCP payload....
         #
         # TODO: We use fairly low timeouts at the moment. If we find
         # intermittant errors we might have to use long timeouts
 
         # should we check if running?
-        total = 0
-        success = 0 
         if not hosts:
             hosts = self.hosts
             output( '*** TCP: testing TCP reachability\n' )
-        for node in hosts:
-            output( '%s -> ' % node.name )
-            for dest in hosts:
-                if node != dest:
-                    total += 1
-
-                    #
-                    # Use a larger timeout for the server, as we do not want
-                    # the server to timeout before the client gets a chance
-                    # send the packets.
-                    #
-                    srvResult = dest.sendCmd("mn-tcptest-srv.py %f %d" % (timeout * 10, self.curTcpPort))
-                    dest.waitOutput(pattern = self._listenRegex)
-                    cliResult = node.cmd( 'mn-tcptest-cli.py %f %s %d' % (timeout, dest.IP(), self.curTcpPort) )
-                    sleep(0.01)
-                    # Make sure server process is done. Need the sleep to give the 
-                    # server time to terminate
-                    dest.sendInt()
-                    if dest.waiting:
-                        # could be false if the early waitOutput call
-                        # retunred an error
-                        srvResult = dest.waitOutput()
-                    cliResult = self._parseTcpOutput(cliResult)
-                    srvResult = self._parseTcpOutput(srvResult)
-                    if cliResult == "OK" and srvResult == "OK":
-                        # everything ok
-                        resCode = dest.name
-                        success += 1
-                    elif cliResult != "OK" and srvResult != "OK":
-                        # error from both. That's what we expect
-                        resCode = cliResult
-                    else:
-                        # Weird. Only one error? 
-                        resCode = cliResult + srvResult
-                        resCode = resCode.replace("OK","O")
-
-                    output( '%s ' % resCode ) 
-
-                    self.curTcpPort += 1
-                    if (self.curTcpPort > self.maxTcpPort):
-                        self.curTcpPort = self.minTcpPort
-            output( '\n' )
-
-        ploss = 100 * (total-success) / total
-        output( "*** Results: %i%% unsuccessful (%d/%d lost)\n" %
-                ( ploss, (total-success), total ) )
-        return ploss
+        count = len( hosts )
+        ports = []
+        for _host in hosts:
+            ports.append( self.curTcpPort )
+            self.curTcpPort += 1
+            if (self.curTcpPort > self.maxTcpPort):
+                self.curTcpPort = self.minTcpPort
+        ips = [ host.IP() for host in hosts ]
+        outfiles = [ '/tmp/mn-tcptest-%d-%s.out' % ( os.getpid(), host.name )
+                     for host in hosts ]
+
+        def startClients( servers ):
+            "Once all servers are listening, run all clients."
+            serverPids = {}
+            for d, dest in enumerate( hosts ):
+                m = re.search( r'LISTENING (\d+)', servers[ d ] )
+                if m:
+                    serverPids[ d ] = int( m.group( 1 ) )
+                else:
+                    error( '*** Error: %s: could not start TCP server: %s\n'
+                           % ( dest.name, servers[ d ] ) )
+            return gather( [
+                node.acmd( 'mn-tcptest-cli.py %f %s' % ( timeout, ' '.join(
+                    '%s:%d' % ( ips[ d ], ports[ s ] )
+                    for d in range( count ) if d != s ) ) )
+                for s, node in enumerate( hosts ) ] ).then(
+                lambda clients: stopServers( serverPids, clients ) )
+
+        def stopServers( serverPids, clients ):
+            "Stop the servers and collect their results."
+            # Once told to stop, the servers only wait for connections
+            # which are still transferring data, and then move their
+            # results into place
+            dests = sorted( serverPids )
+            return gather( [
+                hosts[ d ].acmd(
+                    'kill %d; while [ ! -e %s ] && kill -0 %d 2>/dev/null; '
+                    'do sleep 0.01; done; cat %s; rm -f %s %s.part' % (
+                        serverPids[ d ], outfiles[ d ], serverPids[ d ],
+                        outfiles[ d ], outfiles[ d ], outfiles[ d ] ) )
+                for d in dests ] ).then(
+                lambda stops: report( clients, dict( zip( dests, stops ) ) ) )
+
+        def report( clients, stops ):
+            "Print and return the results."
+            srvResults = dict( ( d, self._parseTcpResults( out ) )
+                               for d, out in stops.items() )
+            total = 0
+            success = 0 
+            for s, node in enumerate( hosts ):
+                output( '%s -> ' % node.name )
+                cliResults = self._parseTcpResults( clients[ s ] )
+                for d, dest in enumerate( hosts ):
+                    if node != dest:
+                        total += 1
+                        cliResult = cliResults.get(
+                            '%s:%d' % ( ips[ d ], ports[ s ] ), '?' )
+                        srvResult = srvResults.get( d, {} ).get(
+                            str( ports[ s ] ), '?' )
+                        if cliResult == "OK" and srvResult == "OK":
+                            # everything ok
+                            resCode = dest.name
+                            success += 1
+                        elif cliResult != "OK" and srvResult != "OK":
+                            # error from both. That's what we expect
+                            resCode = cliResult
+                        else:
+                            # Weird. Only one error? 
+                            resCode = cliResult + srvResult
+                            resCode = resCode.replace("OK","O")
+
+                        output( '%s ' % resCode ) 
+                output( '\n' )
+
+            ploss = 100 * (total-success) / total
+            output( "*** Results: %i%% unsuccessful (%d/%d lost)\n" %
+                    ( ploss, (total-success), total ) )
+            return ploss
+
+        # Start the servers; each one goes into the background once it
+        # is listening on all of its ports.
+        # Use a larger timeout for the servers, as we do not want
+        # a server to timeout before the clients get a chance
+        # send the packets.
+        return gather( [
+            dest.acmd( 'mn-tcptest-srv.py -o %s %f %s' % (
+                outfiles[ d ], timeout * 10,
+                ' '.join( str( ports[ s ] ) for s in range( count )
+                          if s != d ) ) )
+            for d, dest in enumerate( hosts ) ] ).then( startClients )
 
 
     @staticmethod
@@ -614,9 +889,6 @@ class Mininet( object ):
            hosts: list of hosts; if None, uses opposite hosts
            l4Type: string, one of [ TCP, UDP ]
            returns: results two-element array of server and client speeds"""
-        if not quietRun( 'which telnet' ):
-            error( 'Cannot find telnet in $PATH - required for iperf test' )
-            return
         if not hosts:
             hosts = [ self.hosts[ 0 ], self.hosts[ -1 ] ]
         else:
@@ -632,19 +904,18 @@ class Mininet( object ):
             bwArgs = '-b ' + udpBw + ' '
         elif l4Type != 'TCP':
             raise Exception( 'Unexpected l4 type: %s' % l4Type )
-        server.sendCmd( iperfArgs + '-s', printPid=True )
-        servout = ''
-        while server.lastPid is None:
-            servout += server.monitor()
-        while 'Connected' not in client.cmd(
-            'sh -c "echo A | telnet -e A %s 5001"' % server.IP()):
-            output('waiting for iperf to start up')
-            sleep(.5)
+        # The server runs outside of the server host's shell
+        serverProc = server.popen( iperfArgs + '-s' )
+        if not server.waitListening( 5001, udp=( l4Type == 'UDP' ),
+                                     timeout=10 ):
+            error( '*** Error: iperf server on %s did not start\n' %
+                   server.name )
         cliout = client.cmd( iperfArgs + '-t 5 -c ' + server.IP() + ' ' +
                            bwArgs )
         debug( 'Client output: %s\n' % cliout )
-        server.sendInt()
-        servout += server.waitOutput()
+        serverProc.send_signal( signal.SIGINT )
+        servout = serverProc.stdout.read()
+        serverProc.wait()
         debug( 'Server output: %s\n' % servout )
         result = [ self._parseIperf( servout ), self._parseIperf( cliout ) ]
         if l4Type == 'UDP':
@@ -652,6 +923,111 @@ class Mininet( object ):
         output( '*** Results: %s\n' % result )
         return result
 
+    @staticmethod
+    def _parseIperfRate( iperfOutput ):
+        """Parse iperf output and return the last reported bandwidth.
+           iperfOutput: string
+           returns: bandwidth in bits/sec, or None"""
+        m = re.findall( r'([\d\.]+) ([KMG]?)bits/sec', iperfOutput )
+        if not m:
+            return None
+        rate, prefix = m[ -1 ]
+        return float( rate ) * { '': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9 }[ prefix ]
+
+    def iperfMulti( self, pairs, l4Type='TCP', udpBw='10M', seconds=5,
+                    port=5001 ):
+        """Run iperf between several pairs of hosts at once.
+           pairs: list of ( client, server ) hosts
+           l4Type: string, one of [ TCP, UDP ]
+           udpBw: UDP bandwidth of each client
+           seconds: duration of the test
+           port: port of the first pair's server; pair i uses port + i
+           returns: list of the pairs' bandwidths in bits/sec (None for
+                    pairs that failed), and their aggregate bandwidth"""
+        return self.aiperfMulti( pairs, l4Type, udpBw, seconds,
+                                 port ).result()
+
+    def aiperfMulti( self, pairs, l4Type='TCP', udpBw='10M', seconds=5,
+                     port=5001 ):
+        """Start running iperf between several pairs of hosts, as
+           iperfMulti() does, without waiting for the results.
+           returns: future for the pairs' bandwidths and their aggregate"""
+        iperfArgs = 'iperf '
+        bwArgs = ''
+        if l4Type == 'UDP':
+            iperfArgs += '-u '
+            bwArgs = '-b ' + udpBw + ' '
+        elif l4Type != 'TCP':
+            raise Exception( 'Unexpected l4 type: %s' % l4Type )
+        output( '*** Iperf: testing %s bandwidth between %d pairs\n' %
+                ( l4Type, len( pairs ) ) )
+        servers, clients = {}, {}
+        for i, ( client, server ) in enumerate( pairs ):
+            servers.setdefault( server, [] ).append( port + i )
+            clients.setdefault( client, [] ).append(
+                ( i, server.IP(), port + i ) )
+        servers, clients = servers.items(), clients.items()
+
+        def startClients( started ):
+            "Once the servers are listening, run all clients."
+            # The servers' shells have already returned, so we check
+            # the servers' sockets directly; they are usually ready by now
+            for server, ports in servers:
+                for p in ports:
+                    if not server.waitListening( p, udp=( l4Type == 'UDP' ),
+                                                 timeout=10 ):
+                        error( '*** Error: iperf server on %s:%d did not '
+                               'start\n' % ( server.name, p ) )
+            serverPids = [ ' '.join( re.findall( r'^(\d+)\s*$', out, re.M ) )
+                           for out in started ]
+            # Each client host runs all of its clients at once; each
+            # client's output is printed as a single line, prefixed by
+            # its pair index. We only wait for the clients, as the host
+            # may also be running servers in the background
+            cmd = ( 'echo "%d $(' + iperfArgs + '-t %d -c %s -p %d ' +
+                    bwArgs + '2>&1 | tr \'\\n\' \' \')" & '
+                    '__mnpids="$__mnpids $!"; ' )
+            return gather( [
+                client.acmd( '__mnpids=; ' +
+                             ''.join( cmd % ( i, seconds, ip, p )
+                                      for i, ip, p in tests ) +
+                             'wait $__mnpids' )
+                for client, tests in clients ] ).then(
+                lambda results: stopServers( serverPids, results ) )
+
+        def stopServers( serverPids, results ):
+            "Stop the servers."
+            # We wait for them so that the shells' job notices don't
+            # end up in later commands' output
+            return gather( [
+                server.acmd( 'kill %s; wait %s' % ( pids, pids ) )
+                for ( server, _ports ), pids in zip( servers, serverPids )
+                if pids ] ).then( lambda _stops: report( results ) )
+
+        def report( results ):
+            "Print and return the results."
+            rates = [ None ] * len( pairs )
+            for out in results:
+                debug( 'Client output: %s\n' % out )
+                for line in out.splitlines():
+                    key, _, result = line.partition( ' ' )
+                    if key.isdigit():
+                        rates[ int( key ) ] = self._parseIperfRate( result )
+            total = sum( rate for rate in rates if rate )
+            for ( client, server ), rate in zip( pairs, rates ):
+                output( '%s -> %s: %s\n' % ( client.name, server.name,
+                        '%.2f Mbits/sec' % ( rate / 1e6 ) if rate is not None
+                        else 'failed' ) )
+            output( '*** Results: %.2f Mbits/sec aggregate\n' %
+                    ( total / 1e6 ) )
+            return rates, total
+
+        # Start all of the servers in the background
+        return gather( [
+            server.acmd( ''.join( '%s-s -p %d >/dev/null 2>&1 & echo $!; ' %
+                                  ( iperfArgs, p ) for p in ports ) )
+            for server, ports in servers ] ).then( startClients )
+
     def configLinkStatus( self, src, dst, status ):
         """Change status of src <-> dst links.
            src: node name
@@ -667,13 +1043,16 @@ class Mininet( object ):
             if len( connections ) == 0:
                 error( 'src and dst not connected: %s %s\n' % ( src, dst) )
             for srcIntf, dstIntf in connections:
-                result = srcNode.cmd( 'ifconfig', srcIntf, status )
+                result = srcNode.setIntfStatus( srcIntf, status )
                 if result:
                     error( 'link src status change failed: %s\n' % result )
-                result = dstNode.cmd( 'ifconfig', dstIntf, status )
+                result = dstNode.setIntfStatus( dstIntf, status )
                 if result:
                     error( 'link dst status change failed: %s\n' % result )
 
+    # Switches which can add and remove ports while running
+    hotplugSwitches = ( OVSKernelSwitch, OVSKernelSwitchNew, UserSwitch )
+
     def attachHost( self, hostName, switchName ):
         if hostName not in self.nameToNode:
             error( 'host not in network: %s\n' % hostName )
@@ -693,8 +1072,8 @@ class Mininet( object ):
             error('%s is not a switch' % switchName)
             return
             
-        if not isinstance(sw, OVSKernelSwitch) and not isinstance(sw, OVSKernelSwitchNew):
-            error('attachHost only works with OVS kernel switches')
+        if not isinstance( sw, self.hotplugSwitches ):
+            error( 'attachHost only works with OVS kernel and user switches' )
             return
             
         hostIntf, swIntf = host.linkTo(sw)
@@ -703,11 +1082,8 @@ class Mininet( object ):
         host.setDefaultRoute( hostIntf )
         if self.autoSetMacs:
             host.setMAC( hostIntf, host.defaultMAC )
-        #if self.autoStaticArp:
-        #    for h in self.hosts:
-        #        if h != host:
-        #            host.setARP( ip=h.IP(), mac=h.MAC() )
-        #            h.setARP( ip=host.IP(), mac=host.MAC() )
+        if self.autoStaticArp:
+            self.staticArp( hosts=[ host ] )
 
     
     def detachHost( self, hostName, switchName=None ):
@@ -730,8 +1106,9 @@ class Mininet( object ):
                 error('%s is not a switch' % switchName)
                 return
                 
-            if not isinstance(sw, OVSKernelSwitch) and not isinstance(sw, OVSKernelSwitchNew):
-                error('attachHost only works with OVS kernel switches')
+            if not isinstance( sw, self.hotplugSwitches ):
+                error( 'detachHost only works with OVS kernel and user '
+                       'switches' )
                 return
         else:
             sw = None
@@ -0,0 +1,622 @@
+"""
+Minimal rtnetlink client for Mininet.
+
+Setting up a link with ip(8) and ifconfig(8) costs several processes:
+deleting stale interfaces, creating the veth pair, moving each end into
+its namespace, and setting its MAC address, IP address and state. The
+kernel can do all of this from a handful of rtnetlink messages, so this
+module speaks rtnetlink directly over an AF_NETLINK socket:
+
+- a veth pair is created with each end placed directly in its node's
+  namespace (IFLA_NET_NS_PID), with its MAC address and MTU set, in a
+  single RTM_NEWLINK message;
+
+- a NetlinkSocket may be opened inside a node's network namespace (via
+  setns(2)), so that addresses, routes and link state can be changed
+  without running a command in the node's shell;
+
+- messages are sent in batches, with one send() and one ack per message;
+
+- a LinkMonitor subscribes to the kernel's link events (RTNLGRP_LINK)
+  in a namespace and tracks the state of every link there, so that we
+  can wait for links to come up (or go down) without polling, and pass
+  the changes to callbacks.
+
+Only the messages Mininet needs are implemented. Everything here needs
+CAP_NET_ADMIN; when we don't have it, available() returns False and
+callers fall back to ip(8) and ifconfig(8).
+"""
+
+import ctypes
+import os
+import select
+import socket
+import struct
+from errno import ENODEV, ENOBUFS, EINTR
+from time import time
+
+# Netlink constants (linux/netlink.h, linux/rtnetlink.h, linux/if_link.h)
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_SETLINK = 19
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+RTM_NEWNEIGH = 28
+
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFLA_LINKINFO = 18
+IFLA_NET_NS_PID = 19
+IFLA_INFO_KIND = 1
+IFLA_INFO_DATA = 2
+VETH_INFO_PEER = 1
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_BROADCAST = 4
+
+RTA_DST = 1
+RTA_OIF = 4
+
+NDA_DST = 1
+NDA_LLADDR = 2
+NUD_PERMANENT = 0x80
+
+RT_TABLE_MAIN = 254
+RTPROT_BOOT = 3
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_LINK = 253
+RTN_UNICAST = 1
+
+IFF_UP = 0x1
+IFF_RUNNING = 0x40
+
+# Multicast group bitmask for RTNLGRP_LINK
+RTMGRP_LINK = 0x1
+
+CLONE_NEWNET = 0x40000000
+
+NLMSGHDR = struct.Struct( '=IHHII' )  # len, type, flags, seq, pid
+IFINFOMSG = struct.Struct( '=BxHiII' )  # family, type, index, flags, change
+IFADDRMSG = struct.Struct( '=BBBBI' )  # family, prefixlen, flags, scope, index
+RTMSG = struct.Struct( '=BBBBBBBBI' )
+NDMSG = struct.Struct( '=BxxxiHBB' )  # family, index, state, flags, type
+RTATTR = struct.Struct( '=HH' )  # len, type
+
+# Maximum number of messages per send(); this keeps the acks from
+# overflowing the socket's receive buffer
+BATCHSIZE = 256
+
+class NetlinkError( Exception ):
+    "An rtnetlink request failed."
+
+    def __init__( self, errno, msg='' ):
+        Exception.__init__( self, '%s%s' % ( msg and msg + ': ',
+                                             os.strerror( errno ) ) )
+        self.errno = errno
+
+def _align( length ):
+    "Round length up to a multiple of 4."
+    return ( length + 3 ) & ~3
+
+def attr( atype, data ):
+    """Encode a netlink attribute.
+       atype: attribute type
+       data: attribute payload (string)"""
+    length = RTATTR.size + len( data )
+    return ( RTATTR.pack( length, atype ) + data +
+             '\0' * ( _align( length ) - length ) )
+
+def parseAttrs( data ):
+    """Decode a sequence of netlink attributes.
+       data: string of encoded attributes
+       returns: dict of attribute type -> payload"""
+    attrs, offset = {}, 0
+    while offset + RTATTR.size <= len( data ):
+        length, atype = RTATTR.unpack_from( data, offset )
+        if length < RTATTR.size:
+            break
+        attrs[ atype ] = data[ offset + RTATTR.size:offset + length ]
+        offset += _align( length )
+    return attrs
+
+def macBytes( mac ):
+    "Convert a colon-hex MAC address string to a 6-byte string."
+    return ''.join( chr( int( byte, 16 ) ) for byte in mac.split( ':' ) )
+
+def macString( data ):
+    "Convert a 6-byte string to a colon-hex MAC address string."
+    return ':'.join( '%02x' % ord( byte ) for byte in data )
+
+def ipBroadcast( ip, prefixLen ):
+    "Return the (packed) broadcast address of ip/prefixLen."
+    num = struct.unpack( '!I', socket.inet_aton( ip ) )[ 0 ]
+    hostBits = ( 1 << ( 32 - prefixLen ) ) - 1
+    return struct.pack( '!I', num | hostBits )
+
+# Message constructors; each returns ( type, flags, payload )
+
+def linkAttrs( name, mac=None, mtu=None, nsPid=None ):
+    "Return the attributes naming and configuring a link."
+    attrs = attr( IFLA_IFNAME, name + '\0' )
+    if mac:
+        attrs += attr( IFLA_ADDRESS, macBytes( mac ) )
+    if mtu:
+        attrs += attr( IFLA_MTU, struct.pack( '=I', mtu ) )
+    if nsPid:
+        attrs += attr( IFLA_NET_NS_PID, struct.pack( '=I', nsPid ) )
+    return attrs
+
+def newVeth( name1, name2, pid1=None, pid2=None, mac1=None, mac2=None,
+             mtu=None, up=True ):
+    """Create a veth pair, with each end placed in a namespace.
+       name1, name2: interface names
+       pid1, pid2: pid of a process in each end's namespace (optional)
+       mac1, mac2: MAC address of each end (optional)
+       mtu: MTU of both ends (optional)
+       up: bring the first end up; the kernel configures the peer before
+           the pair is complete, so it has to be brought up separately"""
+    flags = IFF_UP if up else 0
+    peer = ( IFINFOMSG.pack( 0, 0, 0, 0, 0 ) +
+             linkAttrs( name2, mac2, mtu, pid2 ) )
+    linkinfo = ( attr( IFLA_INFO_KIND, 'veth' ) +
+                 attr( IFLA_INFO_DATA, attr( VETH_INFO_PEER, peer ) ) )
+    payload = ( IFINFOMSG.pack( 0, 0, 0, flags, flags ) +
+                linkAttrs( name1, mac1, mtu, pid1 ) +
+                attr( IFLA_LINKINFO, linkinfo ) )
+    return RTM_NEWLINK, NLM_F_CREATE | NLM_F_EXCL, payload
+
+def setLink( name, up=None, mac=None, mtu=None, nsPid=None ):
+    """Change a link's state and settings.
+       name: interface name
+       up: True/False to bring the link up/down, or None to leave it
+       mac: new MAC address (optional)
+       mtu: new MTU (optional)
+       nsPid: move the link to this process's namespace (optional)"""
+    change = IFF_UP if up is not None else 0
+    flags = IFF_UP if up else 0
+    payload = ( IFINFOMSG.pack( 0, 0, 0, flags, change ) +
+                linkAttrs( name, mac, mtu, nsPid ) )
+    return RTM_SETLINK, 0, payload
+
+def delLink( name ):
+    "Delete a link."
+    return RTM_DELLINK, 0, IFINFOMSG.pack( 0, 0, 0, 0, 0 ) + linkAttrs( name )
+
+def getLink( name ):
+    "Look up a link by name."
+    return RTM_GETLINK, 0, IFINFOMSG.pack( 0, 0, 0, 0, 0 ) + linkAttrs( name )
+
+def newAddr( index, ip, prefixLen ):
+    """Add an IPv4 address to a link.
+       index: interface index
+       ip: IP address as a string
+       prefixLen: prefix length"""
+    packed = socket.inet_aton( ip )
+    payload = ( IFADDRMSG.pack( socket.AF_INET, prefixLen, 0,
+                                RT_SCOPE_UNIVERSE, index ) +
+                attr( IFA_LOCAL, packed ) + attr( IFA_ADDRESS, packed ) )
+    if prefixLen < 31:
+        payload += attr( IFA_BROADCAST, ipBroadcast( ip, prefixLen ) )
+    return RTM_NEWADDR, NLM_F_CREATE | NLM_F_REPLACE, payload
+
+def delAddr( index, ip, prefixLen ):
+    "Remove an IPv4 address from a link."
+    payload = ( IFADDRMSG.pack( socket.AF_INET, prefixLen, 0,
+                                RT_SCOPE_UNIVERSE, index ) +
+                attr( IFA_LOCAL, socket.inet_aton( ip ) ) )
+    return RTM_DELADDR, 0, payload
+
+def newNeigh( index, ip, mac ):
+    """Add (or replace) a permanent neighbor (ARP) entry.
+       index: interface index
+       ip: IP address as a string
+       mac: MAC address as a string"""
+    # Static ARP loads every host's address into every other host,
+    # so the encoded addresses are worth caching
+    key = ( ip, mac )
+    attrs = newNeigh.attrs.get( key )
+    if attrs is None:
+        attrs = newNeigh.attrs[ key ] = (
+            attr( NDA_DST, socket.inet_aton( ip ) ) +
+            attr( NDA_LLADDR, macBytes( mac ) ) )
+    payload = NDMSG.pack( socket.AF_INET, index, NUD_PERMANENT, 0, 0 ) + attrs
+    return RTM_NEWNEIGH, NLM_F_CREATE | NLM_F_REPLACE, payload
+
+newNeigh.attrs = {}
+
+def newRoute( index, dst='0.0.0.0', prefixLen=0 ):
+    """Add (or replace) a route out of a link.
+       index: interface index
+       dst: destination network (default: default route)
+       prefixLen: destination prefix length"""
+    payload = RTMSG.pack( socket.AF_INET, prefixLen, 0, 0, RT_TABLE_MAIN,
+                          RTPROT_BOOT, RT_SCOPE_LINK, RTN_UNICAST, 0 )
+    if prefixLen:
+        payload += attr( RTA_DST, socket.inet_aton( dst ) )
+    payload += attr( RTA_OIF, struct.pack( '=I', index ) )
+    return RTM_NEWROUTE, NLM_F_CREATE | NLM_F_REPLACE, payload
+
+def delRoute( route ):
+    """Delete a route.
+       route: route message payload, as returned by NetlinkSocket.routes()"""
+    return RTM_DELROUTE, 0, route
+
+# Network namespaces
+
+_libc = None
+
+def setns( fd, nstype=CLONE_NEWNET ):
+    """Move the calling thread into a namespace.
+       fd: open file descriptor of a /proc/<pid>/ns file
+       nstype: namespace type"""
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL( None, use_errno=True )
+    if _libc.setns( fd, nstype ) != 0:
+        errno = ctypes.get_errno()
+        raise OSError( errno, os.strerror( errno ) )
+
+def nsSocket( pid, family, stype, proto=0 ):
+    """Open a socket in the network namespace of a process.
+       pid: pid of a process in the namespace
+       family, stype, proto: as for socket.socket()"""
+    home = os.open( '/proc/self/ns/net', os.O_RDONLY )
+    try:
+        target = os.open( '/proc/%d/ns/net' % pid, os.O_RDONLY )
+        try:
+            setns( target )
+            try:
+                return socket.socket( family, stype, proto )
+            finally:
+                setns( home )
+        finally:
+            os.close( target )
+    finally:
+        os.close( home )
+
+class NetlinkSocket( object ):
+    "An rtnetlink socket, optionally in another network namespace."
+
+    def __init__( self, pid=None, groups=0 ):
+        """pid: pid of a process in the namespace to use (default: ours)
+           groups: bitmask of multicast groups to receive events from"""
+        if pid is None:
+            self.sock = socket.socket( socket.AF_NETLINK, socket.SOCK_RAW,
+                                       NETLINK_ROUTE )
+        else:
+            self.sock = nsSocket( pid, socket.AF_NETLINK, socket.SOCK_RAW,
+                                  NETLINK_ROUTE )
+        self.sock.bind( ( 0, groups ) )
+        self.seq = 0
+
+    def close( self ):
+        "Close the socket."
+        self.sock.close()
+
+    def fileno( self ):
+        "Return the socket's file descriptor."
+        return self.sock.fileno()
+
+    def nextSeq( self ):
+        "Return a new sequence number."
+        self.seq = ( self.seq + 1 ) & 0xffffffff
+        return self.seq
+
+    def send( self, msgs, ack=True ):
+        """Send a batch of messages at once.
+           msgs: list of ( type, flags, payload )
+           ack: ask for an ack of the last message; since the kernel
+                handles messages in order, this acks the whole batch
+                (failures are reported whether or not we ask)
+           returns: list of sequence numbers"""
+        data, seqs = [], []
+        last = len( msgs ) - 1
+        for i, ( msgtype, flags, payload ) in enumerate( msgs ):
+            seq = self.nextSeq()
+            seqs.append( seq )
+            if ack and i == last:
+                flags |= NLM_F_ACK
+            data.append( NLMSGHDR.pack( NLMSGHDR.size + len( payload ),
+                                        msgtype, NLM_F_REQUEST | flags,
+                                        seq, 0 ) )
+            data.append( payload )
+        self.sock.sendall( ''.join( data ) )
+        return seqs
+
+    def receive( self ):
+        """Read and decode one datagram of netlink messages.
+           returns: list of ( type, seq, payload )"""
+        data = self.sock.recv( 65536 )
+        msgs, offset = [], 0
+        while offset + NLMSGHDR.size <= len( data ):
+            length, msgtype, _flags, seq, _pid = NLMSGHDR.unpack_from(
+                data, offset )
+            if length < NLMSGHDR.size:
+                break
+            msgs.append( ( msgtype, seq,
+                           data[ offset + NLMSGHDR.size:offset + length ] ) )
+            offset += _align( length )
+        return msgs
+
+    def request( self, msgs ):
+        """Send messages, in batches, and wait for them to be handled.
+           msgs: list of ( type, flags, payload )
+           returns: list of errno values (0 for success), one per message"""
+        results = []
+        for start in range( 0, len( msgs ), BATCHSIZE ):
+            seqs = self.send( msgs[ start:start + BATCHSIZE ] )
+            status = dict.fromkeys( seqs, 0 )
+            done = False
+            while not done:
+                for msgtype, seq, payload in self.receive():
+                    if msgtype != NLMSG_ERROR or seq not in status:
+                        continue
+                    status[ seq ] = -struct.unpack_from( '=i', payload )[ 0 ]
+                    # Every message is handled by the time the last
+                    # one is acked (or fails)
+                    done = done or seq == seqs[ -1 ]
+            results += [ status[ seq ] for seq in seqs ]
+        return results
+
+    def check( self, msgs, ignore=() ):
+        """Send messages and raise NetlinkError if any of them fail.
+           msgs: list of ( type, flags, payload )
+           ignore: errno values which don't count as failures"""
+        for errno in self.request( msgs ):
+            if errno and errno not in ignore:
+                raise NetlinkError( errno )
+
+    def query( self, msg ):
+        """Send a request and return the replies to it.
+           msg: ( type, flags, payload )
+           returns: list of ( type, payload ) replies"""
+        msgtype, flags, payload = msg
+        dump = flags & NLM_F_DUMP
+        seq = self.send( [ msg ], ack=False )[ 0 ]
+        replies = []
+        while True:
+            for rtype, rseq, rpayload in self.receive():
+                if rseq != seq:
+                    continue
+                if rtype == NLMSG_ERROR:
+                    errno = -struct.unpack_from( '=i', rpayload )[ 0 ]
+                    if errno:
+                        raise NetlinkError( errno )
+                    return replies
+                if rtype == NLMSG_DONE:
+                    return replies
+                replies.append( ( rtype, rpayload ) )
+                if not dump:
+                    return replies
+
+    def link( self, name ):
+        """Look up a link by name.
+           returns: ( index, flags, attrs ) or None if there is no such link"""
+        try:
+            replies = self.query( getLink( name ) )
+        except NetlinkError, e:
+            if e.errno == ENODEV:
+                return None
+            raise
+        for rtype, payload in replies:
+            if rtype == RTM_NEWLINK:
+                _family, _type, index, flags, _change = IFINFOMSG.unpack_from(
+                    payload )
+                return index, flags, parseAttrs( payload[ IFINFOMSG.size: ] )
+        return None
+
+    def linkIndex( self, name ):
+        "Return the index of a link, or None if there is no such link."
+        link = self.link( name )
+        return link[ 0 ] if link else None
+
+    def addrs( self, index ):
+        """Return the IPv4 addresses of a link.
+           index: interface index
+           returns: list of ( ip, prefixLen )"""
+        msg = ( RTM_GETADDR, NLM_F_DUMP,
+                IFADDRMSG.pack( socket.AF_INET, 0, 0, 0, 0 ) )
+        result = []
+        for rtype, payload in self.query( msg ):
+            if rtype != RTM_NEWADDR:
+                continue
+            family, prefixLen, _flags, _scope, aindex = IFADDRMSG.unpack_from(
+                payload )
+            local = parseAttrs( payload[ IFADDRMSG.size: ] ).get( IFA_LOCAL )
+            if family == socket.AF_INET and aindex == index and local:
+                result.append( ( socket.inet_ntoa( local ), prefixLen ) )
+        return result
+
+    def routes( self, table=RT_TABLE_MAIN ):
+        """Return the IPv4 routes of a routing table.
+           table: routing table id
+           returns: list of route message payloads (see delRoute())"""
+        msg = ( RTM_GETROUTE, NLM_F_DUMP,
+                RTMSG.pack( socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0 ) )
+        result = []
+        for rtype, payload in self.query( msg ):
+            if rtype != RTM_NEWROUTE:
+                continue
+            family, _dstLen, _srcLen, _tos, rtable = RTMSG.unpack_from(
+                payload )[ :5 ]
+            if family == socket.AF_INET and rtable == table:
+                result.append( payload )
+        return result
+
+def linkState( flags ):
+    """Return the state of a link, given its flags: 'up' if it is up and
+       running (its carrier is up, e.g. the peer of a veth is up too,
+       or a bridge has a forwarding port), 'down' otherwise."""
+    running = IFF_UP | IFF_RUNNING
+    return 'up' if flags & running == running else 'down'
+
+class LinkMonitor( object ):
+    """Tracks the state of the links in a network namespace, using the
+       kernel's link events (RTNLGRP_LINK).
+       Events are only read by waitState() or dispatch(); to receive
+       them (and run callbacks) as they happen, register the monitor
+       with the shared reactor:
+           reactor.addReader( monitor.fileno(), monitor.dispatch )"""
+
+    def __init__( self, pid=None ):
+        "pid: pid of a process in the namespace to use (default: ours)"
+        self.nl = NetlinkSocket( pid, groups=RTMGRP_LINK )
+        self.links = {}  # link name -> state
+        self.callbacks = []
+        self.dumpSeq = None  # sequence number of a dump in progress
+        self.resync()
+
+    def close( self ):
+        "Close the socket."
+        self.nl.close()
+
+    def fileno( self ):
+        "Return the socket's file descriptor."
+        return self.nl.fileno()
+
+    def addCallback( self, callback ):
+        """Call a function whenever a link changes state.
+           callback: function of link name and new state ('up', 'down',
+                     or None if the link has been deleted)"""
+        self.callbacks.append( callback )
+
+    def removeCallback( self, callback ):
+        "Remove a function added with addCallback()."
+        self.callbacks.remove( callback )
+
+    def state( self, name ):
+        """Return the state of a link.
+           name: link name
+           returns: 'up', 'down' or None if there is no such link"""
+        return self.links.get( name )
+
+    def update( self, name, state ):
+        "Record the state of a link, and report it if it has changed."
+        if state is None:
+            old = self.links.pop( name, None )
+        else:
+            old = self.links.get( name )
+            self.links[ name ] = state
+        if old != state:
+            for callback in list( self.callbacks ):
+                callback( name, state )
+
+    def resync( self ):
+        """Read the state of every link. Events which arrive meanwhile are
+           handled in order, so none of them are lost."""
+        msg = ( RTM_GETLINK, NLM_F_DUMP, IFINFOMSG.pack( 0, 0, 0, 0, 0 ) )
+        self.dumpSeq = self.nl.send( [ msg ], ack=False )[ 0 ]
+        seen = set()
+        while self.dumpSeq is not None:
+            seen.update( self.dispatch() )
+        # Links which weren't dumped have gone away
+        for name in set( self.links ) - seen:
+            self.update( name, None )
+
+    def dispatch( self ):
+        """Read and handle one batch of link events (blocks if none has
+           arrived).
+           returns: names of the links we heard about"""
+        try:
+            msgs = self.nl.receive()
+        except socket.error, e:
+            if e.errno == ENOBUFS:
+                # We missed some events, so start again
+                self.resync()
+                return list( self.links )
+            if e.errno == EINTR:
+                return []
+            raise
+        names = []
+        for msgtype, seq, payload in msgs:
+            if seq == self.dumpSeq and msgtype in ( NLMSG_DONE, NLMSG_ERROR ):
+                self.dumpSeq = None
+            if msgtype not in ( RTM_NEWLINK, RTM_DELLINK ):
+                continue
+            _family, _type, _index, flags, _change = IFINFOMSG.unpack_from(
+                payload )
+            name = parseAttrs( payload[ IFINFOMSG.size: ] ).get( IFLA_IFNAME )
+            if not name:
+                continue
+            name = name.rstrip( '\0' )
+            names.append( name )
+            self.update( name, linkState( flags )
+                         if msgtype == RTM_NEWLINK else None )
+        return names
+
+    def waitState( self, names, state='up', timeout=None ):
+        """Wait until each of a list of links is in a given state.
+           names: list of link names
+           state: 'up', 'down' or None (deleted)
+           timeout: seconds to wait, or None to wait indefinitely
+           returns: True if they are, False on timeout"""
+        deadline = None if timeout is None else time() + timeout
+        poller = select.poll()
+        poller.register( self.fileno(), select.POLLIN )
+        while [ name for name in names if self.links.get( name ) != state ]:
+            timeoutms = -1
+            if deadline is not None:
+                timeoutms = int( ( deadline - time() ) * 1000 )
+                if timeoutms < 0:
+                    return False
+            try:
+                ready = poller.poll( timeoutms )
+            except select.error, e:
+                if e.args[ 0 ] == EINTR:
+                    continue
+                raise
+            if ready:
+                self.dispatch()
+        return True
+
+def available():
+    "Can we use rtnetlink to configure links?"
+    if available.result is None:
+        available.result = False
+        if os.geteuid() == 0 and hasattr( socket, 'AF_NETLINK' ):
+            try:
+                NetlinkSocket().close()
+                available.result = True
+            except ( socket.error, OSError ):
+                pass
+    return available.result
+
+available.result = None
+
+_root = None
+
+def rootSocket():
+    "Return a shared netlink socket in our own namespace."
+    global _root
+    if _root is None:
+        _root = NetlinkSocket()
+    return _root
+
+_rootMonitor = None
+
+def rootMonitor():
+    "Return a shared LinkMonitor for our own namespace."
+    global _rootMonitor
+    if _rootMonitor is None:
+        _rootMonitor = LinkMonitor()
+    return _rootMonitor
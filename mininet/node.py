@@ -10,8 +10,11 @@ Node: superclass for all (primarily local) network nodes.
 Host: a virtual host. By default, a host is simply a shell; commands
     may be sent using Cmd (which waits for output), or using sendCmd(),
     which returns immediately, allowing subsequent monitoring using
-    monitor(). Examples of how to run experiments using this
-    functionality are provided in the examples/ directory.
+    monitor(), or using acmd(), which returns a future for the output
+    (see mininet.futures). Long-running processes which shouldn't tie
+    up the shell may be started with popen() instead. Examples of how
+    to run experiments using this functionality are provided in the
+    examples/ directory.
 
 Switch: superclass for switch nodes.
 
@@ -54,17 +57,25 @@ Future enhancements:
 - Create proxy objects for remote nodes (Mininet: Cluster Edition)
 """
 
+import io
 import os
 import pty
 import re
 import signal
-import select
+import socket
 import sys
+import termios
+from pipes import quote
 from subprocess import Popen, PIPE, STDOUT
-from time import sleep
+from time import sleep, time
 
+from mininet import futures, netlink, ovsdb
+from mininet.forkserver import forkServer
 from mininet.log import info, error, debug
-from mininet.util import quietRun, makeIntfPair, moveIntf, isShellBuiltin
+from mininet.reactor import reactor, OutputRing
+from mininet.shell import FrameParser, shellEnv, batchMarker
+from mininet.util import quietRun, errRun, createLinks, moveIntf
+from mininet.util import isSimpleCommand
 from mininet.moduledeps import moduleDeps, pathCheck, checkRunning, OVS_KMOD, OF_KMOD, TUN
 
 SWITCH_PORT_BASE = 1  # For OF > 0.9, switch ports start at 1 rather than zero
@@ -79,55 +90,168 @@ class Node( object ):
     portBase = 0  # Nodes always start with eth0/port0, even in OF 1.0
 
     def __init__( self, name, inNamespace=True,
-        defaultMAC=None, defaultIP=None, prefix='n', **kwargs ):
+        defaultMAC=None, defaultIP=None, prefix='n', usePty=True,
+        waitStart=True, lazyShell=False, **kwargs ):
         """name: name of node
            inNamespace: in network namespace?
            defaultMAC: default MAC address for intf 0
-           defaultIP: default IP address for intf 0"""
+           defaultIP: default IP address for intf 0
+           usePty: talk to the shell over a pty rather than a socketpair?
+           waitStart: wait for the shell to start? If False, the caller
+               must call waitStarted() (or read the shell's output)
+               before using the node's pid
+           lazyShell: hold our namespace with an idle mnexec process,
+               and only start the shell when a command is first sent?"""
         self.name = name
         self.inNamespace = inNamespace
         self.defaultIP = defaultIP
         self.defaultMAC = defaultMAC
         self.prefix = prefix
-        opts = '-cdp'
-        if self.inNamespace:
-            opts += 'n'
-        cmd = [ 'sudo', '-E', 'env', 'PATH=%s' % os.environ['PATH'],
-                'PS1=' + chr( 127 ), 'mnexec', opts, 'bash', '--norc' ]
-        # Spawn a shell subprocess in a pseudo-tty, to disable buffering
-        # in the subprocess and insulate it from signals (e.g. SIGINT)
-        # received by the parent
-        master, slave = pty.openpty()
-        self.shell = Popen( cmd, stdin=slave, stdout=slave, stderr=slave,
-            close_fds=False )
-        self.stdin = os.fdopen( master )
-        self.stdout = self.stdin
-        self.pollOut = select.poll()
-        self.pollOut.register( self.stdout )
-        # Maintain mapping between file descriptors and nodes
-        # This is useful for monitoring multiple nodes
-        # using select.poll()
-        self.outToNode[ self.stdout.fileno() ] = self
-        self.inToNode[ self.stdin.fileno() ] = self
+        self.usePty = usePty
+        self.shell = None  # shell process
+        self.holder = None  # process holding our namespace, for lazyShell
+        self.holderChannel = None  # holder's channel, once a shell runs
+        # Output is read by the shared reactor (see mininet.reactor)
+        # into our ring buffer, whoever is waiting for it
+        self.outbuf = OutputRing()
         self.intfs = {}  # dict of port numbers to interface names
         self.ports = {}  # dict of interface names to port numbers
                          # replace with Port objects, eventually ?
+        # Address caches, filled in by setIP()/setMAC()/link creation
+        # and on demand by IP()/MAC()
         self.ips = {}  # dict of interfaces to ip addresses as strings
         self.macs = {}  # dict of interfacesto mac addresses as strings
         self.connection = {}  # remote node connected to each interface
+        self.nl = None  # netlink socket in our namespace, opened on demand
+        self.linkMon = None  # netlink.LinkMonitor, opened on demand
         self.execed = False
         self.lastCmd = None
         self.lastPid = None
-        self.readbuf = ''
+        self.lastBgPid = None
+        self.lastStatus = None
         self.waiting = False
+        self.batch = None  # state of the batch sent by sendBatch()
+        self.sink = None  # callable receiving the current command's output
+        self.sinkFile = None  # file opened for the current command's output
+        # Shell protocol state: serial number of the last command sent,
+        # and of the last command the shell reported as complete
+        self.parser = None
+        self.serial = 0
+        self.lastSerial = None
+        self.synced = False
         # Stash additional information as desired
         self.args = kwargs
-        x = ""
-        while "\n" not in x:
-            self.waitReadable()
-            x += self.read(1)
-        self.pid = int(x[1:-1])
-        self.serial = 0
+        # mnexec -p reports the pid of our shell (or holder) before
+        # anything else; pid identifies our namespace
+        self.pid = None
+        self.shellPid = None
+        if lazyShell:
+            self.startHolder()
+        else:
+            self.startShell()
+        if waitStart:
+            self.waitStarted()
+
+    def startShell( self ):
+        """Start our shell, in a new namespace or in the namespace held
+           by our holder process. The shell is started by the mnexec
+           fork server if there is one (see mininet.forkserver)."""
+        if self.holder:
+            self.waitStarted()
+            # We're done reading from the holder (but it holds our
+            # namespace until its stdin is closed, so closeChannel()
+            # keeps that open)
+            self.closeChannel()
+        nsPid = self.pid if self.holder and self.inNamespace else None
+        newNs = self.inNamespace and not self.holder
+        cmd = [ 'bash', '--norc', '--noediting', '-i' ]
+        server = forkServer()
+        if server:
+            env = [ 'PATH=%s' % os.environ['PATH'] ] + shellEnv()
+            self.shell, master = server.spawn( cmd, env, newNs, nsPid,
+                                               self.usePty )
+            self.shellPid = self.shell.pid
+            if self.pid is None:
+                self.pid = self.shellPid
+            self.openChannel( os.fdopen( master ), writable=True )
+            return
+        opts = [ '-cdpn' if newNs else '-cdp' ]
+        if nsPid:
+            opts += [ '-a', str( nsPid ) ]
+        # sudo is slow to start, so skip it if we're root already
+        sudo = [ 'sudo', '-E' ] if os.geteuid() != 0 else []
+        cmd = ( sudo + [ 'env', 'PATH=%s' % os.environ['PATH'] ] +
+                shellEnv() + [ 'mnexec' ] + opts + cmd )
+        if self.usePty:
+            # Spawn a shell subprocess in a pseudo-tty, to disable
+            # buffering in the subprocess and insulate it from signals
+            # (e.g. SIGINT) received by the parent
+            master, slave = pty.openpty()
+            # Turn off echo so that we only read back command output
+            attrs = termios.tcgetattr( slave )
+            attrs[ 3 ] &= ~termios.ECHO
+            termios.tcsetattr( slave, termios.TCSANOW, attrs )
+        else:
+            # A socketpair has no line discipline (hence no echo) and
+            # doesn't count against the system-wide pty limit
+            parent, child = socket.socketpair()
+            master, slave = os.dup( parent.fileno() ), os.dup( child.fileno() )
+            parent.close()
+            child.close()
+        self.shell = Popen( cmd, stdin=slave, stdout=slave, stderr=slave,
+            close_fds=False )
+        # The shell has its own copy of the slave side
+        os.close( slave )
+        self.openChannel( os.fdopen( master ), writable=True )
+
+    def startHolder( self ):
+        """Start an idle mnexec process to hold our namespace until the
+           shell is needed; all it does is report its pid."""
+        server = forkServer()
+        if server:
+            self.holder, fd = server.spawn( [ 'mnexec', '-w' ],
+                newNs=self.inNamespace, usePty=False )
+            self.pid = self.holder.pid
+            self.openChannel( os.fdopen( fd ), writable=False )
+            return
+        opts = '-cdnpw' if self.inNamespace else '-cdpw'
+        sudo = [ 'sudo', '-E' ] if os.geteuid() != 0 else []
+        # The holder exits when its stdin is closed, i.e. when we do
+        self.holder = Popen( sudo + [ 'env', 'PATH=%s' % os.environ['PATH'],
+                                      'mnexec', opts ],
+                             stdin=PIPE, stdout=PIPE, close_fds=True )
+        self.openChannel( self.holder.stdout, writable=False )
+
+    def openChannel( self, fileobj, writable ):
+        """Start reading output from our shell or holder.
+           fileobj: file object to read from (and write to)
+           writable: can commands be written to fileobj?"""
+        self.stdout = fileobj
+        self.stdin = fileobj if writable else None
+        # Unbuffered reader, so output can be read straight into
+        # the parser's buffer
+        self.reader = io.FileIO( fileobj.fileno(), 'r', closefd=False )
+        self.parser = FrameParser()
+        reactor.register( self )
+        # Maintain mapping between file descriptors and nodes
+        self.outToNode[ fileobj.fileno() ] = self
+        if writable:
+            self.inToNode[ fileobj.fileno() ] = self
+
+    def closeChannel( self ):
+        """Stop reading output from our holder. The channel stays open
+           until cleanup(), since (with the fork server) it is also the
+           holder's stdin, and the holder exits when that is closed."""
+        reactor.unregister( self )
+        reactor.pending.discard( self )
+        self.outToNode.pop( self.stdout.fileno(), None )
+        self.holderChannel = self.stdout
+        self.stdout = self.reader = None
+
+    def ensureShell( self ):
+        "Start our shell if it was deferred (see lazyShell)."
+        if self.shell is None and self.holder is not None:
+            self.startShell()
 
     @classmethod
     def fdToNode( cls, fd ):
@@ -137,36 +261,52 @@ class Node( object ):
         node = Node.outToNode.get( fd )
         return node or Node.inToNode.get( fd )
 
+    def waitStarted( self ):
+        "Wait for the shell (or holder) to start and report its pid."
+        while self.pid is None:
+            if not self.readItems() and not self.shellAlive():
+                error( '*** Error: shell for %s exited before starting\n' %
+                       self.name )
+                exit( 1 )
+
+    def shellAlive( self ):
+        "Is our shell (or holder) still running?"
+        proc = self.shell or self.holder
+        return proc is not None and proc.poll() is None
+
     def cleanup( self ):
         "Help python collect its garbage."
-        self.shell = None
+        self.shell = self.holder = None
+        if self.holderChannel:
+            self.holderChannel.close()
+            self.holderChannel = None
+        reactor.unregister( self )
+        # An open socket would keep our namespace (and its links) alive
+        if self.nl:
+            self.nl.close()
+            self.nl = None
+        if self.linkMon:
+            self.linkMon.close()
+            self.linkMon = None
 
     # Subshell I/O, commands and control
     def read( self, bytes=1024 ):
-        """Buffered read from node, non-blocking.
+        """Raw read from node, bypassing the shell protocol.
            bytes: maximum number of bytes to return"""
-        count = len( self.readbuf )
-        if count < bytes:
-            data = os.read( self.stdout.fileno(), bytes - count )
-            self.readbuf += data
-        if bytes >= len( self.readbuf ):
-            result = self.readbuf
-            self.readbuf = ''
-        else:
-            result = self.readbuf[ :bytes ]
-            self.readbuf = self.readbuf[ bytes: ]
-        return result
+        return os.read( self.stdout.fileno(), bytes )
 
-    def readline( self ):
+    def readline( self, timestamp=False ):
         """Buffered readline from node, non-blocking.
+           timestamp: return ( time read, line ) rather than line
            returns: line (minus newline) or None"""
-        self.readbuf += self.read( 1024 )
-        if '\n' not in self.readbuf:
-            return None
-        pos = self.readbuf.find( '\n' )
-        line = self.readbuf[ 0 : pos ]
-        self.readbuf = self.readbuf[ pos + 1: ]
-        return line
+        entry = self.outbuf.readline()
+        if entry is None and self.waitReadable( 0 ):
+            entry = self.outbuf.readline()
+        if not self.outbuf:
+            reactor.pending.discard( self )
+        if entry is None or timestamp:
+            return entry
+        return entry[ 1 ]
 
     def write( self, data ):
         """Write data to node.
@@ -175,7 +315,8 @@ class Node( object ):
 
     def terminate( self ):
         "Send kill signal to Node and clean up after it."
-        quietRun( 'kill ' + str( self.pid ) )
+        pids = set( pid for pid in ( self.pid, self.shellPid ) if pid )
+        quietRun( 'kill ' + ' '.join( str( pid ) for pid in pids ) )
         self.cleanup()
 
     def stop( self ):
@@ -183,31 +324,146 @@ class Node( object ):
         self.terminate()
 
     def waitReadable( self, timeoutms=None ):
-        """Wait until node's output is readable.
-           timeoutms: timeout in ms or None to wait indefinitely."""
-        if len( self.readbuf ) == 0:
-            self.pollOut.poll( timeoutms )
+        """Wait until the reactor has read output from the node.
+           timeoutms: timeout in ms or None to wait indefinitely.
+           returns: True if output is available"""
+        if reactor.waitFor( self, timeoutms ):
+            return True
+        if self.waiting and ( self.stdout is None or
+                              not reactor.registered( self ) ):
+            # Nothing more will be read, so don't wait for the command
+            self.shellClosed()
+        return False
+
+    def hasOutput( self ):
+        "Has the reactor read output which we haven't consumed yet?"
+        return self in reactor.pending
+
+    def readOutput( self, stamp ):
+        """Read available output from the shell into our ring buffer,
+           updating the command state. Called by the reactor.
+           stamp: time of the read
+           returns: False if the shell has closed its end"""
+        try:
+            count = self.parser.fill( self.reader )
+        except ( IOError, OSError ):
+            # EIO: the pty has been hung up
+            count = 0
+        if not count:
+            self.shellClosed()
+            return False
+        # handleItems() clears self.waiting when it sees the end of the
+        # command, but the output read along with that belongs to it too
+        waiting = self.waiting
+        items = self.handleItems( self.parser.parse() )
+        # Output nobody asked for is only kept up to the ring size
+        self.outbuf.append( items, stamp,
+                            bounded=not ( waiting or self.waiting ) )
+        return True
+
+    def shellClosed( self ):
+        """Our shell's output has been closed (e.g. the shell exited):
+           end the current command, which can't report its status."""
+        if not self.waiting:
+            return
+        error( '*** Error: %s: shell exited while running %s\n' %
+               ( self.name, self.lastCmd ) )
+        self.waiting = False
+        self.lastStatus = None
+        self.closeSink()
+
+    def handleItems( self, items ):
+        """Process output and control frames read from the shell,
+           updating the command state.
+           items: list of output strings and ( type, payload ) frames
+           returns: list of output strings (and batch frames) belonging
+                    to the current command"""
+        result = []
+        for item in items:
+            if isinstance( item, str ):
+                # Output preceding the previous command's completion
+                # is stale, so we drop it
+                if not self.synced:
+                    continue
+                if self.sink and self.waiting:
+                    self.sink( item )
+                else:
+                    result.append( item )
+                continue
+            kind, payload = item
+            try:
+                fields = [ int( field ) for field in payload.split() ]
+            except ValueError:
+                continue
+            if kind == 'P' and fields:
+                if self.pid is None:
+                    self.pid = fields[ 0 ]
+                if self.shell is not None and self.shellPid is None:
+                    self.shellPid = fields[ 0 ]
+                elif self.synced:
+                    self.lastPid = fields[ 0 ]
+            elif kind == 'E' and len( fields ) == 3:
+                serial, status, bgPid = fields
+                self.lastSerial = serial
+                if serial == self.serial - 1 and not self.synced:
+                    self.synced = True
+                elif self.waiting and serial in ( self.serial,
+                                                  self.serial - 1 ):
+                    # The previous serial again means that our command
+                    # line never ran (e.g. it had a syntax error), so
+                    # its serial counts as done for the next command
+                    self.lastSerial = self.serial
+                    self.waiting = False
+                    self.lastStatus = status
+                    self.lastBgPid = bgPid or None
+                    self.closeSink()
+            elif kind == 'B' and self.synced:
+                result.append( item )
+        return result
+
+    def openSink( self, sink=None, outfile=None ):
+        """Direct the output of the next command to a callable or a file
+           instead of returning it.
+           sink: callable which is passed each piece of output
+           outfile: name of file to write output to"""
+        if outfile:
+            self.sinkFile = open( outfile, 'w' )
+            sink = self.sinkFile.write
+        self.sink = sink
+
+    def closeSink( self ):
+        "Stop directing command output to the current sink."
+        if self.sinkFile:
+            self.sinkFile.close()
+        self.sink = self.sinkFile = None
+
+    def readItems( self, timeoutms=None ):
+        """Read available output from the shell.
+           timeoutms: timeout in ms or None to wait indefinitely.
+           returns: list of output strings (and batch frames) belonging
+                    to the current command"""
+        if not self.waitReadable( timeoutms ):
+            return []
+        reactor.pending.discard( self )
+        return self.outbuf.read()
+
+    def nextSerial( self ):
+        "Allocate a serial number for a new command line."
+        self.serial += 1
+        self.synced = self.lastSerial == self.serial - 1
+        return self.serial
 
     def sendCmd( self, *args, **kwargs ):
         """Send a command, and return without waiting for the command
            to complete.
            args: command and arguments, or string
-           printPid: print command's PID?"""
+           printPid: print command's PID (setting lastPid)? default True
+           interactive: command expects a terminal?
+           sink: callable to pass output to as it arrives, rather
+                 than returning it from monitor()/waitOutput()
+           outfile: file name to stream output to, as for sink"""
         assert not self.waiting
-        self.serial += 1
-        self.write( 'echo __   %s   __\n' % self.serial )
-        match = '__ %s __' % self.serial
-        buf = ''
-        while True:
-            i = buf.find( match )
-            if i >= 0:
-                buf = buf[ i + len( match ): ]
-                break
-            buf += self.read( 1024 )
-        while True:
-            if chr( 127 ) in buf:
-                break
-            buf += self.read( 1024 )
+        self.ensureShell()
         printPid = kwargs.get( 'printPid', True )
         if len( args ) > 0:
             cmd = args
@@ -216,76 +472,207 @@ class Node( object ):
         if not re.search( r'\w', cmd ):
             # Replace empty commands with something harmless
             cmd = 'echo -n'
-        if printPid and not isShellBuiltin( cmd ):
+        if kwargs.get( 'interactive', False ) and not self.usePty:
+            # Give interactive commands a pty of their own
+            cmd = 'script -qfec %s /dev/null' % quote( cmd )
+        elif printPid and isSimpleCommand( cmd ):
             use_mnexec = kwargs.get( 'mn_use_mnexec', True)
             if use_mnexec:
                 cmd = 'mnexec -p ' + cmd
             disable_io_buf = kwargs.get( 'mn_disable_io_buf', False)
             if disable_io_buf:
                 cmd = 'stdbuf -i0 -o0 -e0 ' + cmd
-        self.write( cmd + '\n' )
+        # The shell reports the serial number back to us when the
+        # command line completes, so no separate sync is needed
+        self.write( '__mnserial=%d; %s\n' % ( self.nextSerial(), cmd ) )
         wait_flag = kwargs.get( 'mn_wait', True)
         if wait_flag:
             self.lastCmd = cmd
             self.lastPid = None
+            self.lastStatus = None
             self.waiting = True
+            self.openSink( kwargs.get( 'sink' ), kwargs.get( 'outfile' ) )
 
     def sendInt( self, sig=signal.SIGINT ):
         "Interrupt running command."
-        self.write( chr( 3 ) )
+        if self.usePty:
+            self.write( chr( 3 ) )
+        else:
+            # No tty to generate the signal, so send it to the shell's
+            # process group (background jobs ignore SIGINT)
+            quietRun( 'kill -%d -- -%d' % ( sig, self.shellPid ) )
 
     def monitor( self, timeoutms=None ):
         """Monitor and return the output of a command.
            Set self.waiting to False if command has completed.
            timeoutms: timeout in ms or None to wait indefinitely."""
-        self.waitReadable( timeoutms )
-        data = self.read( 1024 )
-        # Look for PID
-        marker = chr( 1 ) + r'\d+\r\n'
-        if chr( 1 ) in data:
-            markers = re.findall( marker, data )
-            if markers:
-                self.lastPid = int( markers[ 0 ][ 1: ] )
-                data = re.sub( marker, '', data )
-        # Look for sentinel/EOF
-        if len( data ) > 0 and data[ -1 ] == chr( 127 ):
-            self.waiting = False
-            data = data[ :-1 ]
-        elif chr( 127 ) in data:
-            self.waiting = False
-            data = data.replace( chr( 127 ), '' )
-        return data
-
-    def waitOutput( self, verbose=False, pattern=None ):
+        return ''.join( [ item for item in self.readItems( timeoutms )
+                          if isinstance( item, str ) ] )
+
+    def waitOutput( self, verbose=False, pattern=None, timeout=None ):
         """Wait for a command to complete or generate certain output.
-           Completion is signaled by a sentinel character, ASCII(127)
-           appearing in the output stream.  Wait for the sentinel or
-           output matched by a certain pattern, and return the output.
+           Completion is signaled by an end-of-command frame from the
+           shell (see mininet.shell). Wait for completion or output
+           matched by a certain pattern, and return the output.
+           Output sent to a sink (see sendCmd) is not returned.
            verbose: print output interactively
-           pattern: compiled regexp or None"""
+           pattern: compiled regexp or None
+           timeout: seconds after which to interrupt the command,
+                    or None to wait indefinitely"""
         log = info if verbose else debug
-        output = ''
-        while self.waiting and (pattern is None or
-                                not pattern.search(output)):
-            data = self.monitor()
-            output += data
+        output = []
+        deadline = None if timeout is None else time() + timeout
+        interrupted = False
+        # The reactor may have seen the command complete while reading
+        # for another node, so drain our buffer before giving up
+        while ( ( self.waiting or self.hasOutput() ) and
+                ( pattern is None or
+                  not pattern.search( ''.join( output ) ) ) ):
+            timeoutms = None
+            if deadline is not None and self.waiting:
+                timeoutms = max( 0, int( ( deadline - time() ) * 1000 ) )
+                if timeoutms == 0:
+                    if interrupted:
+                        error( '*** Error: %s: command did not exit after '
+                               'interrupt: %s\n' % ( self.name,
+                                                      self.lastCmd ) )
+                        break
+                    # Interrupt the command and give it the same
+                    # amount of time again to exit
+                    self.sendInt()
+                    interrupted = True
+                    deadline = time() + timeout
+                    continue
+            data = self.monitor( timeoutms )
+            output.append( data )
             log( data )
-        return output
+        return ''.join( output )
 
     def cmd( self, *args, **kwargs ):
         """Send a command, wait for output, and return it.
-           cmd: string"""
+           cmd: string
+           timeout: seconds after which to interrupt the command
+           exitcode: return ( output, exit status ) rather than output
+           sink: callable to stream output to (nothing is returned)
+           outfile: file name to stream output to (nothing is returned)"""
         verbose = kwargs.get( 'verbose', False )
         log = info if verbose else debug
         log( '*** %s : %s\n' % ( self.name, args ) )
         self.sendCmd( *args, **kwargs )
-        return self.waitOutput( verbose )
+        output = self.waitOutput( verbose, timeout=kwargs.get( 'timeout' ) )
+        if kwargs.get( 'exitcode', False ):
+            return output, self.lastStatus
+        return output
+
+    def acmd( self, *args, **kwargs ):
+        """Queue a command and return a future for its output, without
+           waiting for the shell to be free (see mininet.futures).
+           args, kwargs: as for sendCmd()
+           exitcode: make the result ( output, exit status )
+           returns: CmdFuture"""
+        return futures.submit( self, *args, **kwargs )
+
+    def cmdBatch( self, cmds, verbose=False, exitcode=False ):
+        """Send a list of commands to the shell in a single write, wait
+           for all of them to complete, and return their outputs.
+           The commands are run in order as one compound command, and
+           the shell reports the end of each one with a frame carrying
+           its exit status.
+           cmds: list of commands (strings or lists of args)
+           verbose: print output interactively
+           exitcode: return ( output, exit status ) for each command
+           returns: list of output strings, one per command"""
+        self.sendBatch( cmds, verbose )
+        return self.waitBatch( exitcode )
+
+    def sendBatch( self, cmds, verbose=False ):
+        """Send a list of commands to the shell, as for cmdBatch(), and
+           return without waiting for them to complete. Use readBatch()
+           or waitBatch() to collect the results.
+           cmds: list of commands (strings or lists of args)
+           verbose: print output interactively"""
+        assert not self.waiting
+        self.ensureShell()
+        log = info if verbose else debug
+        log( '*** %s : %s\n' % ( self.name, cmds ) )
+        serial = self.nextSerial()
+        lines = [ '__mnserial=%d; {' % serial ]
+        for index, cmd in enumerate( cmds ):
+            if not isinstance( cmd, str ):
+                cmd = ' '.join( cmd )
+            lines.append( cmd )
+            lines.append( batchMarker( serial, index ) )
+        lines.append( '}' )
+        self.write( '\n'.join( lines ) + '\n' )
+        self.lastCmd = cmds
+        self.lastPid = None
+        self.lastStatus = None
+        self.waiting = True
+        self.batch = ( cmds, log, [ [] ], [] )
+
+    def readBatch( self, timeoutms=None ):
+        """Read available output of the commands sent by sendBatch().
+           Set self.waiting to False once they have all completed.
+           timeoutms: timeout in ms or None to wait indefinitely."""
+        _cmds, log, outputs, statuses = self.batch
+        for item in self.readItems( timeoutms ):
+            if isinstance( item, str ):
+                outputs[ -1 ].append( item )
+                log( item )
+                continue
+            fields = item[ 1 ].split()
+            if len( fields ) == 3 and fields[ 0 ] == str( self.serial ):
+                statuses.append( int( fields[ 2 ] ) )
+                outputs.append( [] )
+
+    def waitBatch( self, exitcode=False ):
+        """Wait for the commands sent by sendBatch() to complete.
+           exitcode: return ( output, exit status ) for each command
+           returns: list of output strings, one per command"""
+        while self.waiting or self.hasOutput():
+            self.readBatch()
+        cmds, _log, outputs, statuses = self.batch
+        self.batch = None
+        if len( statuses ) < len( cmds ):
+            error( '*** Error: %s: lost output of batched commands %s\n'
+                   % ( self.name, cmds[ len( statuses ): ] ) )
+            statuses += [ None ] * ( len( cmds ) - len( statuses ) )
+        outputs = [ ''.join( output )
+                    for output in outputs + [ [] ] * len( cmds ) ]
+        outputs = outputs[ :len( cmds ) ]
+        if exitcode:
+            return zip( outputs, statuses )
+        return outputs
 
     def cmdPrint( self, *args):
         """Call cmd and printing its output
            cmd: string"""
         return self.cmd( *args, **{ 'verbose': True } )
 
+    def popen( self, *args, **kwargs ):
+        """Start a process in our network namespace without going
+           through our shell, so that any number of processes can run
+           at once, independently of the shell and of each other.
+           The process is detached from our tty (so that ^C at the CLI
+           doesn't kill it), and joins our namespace via mnexec -a.
+           args: command and arguments, or string (run by bash)
+           kwargs: arguments for subprocess.Popen(); by default, stdout
+                   is a pipe, stderr goes to stdout, and other fds are
+                   closed
+           returns: Popen object"""
+        cmd = args[ 0 ] if len( args ) == 1 else list( args )
+        if isinstance( cmd, str ):
+            cmd = [ 'bash', '-c', cmd ]
+        mnexec = [ 'mnexec', '-d' ]
+        if self.inNamespace:
+            mnexec += [ '-a', str( self.pid ) ]
+        sudo = [ 'sudo', '-E' ] if os.geteuid() != 0 else []
+        kwargs.setdefault( 'stdout', PIPE )
+        kwargs.setdefault( 'stderr', STDOUT )
+        kwargs.setdefault( 'close_fds', True )
+        debug( '*** %s : popen %s\n' % ( self.name, cmd ) )
+        return Popen( sudo + mnexec + list( cmd ), **kwargs )
+
     # Interface management, configuration, and routing
 
     # BL notes: This might be a bit redundant or over-complicated.
@@ -310,17 +697,19 @@ class Node( object ):
             return max( self.ports.values() ) + 1
         return self.portBase
 
-    def addIntf( self, intf, port=None ):
+    def addIntf( self, intf, port=None, move=True ):
         """Add an interface.
            intf: interface name (e.g. nodeN-ethM)
-           port: port number (optional, typically OpenFlow port number)"""
+           port: port number (optional, typically OpenFlow port number)
+           move: move intf into our namespace? (False if it's there already)"""
         if port is None:
             port = self.newPort()
         self.intfs[ port ] = intf
         self.ports[ intf ] = port
+        self.clearAddrs( intf )
         #info( '\n' )
         #info( 'added intf %s:%d to node %s\n' % ( intf,port, self.name ) )
-        if self.inNamespace:
+        if self.inNamespace and move:
             #info( 'moving w/inNamespace set\n' )
             moveIntf( intf, self )
 
@@ -343,25 +732,18 @@ class Node( object ):
     # this class. For a more symmetric API, you can use
     # mininet.util.createLink()
 
-    def linkTo( self, node2, port1=None, port2=None ):
+    def linkTo( self, node2, port1=None, port2=None, mac1=None, mac2=None,
+                mtu=None ):
         """Create link to another node, making two new interfaces.
            node2: Node to link us to
            port1: our port number (optional)
            port2: node2 port number (optional)
+           mac1: our interface's MAC address (optional)
+           mac2: node2 interface's MAC address (optional)
+           mtu: MTU of both interfaces (optional)
            returns: intf1 name, intf2 name"""
-        node1 = self
-        if port1 is None:
-            port1 = node1.newPort()
-        if port2 is None:
-            port2 = node2.newPort()
-        intf1 = node1.intfName( port1 )
-        intf2 = node2.intfName( port2 )
-        makeIntfPair( intf1, intf2 )
-        node1.addIntf( intf1, port1 )
-        node2.addIntf( intf2, port2 )
-        node1.registerIntf( intf1, node2, intf2 )
-        node2.registerIntf( intf2, node1, intf1 )
-        return intf1, intf2
+        params = dict( mac1=mac1, mac2=mac2, mtu=mtu )
+        return createLinks( [ ( self, node2, port1, port2, params ) ] )[ 0 ]
 
     def unlinkFrom( self, node2=None ):
         if node2:
@@ -401,6 +783,7 @@ class Node( object ):
         if port is not None:
             del self.intfs[port]
         del self.ports[intf]
+        self.clearAddrs( intf )
         
         quietRun( 'ip link del ' + intf )
         sleep( 0.001 )
@@ -421,31 +804,124 @@ class Node( object ):
             # Does it help to sleep to let things run?
             sleep( 0.001 )
 
+    # Interface configuration goes through netlink where we can,
+    # and through commands in our shell otherwise
+
+    def nsPid( self ):
+        "Return the pid identifying our network namespace, or None."
+        return self.pid if self.inNamespace else None
+
+    def nlSocket( self ):
+        """Return a netlink socket in our network namespace, or None
+           if links can't be configured via netlink."""
+        if not netlink.available():
+            return None
+        if not self.inNamespace:
+            return netlink.rootSocket()
+        if self.nl is None:
+            self.nl = netlink.NetlinkSocket( self.pid )
+        return self.nl
+
+    def linkMonitor( self ):
+        """Return a netlink.LinkMonitor for our network namespace, or None
+           if netlink isn't available."""
+        if not netlink.available():
+            return None
+        if not self.inNamespace:
+            return netlink.rootMonitor()
+        if self.linkMon is None:
+            self.linkMon = netlink.LinkMonitor( self.pid )
+        return self.linkMon
+
+    def nlConfig( self, intf, msgs ):
+        """Configure an interface via netlink.
+           intf: interface name
+           msgs: function of the interface index returning netlink messages
+           returns: error message, or '' on success"""
+        nl = self.nlSocket()
+        try:
+            index = nl.linkIndex( intf )
+            if index is None:
+                return '%s: No such device\n' % intf
+            nl.check( msgs( index ) )
+        except netlink.NetlinkError, e:
+            return '%s: %s\n' % ( intf, e )
+        return ''
+
     def setMAC( self, intf, mac ):
         """Set the MAC address for an interface.
            mac: MAC address as string"""
-        result = self.cmd( 'ifconfig', intf, 'down' )
-        result += self.cmd( 'ifconfig', intf, 'hw', 'ether', mac )
-        result += self.cmd( 'ifconfig', intf, 'up' )
+        if self.nlSocket():
+            result = self.nlConfig( intf, lambda index: [
+                netlink.setLink( intf, up=False ),
+                netlink.setLink( intf, up=True, mac=mac ) ] )
+        else:
+            result = ''.join( self.cmdBatch( self.setMACCmds( intf, mac ) ) )
+        if result:
+            self.macs.pop( intf, None )
+        else:
+            self.macs[ intf ] = mac
         return result
 
+    def setMACCmds( self, intf, mac ):
+        "Return the shell commands which setMAC() runs without netlink."
+        return [ [ 'ifconfig', intf, 'down' ],
+                 [ 'ifconfig', intf, 'hw', 'ether', mac ],
+                 [ 'ifconfig', intf, 'up' ] ]
+
     def setARP( self, ip, mac ):
         """Add an ARP entry.
            ip: IP address as string
            mac: MAC address as string"""
-        result = self.cmd( 'arp', '-s', ip, mac )
-        return result
+        return self.setARPs( [ ( ip, mac ) ] )
+
+    def setARPs( self, entries, intf=None ):
+        """Add static ARP entries in one operation.
+           entries: list of ( ip, mac ) strings
+           intf: interface for the entries (default: default interface)
+           returns: error messages, or '' on success"""
+        if intf is None:
+            intf = self.defaultIntf()
+        if self.nlSocket():
+            return self.nlConfig( intf, lambda index:
+                [ netlink.newNeigh( index, ip, mac ) for ip, mac in entries ] )
+        return ''.join( self.cmdBatch( self.setARPsCmds( entries, intf ) ) )
+
+    def setARPsCmds( self, entries, intf=None ):
+        "Return the shell commands which setARPs() runs without netlink."
+        if intf is None:
+            intf = self.defaultIntf()
+        lines = [ 'neigh replace %s lladdr %s dev %s nud permanent' %
+                  ( ip, mac, intf ) for ip, mac in entries ]
+        # Feed the entries to a single ip command
+        return [ 'ip -force -batch - <<EOF\n%s\nEOF' % '\n'.join( lines ) ]
 
     def setIP( self, intf, ip, prefixLen=8 ):
         """Set the IP address for an interface.
            intf: interface name
            ip: IP address as a string
            prefixLen: prefix length, e.g. 8 for /8 or 16M addrs"""
-        ipSub = '%s/%d' % ( ip, prefixLen )
-        result = self.cmd( 'ifconfig', intf, ipSub, 'up' )
-        self.ips[ intf ] = ip
+        nl = self.nlSocket()
+        if nl:
+            # Replace any existing addresses, as ifconfig does
+            result = self.nlConfig( intf, lambda index:
+                [ netlink.delAddr( index, *addr )
+                  for addr in nl.addrs( index ) ] +
+                [ netlink.newAddr( index, ip, prefixLen ),
+                  netlink.setLink( intf, up=True ) ] )
+        else:
+            result = ''.join( self.cmdBatch(
+                self.setIPCmds( intf, ip, prefixLen ) ) )
+        if result:
+            self.ips.pop( intf, None )
+        else:
+            self.ips[ intf ] = ip
         return result
 
+    def setIPCmds( self, intf, ip, prefixLen=8 ):
+        "Return the shell commands which setIP() runs without netlink."
+        return [ [ 'ifconfig', intf, '%s/%d' % ( ip, prefixLen ), 'up' ] ]
+
     def setHostRoute( self, ip, intf ):
         """Add route to host.
            ip: IP address as dotted decimal
@@ -455,8 +931,19 @@ class Node( object ):
     def setDefaultRoute( self, intf ):
         """Set the default route to go through intf.
            intf: string, interface name"""
-        self.cmd( 'ip route flush root 0/0' )
-        return self.cmd( 'route add default ' + intf )
+        nl = self.nlSocket()
+        if nl:
+            # Remove every route first, like ip route flush root 0/0
+            flush = [ netlink.delRoute( route ) for route in nl.routes() ]
+            return self.nlConfig( intf, lambda index:
+                                  flush + [ netlink.newRoute( index ) ] )
+        result = self.cmdBatch( self.setDefaultRouteCmds( intf ) )
+        return result[ -1 ]
+
+    def setDefaultRouteCmds( self, intf ):
+        """Return the shell commands which setDefaultRoute() runs
+           without netlink."""
+        return [ 'ip route flush root 0/0', 'route add default ' + intf ]
 
     def defaultIntf( self ):
         "Return interface for lowest port"
@@ -468,24 +955,42 @@ class Node( object ):
     _macMatchRegex = re.compile( r'..:..:..:..:..:..' )
     _ipSubnetMatchRegex = re.compile( r'(\d+\.\d+\.\d+\.\d+)/(\d+)' )
 
-    def IP( self, intf=None ):
-        "Return IP address of a node or specific interface."
+    def IP( self, intf=None, refresh=False ):
+        """Return IP address of a node or specific interface.
+           Addresses are cached, so changes made behind our back (e.g.
+           by running ifconfig in the node) are only seen with refresh.
+           intf: interface name (default: default interface)
+           refresh: read the address from the interface again?"""
         if intf is None:
             intf = self.defaultIntf()
-        if intf and not self.waiting:
+        if intf and ( refresh or intf not in self.ips ) and not self.waiting:
             self.updateIP( intf )
         return self.ips.get( intf, None )
 
-    def MAC( self, intf=None ):
-        "Return MAC address of a node or specific interface."
+    def MAC( self, intf=None, refresh=False ):
+        """Return MAC address of a node or specific interface.
+           Addresses are cached, as for IP().
+           intf: interface name (default: default interface)
+           refresh: read the address from the interface again?"""
         if intf is None:
             intf = self.defaultIntf()
-        if intf and not self.waiting:
+        if intf and ( refresh or intf not in self.macs ) and not self.waiting:
             self.updateMAC( intf )
         return self.macs.get( intf, None )
 
+    def clearAddrs( self, intf ):
+        "Forget the cached addresses of an interface."
+        self.ips.pop( intf, None )
+        self.macs.pop( intf, None )
+
     def updateIP( self, intf ):
         "Update IP address for an interface"
+        nl = self.nlSocket()
+        if nl:
+            index = nl.linkIndex( intf )
+            addrs = nl.addrs( index ) if index else []
+            self.ips[ intf ] = addrs[ 0 ][ 0 ] if addrs else None
+            return
         assert not self.waiting
         ifconfig = self.cmd( 'ifconfig ' + intf )
         ips = self._ipMatchRegex.findall( ifconfig )
@@ -496,6 +1001,12 @@ class Node( object ):
 
     def updateMAC( self, intf ):
         "Update MAC address for an interface"
+        nl = self.nlSocket()
+        if nl:
+            link = nl.link( intf )
+            mac = link and link[ 2 ].get( netlink.IFLA_ADDRESS )
+            self.macs[ intf ] = netlink.macString( mac ) if mac else None
+            return
         assert not self.waiting
         ifconfig = self.cmd( 'ifconfig ' + intf )
         macs = self._macMatchRegex.findall( ifconfig )
@@ -506,8 +1017,131 @@ class Node( object ):
 
     def intfIsUp( self, intf ):
         "Check if an interface is up."
+        nl = self.nlSocket()
+        if nl:
+            link = nl.link( intf )
+            return link is not None and bool( link[ 1 ] & netlink.IFF_UP )
         return 'UP' in self.cmd( 'ifconfig ' + intf )
 
+    def linkState( self, intf ):
+        """Return the state of an interface: 'up' if it is up and running
+           (has a carrier), 'down' otherwise, or None if it doesn't exist.
+           intf: interface name"""
+        monitor = self.linkMonitor()
+        if monitor:
+            return monitor.state( intf )
+        output, status = self.cmd( 'ifconfig ' + intf, exitcode=True )
+        if status:
+            return None
+        return 'up' if 'UP' in output and 'RUNNING' in output else 'down'
+
+    def waitLinkState( self, intfs, state='up', timeout=None ):
+        """Wait until each of a list of interfaces is in a given state,
+           as reported by the kernel's link events (see linkState()).
+           intfs: list of interface names
+           state: 'up', 'down' or None (deleted)
+           timeout: seconds to wait, or None to wait indefinitely
+           returns: True if they are, False on timeout"""
+        monitor = self.linkMonitor()
+        if monitor:
+            return monitor.waitState( intfs, state, timeout )
+        # Without netlink, poll with a short backoff
+        deadline = None if timeout is None else time() + timeout
+        delay = .001
+        while [ intf for intf in intfs if self.linkState( intf ) != state ]:
+            if deadline is not None and time() > deadline:
+                return False
+            sleep( delay )
+            delay = min( 2 * delay, .1 )
+        return True
+
+    def setIntfStatus( self, intf, status ):
+        """Bring an interface up or down.
+           intf: interface name
+           status: string {up, down}
+           returns: error message, or '' on success"""
+        if self.nlSocket():
+            return self.nlConfig( intf, lambda index:
+                [ netlink.setLink( intf, up=( status == 'up' ) ) ] )
+        return self.cmd( 'ifconfig', intf, status )
+
+    # Sockets
+    def sockets( self, proto='tcp' ):
+        """Read the kernel's socket tables for our namespace.
+           proto: 'tcp' or 'udp'
+           returns: list of rows of /proc/net/{proto,proto6}, as lists of
+                    fields (local address, remote address, state, ...
+                    inode are fields 1, 2, 3 and 9)"""
+        rows = []
+        for table in proto, proto + '6':
+            try:
+                f = open( '/proc/%d/net/%s' % ( self.pid, table ) )
+            except IOError:
+                continue
+            # Skip the header line
+            lines = f.readlines()[ 1: ]
+            f.close()
+            rows += [ line.split() for line in lines ]
+        return rows
+
+    def isListening( self, port, udp=False ):
+        """Check whether a socket in our namespace is listening on a port,
+           by reading the kernel's socket table rather than connecting.
+           port: TCP or UDP port number
+           udp: look for a bound UDP socket rather than a TCP listener
+           returns: True if there is such a socket"""
+        # TCP_LISTEN, or TCP_CLOSE for unconnected UDP sockets
+        state = '07' if udp else '0A'
+        suffix = ':%04X' % port
+        for fields in self.sockets( 'udp' if udp else 'tcp' ):
+            if fields[ 1 ].endswith( suffix ) and fields[ 3 ] == state:
+                return True
+        return False
+
+    def isConnected( self, port, pids=None ):
+        """Check whether a TCP socket in our namespace is connected to a
+           (remote) port, by reading the kernel's socket table.
+           port: remote TCP port number
+           pids: only count sockets held open by these processes
+           returns: True if there is such a connection"""
+        suffix = ':%04X' % port
+        # TCP_ESTABLISHED
+        inodes = set( fields[ 9 ] for fields in self.sockets( 'tcp' )
+                      if fields[ 2 ].endswith( suffix ) and
+                      fields[ 3 ] == '01' )
+        if pids is None or not inodes:
+            return bool( inodes )
+        for pid in pids:
+            fdDir = '/proc/%d/fd' % pid
+            try:
+                fds = os.listdir( fdDir )
+            except OSError:
+                continue
+            for fd in fds:
+                try:
+                    link = os.readlink( os.path.join( fdDir, fd ) )
+                except OSError:
+                    continue
+                # socket:[inode]
+                if link.startswith( 'socket:' ) and link[ 8:-1 ] in inodes:
+                    return True
+        return False
+
+    def waitListening( self, port, udp=False, timeout=None ):
+        """Wait until a socket in our namespace is listening on a port.
+           port: TCP or UDP port number
+           udp: wait for a bound UDP socket rather than a TCP listener
+           timeout: seconds to wait, or None to wait indefinitely
+           returns: True if the port is listening"""
+        deadline = None if timeout is None else time() + timeout
+        delay = .001
+        while not self.isListening( port, udp ):
+            if deadline is not None and time() > deadline:
+                return False
+            sleep( delay )
+            delay = min( 2 * delay, .05 )
+        return True
+
     # Other methods
     def __str__( self ):
         intfs = sorted( self.intfs.values() )
@@ -535,11 +1169,13 @@ class Host( Node ):
         self.cmd("ifconfig %s inet 0.0.0.0" % intf)
         self.cmd("vconfig add %s %d" % (intf, vlan))
         self.cmd("ifconfig %s.%d inet %s/%s" % (intf, vlan, ip, prefixLen) )
+        self.clearAddrs( intf )
         # Make the new vlan interface the default intf
         port = self.ports[intf]
         intf = "%s.%d" % (intf, vlan)
         self.intfs[ port ] = intf
         self.ports[ intf ] = port
+        self.ips[ intf ] = ip
 
 
 class Switch( Node ):
@@ -571,9 +1207,38 @@ class Switch( Node ):
 
     def startIntfs( self ):
         "Default function to start interfaces"
-        self.cmd("ifconfig lo up")
-        for intf in self.intfs.values():
-            self.cmd("ifconfig " + intf + " up" )
+        self.cmdBatch( [ 'ifconfig lo up' ] +
+                       [ 'ifconfig ' + intf + ' up'
+                         for intf in self.intfs.values() ] )
+
+    @classmethod
+    def batchStartup( cls, switches, controllers ):
+        """Start several switches of this class. Subclasses may override
+           this to start them all at once rather than one at a time.
+           switches: list of switches
+           controllers: list of controllers"""
+        for switch in switches:
+            switch.start( controllers )
+
+    def connected( self, controllers ):
+        """Is the switch ready, i.e. connected to one of its controllers?
+           By default, look for an established connection to a controller
+           from one of the background jobs in our shell (ofprotocol,
+           ovs-openflowd, ...). A switch without such jobs (e.g. a Linux
+           bridge) is always ready; without controllers, a switch is
+           ready once it listens on its listenPort, if any.
+           controllers: list of controllers
+           returns: True if the switch is ready"""
+        if not controllers:
+            return not self.listenPort or self.isListening( self.listenPort )
+        pids = [ int( pid ) for pid in self.cmd( 'jobs -p' ).split()
+                 if pid.isdigit() ]
+        if not pids:
+            return True
+        for controller in controllers:
+            if self.isConnected( controller.port, pids ):
+                return True
+        return False
 
     def sendCmd( self, *cmd, **kwargs ):
         """Send command to Node.
@@ -606,14 +1271,22 @@ class LinuxBridge( Switch ):
                 print "Cleaning old bridge lxbr-%s" % m.group(1)
                 self.cmd ('brctl', 'delbr', 'lxbr-%s' % m.group(1))
 
+    # Seconds to wait for the bridge to start forwarding
+    forwardTimeout = 10
+
     def start(self, controllers):
         self.startIntfs()
         self.cmd('brctl', 'addbr', self.dp)
         self.cmd('brctl', 'stp', self.dp, 'on')
+        # Set the forward delay before the ports start listening
+        self.cmd('brctl', 'setfd', self.dp, '2')
         for port, intf in self.intfs.items():
             self.doadd(intf)
         self.cmd('ifconfig', self.dp, 'up')
-        self.cmd('brctl', 'setfd', self.dp, '2')
+        # The bridge has a carrier once one of its ports is forwarding
+        if self.intfs and not self.waitLinkState( [ self.dp ], 'up',
+                                                  self.forwardTimeout ):
+            error( '*** Error: %s is not forwarding\n' % self.dp )
 
     def stop( self ):
         "Terminate kernel datapath."
@@ -624,8 +1297,8 @@ class LinuxBridge( Switch ):
     def doadd ( self, intf ):
         self.cmd('brctl', 'addif', self.dp, intf)
 
-    def addIntf( self, intf, port ):
-        super(LinuxBridge, self).addIntf(intf, port)
+    def addIntf( self, intf, port, move=True ):
+        super(LinuxBridge, self).addIntf(intf, port, move)
         self.doadd(intf)
     
     def deleteIntf( self, intf ):
@@ -643,8 +1316,6 @@ class UserSwitch( Switch ):
         Switch.__init__( self, name, **kwargs )
         pathCheck( 'ofdatapath', 'ofprotocol',
             moduleName='the OpenFlow reference user switch (openflow.org)' )
-        self.killjob('%ofdatapath')
-        self.killjob('%ofprotocol')
 
     @staticmethod
     def setup():
@@ -657,6 +1328,9 @@ class UserSwitch( Switch ):
            Log to /tmp/sN-{ofd,ofp}.log.
            controllers: list of controller objects"""
         self.saved_contr = controllers
+        # Stop the datapath of an earlier start(), if any; this is done
+        # here rather than in __init__(), which doesn't wait for the shell
+        self.stopprocs()
 
         ofdlog = '/tmp/' + self.name + '-ofd.log'
         ofplog = '/tmp/' + self.name + '-ofp.log'
@@ -677,31 +1351,61 @@ class UserSwitch( Switch ):
             ' --fail=closed ' + self.opts +
             ' 1> ' + ofplog + ' 2>' + ofplog + ' &' )
 
-    def killjob( self, job ):
-        self.cmd('kill %s' % job)
-        self.cmd('if jobs -l %s; then sleep 1; kill -9 %s; fi' % (job, job))
+    def killjob( self, job, timeout=1 ):
+        """Kill a background job, waiting for it to exit rather than
+           for a fixed time, and kill -9 it if it doesn't exit in time.
+           job: job spec, e.g. %ofdatapath
+           timeout: seconds to wait before kill -9"""
+        self.cmd( 'if kill %s 2>/dev/null; then'
+                  ' for i in $(seq %d); do'
+                  ' kill -0 %s 2>/dev/null || break; sleep .01; done;'
+                  ' kill -9 %s 2>/dev/null; wait %s 2>/dev/null; fi'
+                  % ( job, int( timeout * 100 ), job, job, job ) )
 
     def stopprocs( self ):
         self.killjob('%ofdatapath')
         self.killjob('%ofprotocol')
 
     def restart( self ):
+        "Restart the datapath (start() stops the old one)."
         if (self.saved_contr):
-            self.stopprocs()
             self.start(self.saved_contr)
         
     def stop( self ):
         "Stop OpenFlow reference user datapath."
+        self.saved_contr = None
         self.stopprocs()
         self.deleteIntfs()
 
-    def addIntf( self, intf, port ):
-        super(UserSwitch, self).addIntf(intf, port)
-        self.restart()
+    def dpctl( self, *args ):
+        """Run dpctl against our running datapath.
+           args: dpctl command and arguments
+           returns: True if it succeeded"""
+        output, status = self.cmd( 'dpctl', args[ 0 ],
+                                   'unix:/tmp/' + self.name, *args[ 1: ],
+                                   exitcode=True )
+        if status:
+            debug( '*** %s: dpctl %s failed: %s' % ( self.name,
+                                                     ' '.join( args ),
+                                                     output ) )
+        return status == 0
+
+    def addIntf( self, intf, port, move=True ):
+        """Add an interface, and add it as a port of the running
+           datapath (if any), restarting the datapath only if that fails."""
+        super(UserSwitch, self).addIntf(intf, port, move)
+        if self.saved_contr:
+            self.cmd( 'ifconfig', intf, 'up' )
+            if not self.dpctl( 'add-port', intf ):
+                self.restart()
     
     def deleteIntf( self, intf ):
+        """Remove an interface from the running datapath (if any) and
+           delete it, restarting the datapath only if removing it fails."""
+        removed = not self.saved_contr or self.dpctl( 'del-port', intf )
         super(UserSwitch, self).deleteIntf(intf)
-        self.restart()
+        if not removed:
+            self.restart()
 
 class KernelSwitch( Switch ):
     """Kernel-space switch.
@@ -766,6 +1470,11 @@ class OVSKernelSwitchNew( Switch ):
     numSwitch = 0
     ovsdbServerPid = None
     ovsVswitchdPid = None
+    db = None  # connection to ovsdb-server (see mininet.ovsdb), if any
+    # Maximum number of ovs-vsctl commands per startBatch() transaction
+    batchSize = 2000
+    # Seconds to wait for a startBatch() transaction
+    batchTimeout = 60
 
     def __init__( self, name, dp=None, **kwargs ):
         """Init.
@@ -775,6 +1484,9 @@ class OVSKernelSwitchNew( Switch ):
         Switch.__init__( self, name, **kwargs )
         self.dp = 'mn-dp%i' % dp
         self.intf = self.dp
+        # Has our bridge been created? Until then, ports are only
+        # recorded, and added when the bridge is (see startBatch())
+        self.started = False
         OVSKernelSwitchNew.numSwitch += 1
         if self.inNamespace:
             error( "OVSKernelSwitch currently only works"
@@ -787,6 +1499,11 @@ class OVSKernelSwitchNew( Switch ):
         moduleName='Open vSwitch (openvswitch.org)'
         pathCheck( 'ovs-vsctl', 'ovsdb-server', 'ovs-vswitchd', moduleName=moduleName )
 
+        # Don't leak the connection made for a previous network
+        if OVSKernelSwitchNew.db:
+            OVSKernelSwitchNew.db.close()
+            OVSKernelSwitchNew.db = None
+
         output = quietRun('ovs-vsctl --version')
         if "1.7" in output:
             # The kernel module name is changed some time in 2012
@@ -835,6 +1552,7 @@ class OVSKernelSwitchNew( Switch ):
             # Append ovs-vsctl with database information
             OVSKernelSwitchNew.vsctl_cmd = \
                 'ovs-vsctl -t 2 --db=unix:%s ' % dbSockPath
+            OVSKernelSwitchNew.db = ovsdb.connect( dbSockPath )
 
             # Save the pids of ovsdb-server and ovs-vswitchd
             OVSKernelSwitchNew.ovsdbServerPid = \
@@ -843,8 +1561,16 @@ class OVSKernelSwitchNew( Switch ):
                 int(file(ovsVswitchdPidPath).read().strip())
         else:
             OVSKernelSwitchNew.vsctl_cmd = 'ovs-vsctl -t 2 '
+            OVSKernelSwitchNew.db = ovsdb.connect()
 
         # Remove old mininet datapaths to make sure they don't interfere
+        db = OVSKernelSwitchNew.db
+        if db:
+            db.apply( db.delBridgesOps(
+                [ uuid for name, uuid in db.bridges().items()
+                  if re.match( '^mn-dp[0-9]+$', name ) ] ),
+                timeout=OVSKernelSwitchNew.batchTimeout )
+            return
         brlist = quietRun ( OVSKernelSwitchNew.vsctl_cmd + ' list-br' )
         for line in brlist.split("\n"):
             line = line.rstrip()
@@ -854,55 +1580,200 @@ class OVSKernelSwitchNew( Switch ):
 
     def start( self, controllers, failopen=False ):
         "Start up kernel datapath."
-        self.startIntfs()
-        # Delete local datapath if it exists;
-        # then create a new one monitoring the given interfaces
-        quietRun( self.vsctl_cmd + ' -- --if-exists del-br ' + self.dp )
-        self.cmd( self.vsctl_cmd + ' add-br ' + self.dp )
+        self.startBatch( [ self ], controllers, failopen )
+
+    def bridgeConfig( self, controllers, failopen=False ):
+        """Return the configuration of our datapath.
+           controllers: list of controllers
+           failopen: act as a learning switch without a controller?
+           returns: fail mode, dict of other-config settings,
+                    list of interfaces, list of controller targets"""
         failmode = 'secure'
         if (failopen):
             failmode = 'standalone'
-        self.cmd('%s set-fail-mode %s %s '  % (self.vsctl_cmd, self.dp, failmode))
-        mac_str = ''
+        otherConfig = {}
         if self.defaultMAC:
             # ovs-openflowd expects a string of exactly 16 hex digits with no
             # colons.
-            dpid_str = '0000' + \
-                      ''.join( self.defaultMAC.split( ':' ) ) + ' '
-            self.cmd(self.vsctl_cmd + ' --no-wait set bridge %s other-config:datapath_type=system other-config:datapath-id=%s' % (self.dp, dpid_str))
+            dpid_str = '0000' + ''.join( self.defaultMAC.split( ':' ) )
+            otherConfig = { 'datapath_type': 'system',
+                            'datapath-id': dpid_str }
         ports = sorted( self.ports.values() )
         if len( ports ) != ports[ -1 ] + 1 - self.portBase:
             raise Exception( 'only contiguous, one-indexed port ranges '
                             'supported: %s' % self.intfs )
         intfs = [ self.intfs[ port ] for port in ports ]
-        for i in intfs:
-            self.cmd( self.vsctl_cmd, 'add-port', self.dp, i ) 
-        if (controllers != None and len(controllers)):
-            self.cmd( self.vsctl_cmd + ' set-controller ' + self.dp +
-                      ' '.join( [ ' tcp:%s:%d' % ( c.IP(), c.port ) \
-                      for c in controllers ] ))
-        self.execed = False
+        targets = [ 'tcp:%s:%d' % ( c.IP(), c.port )
+                    for c in controllers or [] ]
+        return failmode, otherConfig, intfs, targets
+
+    def startCmds( self, controllers, failopen=False ):
+        """Return the ovs-vsctl commands which (re)create our datapath,
+           as a list of lists of arguments, to be run as part of a
+           single transaction.
+           controllers: list of controllers
+           failopen: act as a learning switch without a controller?"""
+        failmode, otherConfig, intfs, targets = self.bridgeConfig(
+            controllers, failopen )
+        # Delete local datapath if it exists;
+        # then create a new one monitoring the given interfaces
+        cmds = [ [ '--if-exists', 'del-br', self.dp ],
+                 [ 'add-br', self.dp ],
+                 [ 'set-fail-mode', self.dp, failmode ] ]
+        if otherConfig:
+            cmds.append( [ 'set', 'bridge', self.dp ] +
+                         [ 'other-config:%s=%s' % item
+                           for item in sorted( otherConfig.items() ) ] )
+        cmds += [ [ 'add-port', self.dp, intf ] for intf in intfs ]
+        if targets:
+            cmds.append( [ 'set-controller', self.dp ] + targets )
+        return cmds
+
+    def startOps( self, bridges, controllers, failopen=False ):
+        """Return the OVSDB operations which (re)create our datapath.
+           bridges: dict of existing bridge names to uuids
+           controllers: list of controllers
+           failopen: act as a learning switch without a controller?"""
+        failmode, otherConfig, intfs, targets = self.bridgeConfig(
+            controllers, failopen )
+        ops = []
+        if self.dp in bridges:
+            ops += self.db.delBridgesOps( [ bridges[ self.dp ] ] )
+        return ops + self.db.addBridgeOps( self.dp, intfs, failmode,
+                                           otherConfig, targets )
+
+    @classmethod
+    def batchStartup( cls, switches, controllers, failopen=False ):
+        """Start several switches, batching them with startBatch().
+           Switches whose class overrides start() are started with it
+           instead, so that the override isn't skipped.
+           switches: list of switches
+           controllers: list of controllers
+           failopen: act as learning switches without a controller?"""
+        start = OVSKernelSwitchNew.start.im_func
+        batch = [ switch for switch in switches
+                  if type( switch ).start.im_func is start ]
+        if batch:
+            cls.startBatch( batch, controllers, failopen )
+        for switch in switches:
+            if type( switch ).start.im_func is not start:
+                switch.start( controllers )
+
+    @classmethod
+    def startBatch( cls, switches, controllers, failopen=False ):
+        """Start several switches with as few OVSDB transactions as
+           possible: each transaction makes vswitchd reconfigure itself,
+           so we combine the commands for many switches into a single
+           ovs-vsctl invocation (of at most batchSize commands).
+           switches: list of switches
+           controllers: list of controllers
+           failopen: act as learning switches without a controller?"""
+        for switch in switches:
+            switch.startIntfs()
+        if cls.db:
+            cls.dbStartup( switches, controllers, failopen )
+            return
+        # A later -t overrides the default timeout in vsctl_cmd, since
+        # a big transaction takes longer to apply
+        vsctl = cls.vsctl_cmd.split() + [ '-t', str( cls.batchTimeout ) ]
+        chunk = []
+        for index, switch in enumerate( switches ):
+            chunk += switch.startCmds( controllers, failopen )
+            last = index == len( switches ) - 1
+            if chunk and ( last or len( chunk ) >= cls.batchSize ):
+                args = []
+                for cmd in chunk:
+                    args += [ '--' ] + cmd
+                output, status = errRun( vsctl + args )
+                if status:
+                    error( '*** Error: ovs-vsctl failed: %s' % output )
+                chunk = []
+        for switch in switches:
+            switch.execed = False
+            switch.started = True
+
+    @classmethod
+    def dbStartup( cls, switches, controllers, failopen=False ):
+        """Start several switches as startBatch() does, talking to
+           ovsdb-server directly (see mininet.ovsdb)."""
+        bridges = cls.db.bridges()
+        ops = []
+        for index, switch in enumerate( switches ):
+            ops += switch.startOps( bridges, controllers, failopen )
+            last = index == len( switches ) - 1
+            if ops and ( last or len( ops ) >= cls.batchSize ):
+                try:
+                    if not cls.db.apply( ops, timeout=cls.batchTimeout ):
+                        error( '*** Error: timed out waiting for '
+                               'ovs-vswitchd\n' )
+                except ovsdb.OVSDBError, e:
+                    error( '*** Error: ovsdb-server: %s\n' % e )
+                ops = []
+        for switch in switches:
+            switch.execed = False
+            switch.started = True
+
+    def connected( self, controllers ):
+        """Is the switch connected to one of its controllers? Asks
+           ovsdb-server, which reports each controller's is_connected
+           state as ovs-vswitchd sees it."""
+        if not controllers:
+            return True
+        if self.db:
+            return True in self.db.controllersConnected( self.dp )
+        uuids = quietRun( self.vsctl_cmd + ' --bare get Bridge ' + self.dp +
+                          ' controller' ).strip( '[] \n' ).split( ', ' )
+        for uuid in uuids:
+            if uuid and quietRun( self.vsctl_cmd + ' get Controller ' + uuid +
+                                  ' is_connected' ).strip() == 'true':
+                return True
+        return False
 
     def stop( self ):
         "Terminate kernel datapath."
-        quietRun( self.vsctl_cmd + ' -- --if-exists del-br ' + self.dp )
+        if self.db:
+            self.db.apply( self.db.delBridgesOps(
+                [ uuid for name, uuid in self.db.bridges().items()
+                  if name == self.dp ] ), timeout=self.batchTimeout )
+        else:
+            quietRun( self.vsctl_cmd + ' -- --if-exists del-br ' + self.dp )
+        self.started = False
         self.deleteIntfs()
         OVSKernelSwitchNew.numSwitch -= 1
 
         # Stop ovsdb-server and ovs-vswitchd if applicable
         if OVSKernelSwitchNew.numSwitch == 0:
+            if OVSKernelSwitchNew.db:
+                OVSKernelSwitchNew.db.close()
+                OVSKernelSwitchNew.db = None
             if OVSKernelSwitchNew.ovsdbServerPid:
                 quietRun("kill %d" % OVSKernelSwitchNew.ovsdbServerPid)
             if OVSKernelSwitchNew.ovsVswitchdPid:
                 quietRun("kill %d" % OVSKernelSwitchNew.ovsVswitchdPid)
 
-    def addIntf( self, intf, port ):
-        super(OVSKernelSwitchNew, self).addIntf(intf, port)
-        self.cmd( self.vsctl_cmd + ' -- --may-exist', 'add-port', self.dp, intf )
+    def addIntf( self, intf, port, move=True ):
+        """Add an interface, and add it as a port of our bridge if it
+           is running (otherwise the port is added when it starts)."""
+        super(OVSKernelSwitchNew, self).addIntf(intf, port, move)
+        if not self.started:
+            return
+        if self.db:
+            self.db.apply( self.db.addPortOps( self.dp, intf ),
+                           timeout=self.batchTimeout )
+        else:
+            self.cmd( self.vsctl_cmd + ' -- --may-exist', 'add-port', self.dp, intf )
     
     def deleteIntf( self, intf ):
+        """Delete an interface, removing its port from our bridge if
+           it is running."""
         super(OVSKernelSwitchNew, self).deleteIntf(intf)
-        self.cmd( self.vsctl_cmd, ' -- --if-exists', 'del-port', self.dp, intf )
+        if not self.started:
+            return
+        if self.db:
+            self.db.apply( self.db.delPortOps( self.dp, intf ),
+                           timeout=self.batchTimeout )
+        else:
+            self.cmd( self.vsctl_cmd, ' -- --if-exists', 'del-port', self.dp, intf )
 
 
 class OVSKernelSwitch( Switch ):
@@ -969,8 +1840,8 @@ class OVSKernelSwitch( Switch ):
         self.cmd( 'kill %ovs-openflowd' )
         self.deleteIntfs()
 
-    def addIntf( self, intf, port ):
-        super(OVSKernelSwitch, self).addIntf(intf, port)
+    def addIntf( self, intf, port, move=True ):
+        super(OVSKernelSwitch, self).addIntf(intf, port, move)
         self.cmd( 'ovs-dpctl', 'add-if', self.dp, intf )
     
     def deleteIntf( self, intf ):
@@ -1084,9 +1955,13 @@ class Controller( Node ):
         self.cmd( 'kill %' + self.command )
         self.terminate()
 
-    def IP( self, intf=None ):
+    def listening( self ):
+        "Is the controller accepting connections from switches?"
+        return self.isListening( self.port )
+
+    def IP( self, intf=None, refresh=False ):
         "Return IP address of the Controller"
-        ip = Node.IP( self, intf=intf )
+        ip = Node.IP( self, intf=intf, refresh=refresh )
         if ip is None:
             ip = self.defaultIP
         return ip
@@ -1145,3 +2020,16 @@ class RemoteController( Controller ):
     def stop( self ):
         "Overridden to do nothing."
         return
+
+    def listening( self ):
+        """Is the controller accepting connections? We can't read a
+           remote controller's socket table, so try to connect to it."""
+        sock = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        sock.settimeout( 1 )
+        try:
+            sock.connect( ( self.IP(), self.port ) )
+            return True
+        except socket.error:
+            return False
+        finally:
+            sock.close()
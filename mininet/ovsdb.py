@@ -0,0 +1,341 @@
+"""
+Minimal OVSDB client for Mininet.
+
+ovs-vsctl is a separate process, with its own connection to
+ovsdb-server, for every command we run, and we have to parse its text
+output. Instead, this module talks to ovsdb-server directly, using
+the JSON-RPC protocol of RFC 7047 over its unix socket, and keeps a
+single connection open:
+
+- transact() runs a list of OVSDB operations as one transaction;
+
+- monitor() subscribes to changes to a set of tables and columns: the
+  callback is passed the current contents of the tables, and then each
+  set of changes as ovsdb-server reports it.
+
+Updates are only received while we are reading from the connection,
+which happens whenever we wait for a reply, or when dispatch() is
+called. To stream updates while an experiment runs, register the
+connection with the shared reactor (see mininet.reactor), e.g.
+
+    db = OVSKernelSwitchNew.db
+    db.monitor( { 'Interface': [ 'name', 'statistics' ] }, callback )
+    reactor.addReader( db.fileno(), db.dispatch )
+
+There are also helpers for the Open_vSwitch database operations that
+Mininet's switches need (creating and deleting bridges and ports), and
+apply(), which commits a transaction and, like ovs-vsctl, waits for
+ovs-vswitchd to reconfigure itself accordingly.
+"""
+
+import json
+import socket
+from time import sleep, time
+
+DBSOCK = '/var/run/openvswitch/db.sock'
+
+class OVSDBError( Exception ):
+    "Error reported by ovsdb-server, or lost connection."
+    pass
+
+def ovsSet( items ):
+    "Return an OVSDB set of a list of atoms."
+    return [ 'set', list( items ) ]
+
+def ovsMap( pairs ):
+    "Return an OVSDB map of a dict."
+    return [ 'map', [ [ key, value ]
+                      for key, value in sorted( pairs.items() ) ] ]
+
+def atoms( value ):
+    "Return the atoms of an OVSDB set, or of a single atom."
+    if isinstance( value, list ) and value and value[ 0 ] == 'set':
+        return value[ 1 ]
+    return [ value ]
+
+def namedUuid( name ):
+    "Return a reference to a row inserted by the same transaction."
+    return [ 'named-uuid', name ]
+
+class OVSDB( object ):
+    "JSON-RPC connection to ovsdb-server."
+
+    def __init__( self, path=DBSOCK, db='Open_vSwitch' ):
+        """path: ovsdb-server's unix socket
+           db: database name"""
+        self.path = path
+        self.db = db
+        self.sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        self.sock.connect( path )
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.nextId = 0
+        self.replies = {}  # replies not yet collected, by request id
+        self.monitors = {}  # monitor callbacks, by monitor id
+        self.rowCount = 0  # for naming inserted rows
+
+    def fileno( self ):
+        "Return our socket's fd, so that we can be polled."
+        return self.sock.fileno()
+
+    def close( self ):
+        "Close the connection."
+        self.sock.close()
+
+    # JSON-RPC
+
+    def send( self, message ):
+        """Send a JSON-RPC message.
+           message: dict"""
+        self.sock.sendall( json.dumps( message ) )
+
+    def receive( self ):
+        "Read and handle at least one message; blocks if none has arrived."
+        data = self.sock.recv( 65536 )
+        if not data:
+            raise OVSDBError( 'connection to %s closed' % self.path )
+        self.buf += data
+        # Messages are simply concatenated JSON objects
+        while True:
+            self.buf = self.buf.lstrip()
+            if not self.buf:
+                break
+            try:
+                message, end = self.decoder.raw_decode( self.buf )
+            except ValueError:
+                # Incomplete message
+                break
+            self.buf = self.buf[ end: ]
+            self.handle( message )
+
+    def handle( self, message ):
+        """Handle a message from ovsdb-server.
+           message: dict"""
+        method = message.get( 'method' )
+        if method == 'echo':
+            # Keepalive
+            self.send( { 'id': message[ 'id' ], 'result': message[ 'params' ],
+                         'error': None } )
+        elif method == 'update':
+            monitorId, updates = message[ 'params' ]
+            callback = self.monitors.get( monitorId )
+            if callback:
+                callback( updates )
+        elif method is None:
+            self.replies[ message.get( 'id' ) ] = message
+
+    def dispatch( self ):
+        "Handle messages which have arrived, e.g. monitor updates."
+        self.receive()
+
+    def call( self, method, params ):
+        """Send a request and wait for its result.
+           method: method name
+           params: list of parameters
+           returns: result"""
+        requestId = self.nextId
+        self.nextId += 1
+        self.send( { 'method': method, 'params': params, 'id': requestId } )
+        while requestId not in self.replies:
+            self.receive()
+        reply = self.replies.pop( requestId )
+        if reply.get( 'error' ):
+            raise OVSDBError( reply[ 'error' ] )
+        return reply[ 'result' ]
+
+    def transact( self, *ops ):
+        """Run a list of operations as a single transaction.
+           ops: operations (dicts, see RFC 7047)
+           returns: list of results, one per operation"""
+        results = self.call( 'transact', [ self.db ] + list( ops ) )
+        for result in results:
+            if result and 'error' in result:
+                raise OVSDBError( '%s: %s' % ( result[ 'error' ],
+                                               result.get( 'details', '' ) ) )
+        return results
+
+    def monitor( self, tables, callback ):
+        """Subscribe to changes to a set of tables.
+           tables: dict of table name -> list of columns (None for all)
+           callback: function of a dict of table name -> dict of
+                     row uuid -> { 'old': row, 'new': row }; it is
+                     called with the current contents of the tables,
+                     and again with each change
+           returns: monitor id, for cancel()"""
+        monitorId = 'mon%d' % self.nextId
+        requests = dict( ( table, { 'columns': columns } if columns else {} )
+                         for table, columns in tables.items() )
+        self.monitors[ monitorId ] = callback
+        callback( self.call( 'monitor', [ self.db, monitorId, requests ] ) )
+        return monitorId
+
+    def cancel( self, monitorId ):
+        "Cancel a monitor."
+        self.call( 'monitor_cancel', [ monitorId ] )
+        del self.monitors[ monitorId ]
+
+    # Open_vSwitch database operations
+
+    def rowName( self ):
+        "Return a new name for a row to be inserted."
+        self.rowCount += 1
+        return 'row%d' % self.rowCount
+
+    def select( self, table, columns, where=() ):
+        """Return the rows of a table.
+           table: table name
+           columns: list of columns to return
+           where: list of conditions
+           returns: list of rows (dicts)"""
+        return self.transact( { 'op': 'select', 'table': table,
+                                'where': list( where ),
+                                'columns': columns } )[ 0 ][ 'rows' ]
+
+    def bridges( self ):
+        "Return a dict of bridge names to uuids."
+        return dict( ( row[ 'name' ], row[ '_uuid' ] )
+                     for row in self.select( 'Bridge', [ 'name', '_uuid' ] ) )
+
+    def delBridgesOps( self, uuids ):
+        """Return the operations which delete a list of bridges.
+           (Their ports and interfaces go away with them, since nothing
+           refers to them any more.)
+           uuids: list of bridge uuids"""
+        if not uuids:
+            return []
+        return [ { 'op': 'mutate', 'table': 'Open_vSwitch', 'where': [],
+                   'mutations': [ [ 'bridges', 'delete', ovsSet( uuids ) ] ] } ]
+
+    def portOps( self, intf, intfType=None ):
+        """Return the operations which insert a port with one interface.
+           intf: port and interface name
+           intfType: interface type, e.g. 'internal'
+           returns: name of the inserted port row, operations"""
+        intfRow, portRow = self.rowName(), self.rowName()
+        interface = { 'name': intf }
+        if intfType:
+            interface[ 'type' ] = intfType
+        return portRow, [
+            { 'op': 'insert', 'table': 'Interface', 'row': interface,
+              'uuid-name': intfRow },
+            { 'op': 'insert', 'table': 'Port', 'uuid-name': portRow,
+              'row': { 'name': intf,
+                       'interfaces': namedUuid( intfRow ) } } ]
+
+    def addBridgeOps( self, name, intfs, failMode=None, otherConfig=None,
+                      controllers=() ):
+        """Return the operations which create a bridge, as ovs-vsctl
+           add-br, add-port, set-fail-mode and set-controller would.
+           name: bridge name
+           intfs: list of interfaces to add as ports
+           failMode: 'secure' or 'standalone'
+           otherConfig: dict of other-config settings
+           controllers: list of controller targets, e.g. 'tcp:ip:port'"""
+        # The bridge's own (internal) port comes first
+        portRow, ops = self.portOps( name, 'internal' )
+        ports = [ portRow ]
+        for intf in intfs:
+            portRow, portOps = self.portOps( intf )
+            ports.append( portRow )
+            ops += portOps
+        bridge = { 'name': name,
+                   'ports': ovsSet( namedUuid( port ) for port in ports ) }
+        if failMode:
+            bridge[ 'fail_mode' ] = failMode
+        if otherConfig:
+            bridge[ 'other_config' ] = ovsMap( otherConfig )
+        if controllers:
+            rows = []
+            for target in controllers:
+                rows.append( self.rowName() )
+                ops.append( { 'op': 'insert', 'table': 'Controller',
+                              'row': { 'target': target },
+                              'uuid-name': rows[ -1 ] } )
+            bridge[ 'controller' ] = ovsSet( namedUuid( row )
+                                             for row in rows )
+        bridgeRow = self.rowName()
+        ops += [ { 'op': 'insert', 'table': 'Bridge', 'row': bridge,
+                   'uuid-name': bridgeRow },
+                 { 'op': 'mutate', 'table': 'Open_vSwitch', 'where': [],
+                   'mutations': [ [ 'bridges', 'insert',
+                                    ovsSet( [ namedUuid( bridgeRow ) ] ) ] ] } ]
+        return ops
+
+    def addPortOps( self, bridge, intf ):
+        """Return the operations which add a port to a bridge, unless
+           the port exists already (like ovs-vsctl --may-exist add-port).
+           bridge: bridge name
+           intf: interface name"""
+        if self.select( 'Port', [ '_uuid' ], [ [ 'name', '==', intf ] ] ):
+            return []
+        portRow, ops = self.portOps( intf )
+        return ops + [
+            { 'op': 'mutate', 'table': 'Bridge',
+              'where': [ [ 'name', '==', bridge ] ],
+              'mutations': [ [ 'ports', 'insert',
+                               ovsSet( [ namedUuid( portRow ) ] ) ] ] } ]
+
+    def delPortOps( self, bridge, intf ):
+        """Return the operations which remove a port from a bridge.
+           bridge: bridge name
+           intf: port name"""
+        ports = self.select( 'Port', [ '_uuid' ], [ [ 'name', '==', intf ] ] )
+        if not ports:
+            return []
+        return [ { 'op': 'mutate', 'table': 'Bridge',
+                   'where': [ [ 'name', '==', bridge ] ],
+                   'mutations': [ [ 'ports', 'delete',
+                                    ovsSet( row[ '_uuid' ]
+                                            for row in ports ) ] ] } ]
+
+    def controllersConnected( self, bridge ):
+        """Return whether ovs-vswitchd is connected to each controller of
+           a bridge.
+           bridge: bridge name
+           returns: list of booleans, one per controller"""
+        rows = self.select( 'Bridge', [ 'controller' ],
+                            [ [ 'name', '==', bridge ] ] )
+        if not rows:
+            return []
+        uuids = set( uuid for _kind, uuid
+                     in atoms( rows[ 0 ][ 'controller' ] ) )
+        return [ row[ 'is_connected' ] for row in
+                 self.select( 'Controller', [ '_uuid', 'is_connected' ] )
+                 if row[ '_uuid' ][ 1 ] in uuids ]
+
+    def apply( self, ops, wait=True, timeout=None ):
+        """Commit a list of operations as one transaction and, as
+           ovs-vsctl does, wait for ovs-vswitchd to apply the new
+           configuration.
+           ops: list of operations
+           wait: wait for ovs-vswitchd?
+           timeout: seconds to wait, or None to wait indefinitely
+           returns: True if the configuration was applied (in time)"""
+        if not ops:
+            return True
+        ops = list( ops ) + [
+            { 'op': 'mutate', 'table': 'Open_vSwitch', 'where': [],
+              'mutations': [ [ 'next_cfg', '+=', 1 ] ] },
+            { 'op': 'select', 'table': 'Open_vSwitch', 'where': [],
+              'columns': [ 'next_cfg' ] } ]
+        cfg = self.transact( *ops )[ -1 ][ 'rows' ][ 0 ][ 'next_cfg' ]
+        if not wait:
+            return True
+        deadline = None if timeout is None else time() + timeout
+        delay = .001
+        while self.select( 'Open_vSwitch', [ 'cur_cfg' ] )[ 0 ][
+                'cur_cfg' ] < cfg:
+            if deadline is not None and time() > deadline:
+                return False
+            sleep( delay )
+            delay = min( 2 * delay, .05 )
+        return True
+
+def connect( path=DBSOCK ):
+    """Connect to ovsdb-server.
+       path: ovsdb-server's unix socket
+       returns: OVSDB, or None if ovsdb-server isn't listening there"""
+    try:
+        return OVSDB( path )
+    except socket.error:
+        return None
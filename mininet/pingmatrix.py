@@ -0,0 +1,172 @@
+"""
+Ping result matrix for Mininet.
+
+Mininet.pingMatrix() pings every ordered pair of a set of hosts and
+records the results in a PingMatrix: for each source/destination pair,
+the number of packets sent and received and the average round trip
+time in ms.
+
+The counts and RTTs are stored as NumPy arrays when NumPy is available,
+so that they can be analyzed directly (e.g. matrix.rtt.mean()), and as
+lists of lists otherwise; either way matrix.sent[ i ][ j ] is the number
+of packets sent from host i to host j. RTTs of pairs which received no
+replies are NaN with NumPy and None without it.
+"""
+
+import json
+import re
+
+from mininet.log import error
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class PingMatrix( object ):
+    "Reachability and RTT matrix for pings between a set of hosts."
+
+    def __init__( self, names ):
+        "names: names of the hosts, in matrix order"
+        self.names = list( names )
+        self.index = dict( ( name, i ) for i, name in enumerate( self.names ) )
+        n = len( self.names )
+        if numpy is not None:
+            self.sent = numpy.zeros( ( n, n ), dtype=int )
+            self.received = numpy.zeros( ( n, n ), dtype=int )
+            self.rtt = numpy.empty( ( n, n ) )
+            self.rtt.fill( numpy.nan )
+        else:
+            self.sent = [ [ 0 ] * n for _ in range( n ) ]
+            self.received = [ [ 0 ] * n for _ in range( n ) ]
+            self.rtt = [ [ None ] * n for _ in range( n ) ]
+
+    def record( self, src, dst, sent, received, rtt=None ):
+        """Record the result of pinging dst from src.
+           src: source index
+           dst: destination index
+           sent: number of packets sent
+           received: number of replies received
+           rtt: average round trip time in ms, or None"""
+        self.sent[ src ][ dst ] = sent
+        self.received[ src ][ dst ] = received
+        if rtt is not None:
+            self.rtt[ src ][ dst ] = rtt
+
+    def pairs( self ):
+        "Return an iterator over the ( src, dst ) index pairs that were pinged."
+        n = len( self.names )
+        for src in range( n ):
+            for dst in range( n ):
+                if self.sent[ src ][ dst ]:
+                    yield src, dst
+
+    def pairRTT( self, src, dst ):
+        """Return the average RTT in ms from src to dst, or None.
+           src, dst: host names"""
+        rtt = self.rtt[ self.index[ src ] ][ self.index[ dst ] ]
+        if rtt is None or rtt != rtt:  # NaN
+            return None
+        return float( rtt )
+
+    def reachable( self, src, dst ):
+        """Return whether any ping from src to dst was answered.
+           src, dst: host names"""
+        return self.received[ self.index[ src ] ][ self.index[ dst ] ] > 0
+
+    def packets( self ):
+        "Return the total number of packets sent and lost."
+        sent = received = 0
+        for src, dst in self.pairs():
+            sent += self.sent[ src ][ dst ]
+            received += self.received[ src ][ dst ]
+        return int( sent ), int( sent - received )
+
+    def loss( self ):
+        "Return the packet loss percentage over all pairs."
+        sent, lost = self.packets()
+        return 100 * lost / sent if sent else 0
+
+    def summary( self ):
+        """Return the textual summary printed by Mininet.ping():
+           one line per source host, listing the destinations that
+           replied (or X), followed by the overall results."""
+        lines = []
+        n = len( self.names )
+        for src in range( n ):
+            line = '%s -> ' % self.names[ src ]
+            for dst in range( n ):
+                if dst != src:
+                    line += ( '%s ' % self.names[ dst ]
+                              if self.received[ src ][ dst ] else 'X ' )
+            lines.append( line + '\n' )
+        sent, lost = self.packets()
+        lines.append( '*** Results: %i%% dropped (%d/%d lost)\n' %
+                      ( self.loss(), lost, sent ) )
+        return ''.join( lines )
+
+    def rows( self ):
+        """Return an iterator over the results of each pinged pair, as
+           ( src, dst, sent, received, loss percentage, rtt or None )"""
+        for src, dst in self.pairs():
+            srcName, dstName = self.names[ src ], self.names[ dst ]
+            sent = int( self.sent[ src ][ dst ] )
+            received = int( self.received[ src ][ dst ] )
+            yield ( srcName, dstName, sent, received,
+                    100 * ( sent - received ) / sent,
+                    self.pairRTT( srcName, dstName ) )
+
+    def toCSV( self ):
+        "Return the per-pair results as CSV, one line per pair."
+        lines = [ 'src,dst,sent,received,loss,rtt\n' ]
+        for row in self.rows():
+            lines.append( '%s,%s,%d,%d,%d,%s\n' %
+                          ( row[ :5 ] + ( '' if row[ 5 ] is None
+                                          else '%.3f' % row[ 5 ], ) ) )
+        return ''.join( lines )
+
+    def toJSON( self ):
+        "Return the hosts, per-pair results and overall loss as JSON."
+        keys = ( 'src', 'dst', 'sent', 'received', 'loss', 'rtt' )
+        sent, lost = self.packets()
+        return json.dumps( { 'hosts': self.names,
+                             'sent': sent, 'lost': lost, 'loss': self.loss(),
+                             'pairs': [ dict( zip( keys, row ) )
+                                        for row in self.rows() ] } )
+
+def parsePing( pingOutput ):
+    "Parse ping output and return packets sent, received."
+    # Check for downed link
+    if 'connect: Network is unreachable' in pingOutput:
+        return (1, 0)
+    r = r'(\d+) packets transmitted, (\d+) received'
+    m = re.search( r, pingOutput )
+    if m == None:
+        error( '*** Error: could not parse ping output: %s\n' %
+                 pingOutput )
+        return (1, 0)
+    sent, received = int( m.group( 1 ) ), int( m.group( 2 ) )
+    return sent, received
+
+def parsePingRTT( pingOutput ):
+    "Parse ping output and return the average RTT in ms, or None."
+    m = re.search( r'= [\d.]+/([\d.]+)/', pingOutput )
+    return float( m.group( 1 ) ) if m else None
+
+def recordPings( matrix, src, pingOutput ):
+    """Record the results of pinging from a host in a PingMatrix.
+       matrix: PingMatrix
+       src: index of the source host
+       pingOutput: lines of '<destination index> <ping output>', as
+                   printed by Mininet._pingAllCmd()"""
+    for line in pingOutput.splitlines():
+        key, _, result = line.partition( ' ' )
+        if not key.isdigit():
+            continue
+        sent, received = parsePing( result )
+        if received > sent:
+            error( '*** Error: received too many packets\n' )
+            error( '%s\n' % result )
+            received = sent
+        matrix.record( src, int( key ), sent, received,
+                       parsePingRTT( result ) )
@@ -0,0 +1,223 @@
+"""
+Shared reactor for node output.
+
+All node shells are registered with a single epoll object when they
+are created, so waiting for output costs the same whether the network
+has ten nodes or ten thousand: there is no per-call registration, and
+each wakeup only touches the nodes which actually have data.
+
+Whoever waits for output (Node.waitOutput(), Mininet.monitor(), the
+CLI, or mininet.futures) runs the reactor, which reads from every
+ready shell, not just the one being waited for. What it reads is
+parsed by the node (see mininet.shell) and appended to the node's
+OutputRing, as lines stamped with the (monotonic) time they were read,
+until the node's owner consumes it. Output of a node which isn't
+running a command, and which nobody reads, is kept only up to the
+ring's size; older lines are discarded.
+
+Nodes with unread output are kept in reactor.pending, so a consumer
+can find its nodes' output without scanning all nodes.
+
+Other file descriptors (such as the CLI's stdin) can be added with
+addReader(), in which case their callbacks are run from the reactor.
+"""
+
+import ctypes
+import os
+import select
+from collections import deque
+from errno import EINTR
+
+try:
+    from time import monotonic
+except ImportError:
+    monotonic = None
+
+# Monotonic clock
+
+CLOCK_MONOTONIC = 1
+
+class Timespec( ctypes.Structure ):
+    "struct timespec, for clock_gettime(2)"
+    _fields_ = [ ( 'tv_sec', ctypes.c_long ), ( 'tv_nsec', ctypes.c_long ) ]
+
+_libc = None
+
+def clockMonotonic():
+    "Return the time in seconds from a clock which never goes backwards."
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL( None, use_errno=True )
+    ts = Timespec()
+    if _libc.clock_gettime( CLOCK_MONOTONIC, ctypes.byref( ts ) ) != 0:
+        errno = ctypes.get_errno()
+        raise OSError( errno, os.strerror( errno ) )
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+
+if monotonic is None:
+    monotonic = clockMonotonic
+
+class OutputRing( object ):
+    """Output read from a node, as a queue of ( timestamp, item ).
+       Items are lines of output, including their newline, except for
+       the last item, which may be an incomplete line, and control
+       frames (see mininet.shell), which are kept in order with the
+       output around them."""
+
+    def __init__( self, maxlen=1000 ):
+        "maxlen: number of items to keep when the ring is bounded"
+        self.maxlen = maxlen
+        self.entries = deque()
+        self.partial = False  # last entry is an incomplete line
+        self.dropped = 0  # number of items discarded so far
+
+    def __len__( self ):
+        return len( self.entries )
+
+    def append( self, items, stamp, bounded=True ):
+        """Add output and frames to the ring.
+           items: list of output strings and ( type, payload ) frames
+           stamp: time the items were read
+           bounded: discard the oldest items beyond maxlen?"""
+        entries = self.entries
+        for item in items:
+            if not isinstance( item, str ):
+                entries.append( ( stamp, item ) )
+                self.partial = False
+                continue
+            if not item:
+                continue
+            lines = item.split( '\n' )
+            last = lines.pop()
+            lines = [ line + '\n' for line in lines ]
+            if last:
+                lines.append( last )
+            if self.partial:
+                # Continue the incomplete line, keeping its start time
+                started, text = entries.pop()
+                entries.append( ( started, text + lines.pop( 0 ) ) )
+            entries.extend( ( stamp, line ) for line in lines )
+            self.partial = not item.endswith( '\n' )
+        if bounded:
+            while len( entries ) > self.maxlen:
+                entries.popleft()
+                self.dropped += 1
+
+    def read( self ):
+        """Remove and return everything in the ring.
+           returns: list of output strings and ( type, payload ) frames"""
+        items = [ item for _stamp, item in self.entries ]
+        self.entries.clear()
+        self.partial = False
+        return items
+
+    def readline( self ):
+        """Remove and return the first complete line, skipping frames.
+           returns: ( timestamp, line minus newline ) or None"""
+        entries = self.entries
+        while entries and not isinstance( entries[ 0 ][ 1 ], str ):
+            entries.popleft()
+        if not entries or ( self.partial and len( entries ) == 1 ):
+            return None
+        stamp, line = entries.popleft()
+        return stamp, line[ :-1 ]
+
+class Reactor( object ):
+    "Single epoll loop reading the output of all nodes."
+
+    def __init__( self ):
+        self.epoll = select.epoll()
+        self.nodes = {}  # registered nodes, by shell output fd
+        self.readers = {}  # callbacks for other fds, by fd
+        self.pending = set()  # nodes with output not yet consumed
+
+    def register( self, node ):
+        """Start reading a node's output.
+           node: node whose shell has just been started"""
+        fd = node.stdout.fileno()
+        self.nodes[ fd ] = node
+        self.epoll.register( fd, select.EPOLLIN )
+
+    def unregister( self, node ):
+        """Stop reading a node's output.
+           node: registered node"""
+        fd = node.stdout.fileno()
+        if self.nodes.get( fd ) is node:
+            del self.nodes[ fd ]
+            self.epoll.unregister( fd )
+
+    def registered( self, node ):
+        "Are we reading node's output?"
+        return self.nodes.get( node.stdout.fileno() ) is node
+
+    def addReader( self, fd, callback ):
+        """Call callback() from the reactor whenever fd is readable.
+           fd: file descriptor
+           callback: function of no arguments"""
+        self.readers[ fd ] = callback
+        self.epoll.register( fd, select.EPOLLIN )
+
+    def removeReader( self, fd ):
+        "Stop watching an fd added with addReader()."
+        if self.readers.pop( fd, None ) is not None:
+            self.epoll.unregister( fd )
+
+    def poll( self, timeoutms=None ):
+        """Read output from all ready nodes, and run the callbacks of
+           other ready fds.
+           timeoutms: timeout in ms or None to wait indefinitely
+           returns: list of nodes which we read from"""
+        timeout = -1 if timeoutms is None or timeoutms < 0 else (
+            timeoutms / 1000.0 )
+        try:
+            events = self.epoll.poll( timeout )
+        except IOError, e:
+            if e.errno == EINTR:
+                return []
+            raise
+        stamp = monotonic()
+        ready = []
+        for fd, _event in events:
+            node = self.nodes.get( fd )
+            if node is None:
+                callback = self.readers.get( fd )
+                if callback:
+                    callback()
+                continue
+            if not node.readOutput( stamp ):
+                # The shell has gone away; its owner finds out when
+                # it reads the (empty) output
+                self.unregister( node )
+            self.pending.add( node )
+            ready.append( node )
+        return ready
+
+    def waitFor( self, node, timeoutms=None ):
+        """Wait until a node has unread output.
+           node: node to wait for
+           timeoutms: timeout in ms or None to wait indefinitely
+           returns: True if the node has unread output"""
+        deadline = None
+        if timeoutms is not None and timeoutms >= 0:
+            deadline = monotonic() + timeoutms / 1000.0
+        while node not in self.pending and self.registered( node ):
+            remaining = None
+            if deadline is not None:
+                remaining = max( 0, int( ( deadline - monotonic() ) * 1000 ) )
+            self.poll( remaining )
+            if remaining == 0:
+                break
+        return node in self.pending
+
+    def ready( self, nodes, timeoutms=None ):
+        """Wait until some of a set of nodes have unread output.
+           nodes: set of nodes
+           timeoutms: timeout in ms or None to wait indefinitely
+           returns: set of nodes with unread output"""
+        ready = self.pending.intersection( nodes )
+        if not ready:
+            self.poll( timeoutms )
+            ready = self.pending.intersection( nodes )
+        return ready
+
+reactor = Reactor()
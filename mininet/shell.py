@@ -0,0 +1,150 @@
+"""
+Framed shell protocol for Mininet nodes.
+
+Each node is a shell whose output is a stream of command output
+interleaved with small control records, or frames. A frame is
+
+    RS <type> <length> <payload>
+
+where RS is ASCII 30 (record separator), type is a single character,
+and length is the payload length as four hex digits. Frame types are:
+
+    P: payload is the pid of a process started via 'mnexec -p'
+    E: payload is 'serial status bgpid', printed by the shell (via
+       PROMPT_COMMAND) whenever a command line completes:
+       serial is the command's serial number, status its exit status
+       and bgpid the pid of the most recent background job
+    B: payload is 'serial index status', printed after each command
+       of a batch sent by Node.cmdBatch()
+
+Since the header carries the payload length, a frame that is split
+across two reads is simply completed on the next read, and only newly
+read data is ever scanned for frames.
+"""
+
+from string import hexdigits
+
+FRAME = chr( 30 )
+HEADERLEN = 6  # RS + type + 4 hex digits
+FRAMETYPES = 'PEB'
+MAXPAYLOAD = 64
+
+# Shell snippet which prints a frame of the given type; the payload
+# is taken from the shell variable __mnf
+_printFrame = 'printf "\\036%s%%04x%%s" ${#__mnf} "$__mnf"'
+
+# Run by the shell before each prompt; $? is still the exit status
+# of the last command line at this point
+PROMPT_COMMAND = ( '__mnst=$?; __mnf="${__mnserial:-0} $__mnst ${!:-0}"; ' +
+                   _printFrame % 'E' )
+
+def batchMarker( serial, index ):
+    """Return a shell command which prints a B frame for a batched command.
+       serial: serial number of the batch
+       index: index of the command within the batch"""
+    return ( '__mnst=$?; __mnf="%d %d $__mnst"; ' % ( serial, index ) +
+             _printFrame % 'B' )
+
+def shellEnv():
+    "Return environment settings (for env(1)) for a framed node shell."
+    return [ 'PS1=', 'PS2=', 'PROMPT_COMMAND=' + PROMPT_COMMAND ]
+
+def validHeader( header ):
+    """Check whether header is a valid frame header or a prefix of one.
+       header: string starting with RS"""
+    if len( header ) > 1 and header[ 1 ] not in FRAMETYPES:
+        return False
+    return all( c in hexdigits for c in header[ 2:HEADERLEN ] )
+
+def payloadLength( header ):
+    """Return the payload length given in a frame header.
+       header: RS, type and length
+       returns: payload length or None if header is invalid"""
+    if len( header ) < HEADERLEN or not validHeader( header ):
+        return None
+    length = int( header[ 2: ], 16 )
+    if length > MAXPAYLOAD:
+        return None
+    return length
+
+class FrameParser( object ):
+    """Split a node's output stream into output data and control frames.
+       Data is read straight into a reusable bytearray, and each byte is
+       scanned only once; the only data kept between reads is the start
+       of a frame which has not been completely read yet."""
+
+    def __init__( self, readSize=65536 ):
+        "readSize: maximum number of bytes to read at once"
+        self.readSize = readSize
+        self.buf = bytearray( 2 * readSize )
+        self.start = 0  # first byte not yet parsed
+        self.end = 0  # end of data read so far
+
+    def reserve( self, count ):
+        """Make room for count more bytes at the end of the buffer.
+           count: number of bytes"""
+        pending = self.end - self.start
+        if self.start and len( self.buf ) - self.end < count:
+            # Move the unparsed tail to the front
+            self.buf[ :pending ] = self.buf[ self.start:self.end ]
+            self.start, self.end = 0, pending
+        if len( self.buf ) - self.end < count:
+            self.buf.extend( bytearray( count - len( self.buf ) + self.end ) )
+
+    def fill( self, fileobj ):
+        """Read available data into the buffer.
+           fileobj: unbuffered file object (e.g. io.FileIO) to read from
+           returns: number of bytes read"""
+        self.reserve( self.readSize )
+        view = memoryview( self.buf )
+        count = fileobj.readinto( view[ self.end:self.end + self.readSize ] )
+        del view
+        self.end += count or 0
+        return count
+
+    def feed( self, data ):
+        """Parse data which has already been read.
+           data: string read from the node
+           returns: list of output strings and ( type, payload ) frames"""
+        self.reserve( len( data ) )
+        self.buf[ self.end:self.end + len( data ) ] = data
+        self.end += len( data )
+        return self.parse()
+
+    def parse( self ):
+        """Parse the data read since the last call.
+           returns: list of output strings and ( type, payload ) frames"""
+        buf, view = self.buf, memoryview( self.buf )
+        start, end = self.start, self.end
+        items = []
+        while start < end:
+            pos = buf.find( FRAME, start, end )
+            if pos < 0:
+                items.append( view[ start:end ].tobytes() )
+                start = end
+                break
+            if pos > start:
+                items.append( view[ start:pos ].tobytes() )
+            header = str( buf[ pos:min( pos + HEADERLEN, end ) ] )
+            if len( header ) < HEADERLEN and validHeader( header ):
+                # Incomplete header: wait for more data
+                start = pos
+                break
+            length = payloadLength( header )
+            if length is None:
+                # Not a frame, just a stray RS character
+                items.append( FRAME )
+                start = pos + 1
+                continue
+            frameEnd = pos + HEADERLEN + length
+            if frameEnd > end:
+                start = pos
+                break
+            items.append( ( header[ 1 ],
+                            view[ pos + HEADERLEN:frameEnd ].tobytes() ) )
+            start = frameEnd
+        del view
+        if start == end:
+            start = end = 0
+        self.start, self.end = start, end
+        return items
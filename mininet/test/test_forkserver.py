@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test starting processes through the mnexec fork server."""
+
+import os
+import signal
+import unittest
+from time import sleep
+
+from mininet.forkserver import ForkServer
+
+
+def readAll( fd, size ):
+    "Read at least size bytes (or up to EOF) from fd."
+    data = ''
+    while len( data ) < size:
+        chunk = os.read( fd, size - len( data ) )
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def netns( pid ):
+    "Return the network namespace of a process."
+    return os.readlink( '/proc/%d/ns/net' % pid )
+
+
+class testForkServer( unittest.TestCase ):
+    "Spawning processes and passing back their channels."
+
+    def setUp( self ):
+        self.server = ForkServer()
+        self.children = []
+
+    def tearDown( self ):
+        for child, fd in self.children:
+            os.close( fd )
+            if child.poll() is None:
+                os.kill( child.pid, signal.SIGKILL )
+        self.server.stop()
+
+    def spawn( self, *args, **kwargs ):
+        "Spawn a process, cleaning it up after the test."
+        child, fd = self.server.spawn( *args, **kwargs )
+        self.children.append( ( child, fd ) )
+        return child, fd
+
+    def testAlive( self ):
+        "The server announces itself"
+        self.assertTrue( self.server.alive )
+
+    def testSocketpair( self ):
+        "Our end of the child's socketpair is passed back to us"
+        child, fd = self.spawn( [ 'sh', '-c', 'echo $$ $FOO; cat' ],
+                                env=[ 'FOO=bar' ], usePty=False )
+        self.assertEqual( readAll( fd, len( '%d bar\n' % child.pid ) ),
+                          '%d bar\n' % child.pid )
+        os.write( fd, 'echo\n' )
+        self.assertEqual( readAll( fd, 5 ), 'echo\n' )
+
+    def testPty( self ):
+        "A pty's master is passed back, and the child has a terminal"
+        _child, fd = self.spawn( [ 'sh', '-c', 'test -t 0 && echo tty' ] )
+        self.assertEqual( readAll( fd, 3 ), 'tty' )
+
+    def testNamespaces( self ):
+        "Children can be put in new namespaces, or join existing ones"
+        first, _fd = self.spawn( [ 'sleep', '10' ], newNs=True,
+                                 usePty=False )
+        second, _fd = self.spawn( [ 'sleep', '10' ], nsPid=first.pid,
+                                  usePty=False )
+        self.assertNotEqual( netns( first.pid ), netns( os.getpid() ) )
+        self.assertEqual( netns( second.pid ), netns( first.pid ) )
+
+    def testExit( self ):
+        "We can tell when a child has exited"
+        child, _fd = self.spawn( [ 'sleep', '10' ], usePty=False )
+        self.assertEqual( child.poll(), None )
+        os.kill( child.pid, signal.SIGKILL )
+        for _ in range( 100 ):
+            if child.poll() is not None:
+                break
+            sleep( .01 )
+        self.assertNotEqual( child.poll(), None )
+
+
+if __name__ == '__main__':
+    unittest.main()
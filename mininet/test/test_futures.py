@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test futures for running node commands concurrently."""
+
+import unittest
+from time import time
+
+from mininet.futures import Future, gather, runLimited, wait
+from mininet.node import Host
+
+
+class testFutures( unittest.TestCase ):
+    "Completing, chaining and combining futures."
+
+    def testThen( self ):
+        "Chained steps run in order, and may return futures"
+        first, inner = Future(), Future()
+        chained = first.then( lambda value: value + 1 ).then(
+            lambda value: inner.then( lambda other: value * other ) )
+        first.set( 1 )
+        self.assertFalse( chained.done() )
+        inner.set( 10 )
+        self.assertEqual( chained.value, 20 )
+
+    def testGather( self ):
+        "gather() returns the results in order once all are done"
+        futures = [ Future() for _ in range( 3 ) ]
+        combined = gather( futures )
+        for index in 2, 0, 1:
+            self.assertFalse( combined.done() )
+            futures[ index ].set( index )
+        self.assertEqual( combined.value, [ 0, 1, 2 ] )
+        self.assertEqual( gather( [] ).value, [] )
+
+    def testRunLimited( self ):
+        "runLimited() runs at most limit operations at once"
+        started = []
+
+        def start( item ):
+            "Start an operation which we complete by hand."
+            future = Future()
+            started.append( ( item, future ) )
+            return future
+
+        combined = runLimited( start, range( 5 ), limit=2 )
+        self.assertEqual( [ item for item, _ in started ], [ 0, 1 ] )
+        started[ 1 ][ 1 ].set( 'one' )
+        self.assertEqual( [ item for item, _ in started ], [ 0, 1, 2 ] )
+        while not combined.done():
+            running = [ ( item, future ) for item, future in started
+                        if not future.done() ]
+            self.assertTrue( 0 < len( running ) <= 2 )
+            item, future = running[ 0 ]
+            future.set( item )
+        self.assertEqual( combined.value, [ 0, 'one', 2, 3, 4 ] )
+
+
+class testCommands( unittest.TestCase ):
+    "Running commands on nodes via futures."
+
+    def setUp( self ):
+        self.hosts = [ Host( 'h%d' % i, usePty=False ) for i in 1, 2, 3 ]
+
+    def tearDown( self ):
+        for host in self.hosts:
+            host.terminate()
+
+    def testConcurrent( self ):
+        "Commands on different nodes run at the same time"
+        start = time()
+        outputs = gather( [ host.acmd( 'sleep 1; echo %s' % host.name )
+                            for host in self.hosts ] ).result()
+        self.assertTrue( time() - start < 2.5 )
+        self.assertEqual( outputs, [ 'h1\n', 'h2\n', 'h3\n' ] )
+
+    def testQueue( self ):
+        "Commands queued on one node run in order"
+        host = self.hosts[ 0 ]
+        futures = [ host.acmd( 'echo %d' % i ) for i in range( 5 ) ]
+        futures.append( host.acmd( 'false', exitcode=True ) )
+        self.assertEqual( gather( futures ).result(),
+                          [ '%d\n' % i for i in range( 5 ) ] + [ ( '', 1 ) ] )
+        self.assertEqual( host.cmd( 'echo sync' ), 'sync\n' )
+
+    def testWaitTimeout( self ):
+        "wait() returns the futures which didn't complete in time"
+        future = self.hosts[ 0 ].acmd( 'sleep 1' )
+        self.assertEqual( wait( [ future ], timeout=.1 ), [ future ] )
+        self.assertEqual( future.result(), '' )
+
+
+if __name__ == '__main__':
+    unittest.main()
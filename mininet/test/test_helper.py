@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test the privileged command helper and its request protocol."""
+
+import unittest
+
+from mininet.helper import RootHelper, runCmd
+
+
+class testRunCmd( unittest.TestCase ):
+    "Running commands and collecting their output."
+
+    def testOutput( self ):
+        "stdout and stderr are returned with the exit status"
+        self.assertEqual( runCmd( [ 'sh', '-c', 'echo out; echo err >&2; '
+                                    'exit 3' ] ), ( 'out\nerr\n', 3 ) )
+
+    def testInput( self ):
+        "Input larger than a pipe buffer is passed to the command"
+        data = 'x' * 200000 + '\n'
+        self.assertEqual( runCmd( [ 'cat' ], data ), ( data, 0 ) )
+
+    def testNoInput( self ):
+        "Without input the command's stdin is empty, not ours"
+        self.assertEqual( runCmd( [ 'cat' ] ), ( '', 0 ) )
+
+    def testMissingCommand( self ):
+        "A command which can't be run reports status 127"
+        output, status = runCmd( [ 'mn-no-such-command' ] )
+        self.assertEqual( status, 127 )
+        self.assertTrue( output.startswith( 'mn-no-such-command:' ) )
+
+
+class testRootHelper( unittest.TestCase ):
+    "Requests and responses over the helper's pipe."
+
+    def setUp( self ):
+        self.helper = RootHelper( sudo=False )
+
+    def tearDown( self ):
+        self.helper.stop()
+
+    def testRequests( self ):
+        "Several requests are answered in order on one helper"
+        for i in range( 3 ):
+            self.assertEqual( self.helper.run( [ 'echo', str( i ) ] ),
+                              ( '%d\n' % i, 0 ) )
+        self.assertEqual( self.helper.run( [ 'sh', '-c', 'exit 5' ] ),
+                          ( '', 5 ) )
+
+    def testArgs( self ):
+        "Arguments with spaces and newlines are passed unchanged"
+        arg = 'a b\nc'
+        self.assertEqual( self.helper.run( [ 'printf', '%s', arg ] ),
+                          ( arg, 0 ) )
+
+    def testInput( self ):
+        "Input, including an empty one, is passed to the command"
+        data = 'line\n' * 20000
+        self.assertEqual( self.helper.run( [ 'cat' ], data ), ( data, 0 ) )
+        self.assertEqual( self.helper.run( [ 'cat' ], '' ), ( '', 0 ) )
+        # Without input the command must not read the request pipe
+        self.assertEqual( self.helper.run( [ 'cat' ] ), ( '', 0 ) )
+        self.assertEqual( self.helper.run( [ 'echo', 'ok' ] ), ( 'ok\n', 0 ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test rtnetlink message encoding and link configuration."""
+
+import socket
+import struct
+import unittest
+
+from mininet import netlink
+from mininet.node import Host
+
+
+class testEncoding( unittest.TestCase ):
+    "Encoding and decoding of rtnetlink messages."
+
+    def testAttrs( self ):
+        "Attributes are padded to 4 bytes and decoded again"
+        data = ( netlink.attr( netlink.IFLA_IFNAME, 'eth0\0' ) +
+                 netlink.attr( netlink.IFLA_MTU, struct.pack( '=I', 1500 ) ) )
+        self.assertEqual( len( data ) % 4, 0 )
+        attrs = netlink.parseAttrs( data )
+        self.assertEqual( attrs[ netlink.IFLA_IFNAME ], 'eth0\0' )
+        self.assertEqual( struct.unpack( '=I', attrs[ netlink.IFLA_MTU ] ),
+                          ( 1500, ) )
+
+    def testAddresses( self ):
+        "MAC and broadcast addresses are converted"
+        mac = '00:11:22:aa:bb:cc'
+        self.assertEqual( netlink.macString( netlink.macBytes( mac ) ), mac )
+        self.assertEqual( socket.inet_ntoa(
+            netlink.ipBroadcast( '10.1.2.3', 8 ) ), '10.255.255.255' )
+
+    def testNewVeth( self ):
+        "A veth pair is created with its peer in one message"
+        msgtype, flags, payload = netlink.newVeth(
+            'a-eth0', 'b-eth0', pid1=10, pid2=20, mac2='00:00:00:00:00:02',
+            mtu=9000 )
+        self.assertEqual( msgtype, netlink.RTM_NEWLINK )
+        self.assertTrue( flags & netlink.NLM_F_CREATE )
+        size = netlink.IFINFOMSG.size
+        attrs = netlink.parseAttrs( payload[ size: ] )
+        self.assertEqual( attrs[ netlink.IFLA_IFNAME ], 'a-eth0\0' )
+        self.assertEqual( struct.unpack(
+            '=I', attrs[ netlink.IFLA_NET_NS_PID ] ), ( 10, ) )
+        info = netlink.parseAttrs( attrs[ netlink.IFLA_LINKINFO ] )
+        self.assertEqual( info[ netlink.IFLA_INFO_KIND ], 'veth' )
+        peer = netlink.parseAttrs( info[ netlink.IFLA_INFO_DATA ] )[
+            netlink.VETH_INFO_PEER ]
+        peerAttrs = netlink.parseAttrs( peer[ size: ] )
+        self.assertEqual( peerAttrs[ netlink.IFLA_IFNAME ], 'b-eth0\0' )
+        self.assertEqual( netlink.macString(
+            peerAttrs[ netlink.IFLA_ADDRESS ] ), '00:00:00:00:00:02' )
+        self.assertEqual( struct.unpack(
+            '=I', peerAttrs[ netlink.IFLA_NET_NS_PID ] ), ( 20, ) )
+
+    def testNewAddr( self ):
+        "Addresses carry their prefix length and broadcast address"
+        _msgtype, _flags, payload = netlink.newAddr( 3, '10.0.0.1', 24 )
+        family, prefixLen, _flags, _scope, index = (
+            netlink.IFADDRMSG.unpack_from( payload ) )
+        self.assertEqual( ( family, prefixLen, index ),
+                          ( socket.AF_INET, 24, 3 ) )
+        attrs = netlink.parseAttrs( payload[ netlink.IFADDRMSG.size: ] )
+        self.assertEqual( socket.inet_ntoa( attrs[ netlink.IFA_LOCAL ] ),
+                          '10.0.0.1' )
+        self.assertEqual( socket.inet_ntoa( attrs[ netlink.IFA_BROADCAST ] ),
+                          '10.0.0.255' )
+
+
+class testLinks( unittest.TestCase ):
+    "Configuring links in node namespaces."
+
+    def setUp( self ):
+        self.h1, self.h2 = Host( 'h1' ), Host( 'h2' )
+
+    def tearDown( self ):
+        self.h1.terminate()
+        self.h2.terminate()
+
+    def testVethAndAddrs( self ):
+        "Links are created in place, addressed and seen to come up"
+        netlink.rootSocket().check( [ netlink.newVeth(
+            'h1-eth0', 'h2-eth0', self.h1.nsPid(), self.h2.nsPid(),
+            mac1='00:00:00:00:00:01' ) ] )
+        nl1, nl2 = self.h1.nlSocket(), self.h2.nlSocket()
+        self.assertEqual( netlink.rootSocket().link( 'h1-eth0' ), None )
+        index, _flags, attrs = nl1.link( 'h1-eth0' )
+        self.assertEqual( netlink.macString( attrs[ netlink.IFLA_ADDRESS ] ),
+                          '00:00:00:00:00:01' )
+        nl1.check( [ netlink.newAddr( index, '10.0.0.1', 8 ) ] )
+        self.assertEqual( nl1.addrs( index ), [ ( '10.0.0.1', 8 ) ] )
+        monitor = netlink.LinkMonitor( self.h1.nsPid() )
+        try:
+            nl2.check( [ netlink.setLink( 'h2-eth0', up=True ) ] )
+            self.assertTrue( monitor.waitState( [ 'h1-eth0' ], 'up',
+                                                timeout=5 ) )
+        finally:
+            monitor.close()
+
+    def testErrors( self ):
+        "Failed requests report their errno"
+        nl = self.h1.nlSocket()
+        self.assertEqual( nl.request( [ netlink.delLink( 'nosuchintf' ) ] ),
+                          [ netlink.ENODEV ] )
+        self.assertRaises( netlink.NetlinkError, nl.check,
+                           [ netlink.delLink( 'nosuchintf' ) ] )
+        nl.check( [ netlink.delLink( 'nosuchintf' ) ],
+                  ignore=[ netlink.ENODEV ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test node shells: command output, status and control."""
+
+import unittest
+from time import time
+
+from mininet.node import Host
+from mininet.reactor import OutputRing
+
+
+class testOutput( unittest.TestCase ):
+    "Capture of command output."
+
+    def testRingBounded( self ):
+        "Only output nobody is waiting for is trimmed to the ring size"
+        ring = OutputRing( maxlen=10 )
+        ring.append( [ '%d\n' % i for i in range( 100 ) ], 0, bounded=False )
+        self.assertEqual( len( ring ), 100 )
+        ring.append( [ 'x\n' ], 0, bounded=True )
+        self.assertEqual( len( ring ), 10 )
+        self.assertEqual( ring.read()[ -1 ], 'x\n' )
+
+    def testLargeOutput( self ):
+        "Multi-line output much larger than 64KB is returned intact"
+        expected = [ str( i ) for i in range( 1, 200001 ) ]
+        for usePty in True, False:
+            host = Host( 'h1', usePty=usePty )
+            try:
+                output = host.cmd( 'seq 200000' )
+            finally:
+                host.terminate()
+            self.assertEqual( output.split(), expected )
+
+
+class testCommands( unittest.TestCase ):
+    "Command status and control over the framed shell protocol."
+
+    def setUp( self ):
+        self.host = Host( 'h1', usePty=False )
+
+    def tearDown( self ):
+        self.host.terminate()
+
+    def testExitStatus( self ):
+        "cmd() reports each command's exit status"
+        self.assertEqual( self.host.cmd( 'true', exitcode=True ), ( '', 0 ) )
+        self.assertEqual( self.host.cmd( 'false', exitcode=True ), ( '', 1 ) )
+        self.assertEqual( self.host.cmd( '( exit 3 )', exitcode=True ),
+                          ( '', 3 ) )
+
+    def testSyntaxError( self ):
+        "A command line the shell can't parse still completes"
+        _output, status = self.host.cmd( 'echo (', exitcode=True )
+        self.assertEqual( status, 2 )
+        self.assertEqual( self.host.cmd( 'echo ok' ), 'ok\n' )
+
+    def testShellExit( self ):
+        "A command which makes the shell exit returns"
+        _output, status = self.host.cmd( 'exit', exitcode=True )
+        self.assertEqual( status, None )
+        self.assertFalse( self.host.waiting )
+
+    def testSerialSync( self ):
+        "Each command's end is matched by its serial number"
+        for i in range( 5 ):
+            self.assertEqual( self.host.cmd( 'echo %d' % i ), '%d\n' % i )
+            self.assertEqual( self.host.lastSerial, self.host.serial )
+
+    def testBatchStatus( self ):
+        "cmdBatch() reports the output and exit status of each command"
+        results = self.host.cmdBatch( [ 'true', 'false', 'echo x',
+                                        '( exit 7 )' ], exitcode=True )
+        self.assertEqual( results, [ ( '', 0 ), ( '', 1 ), ( 'x\n', 0 ),
+                                     ( '', 7 ) ] )
+
+    def testTimeout( self ):
+        "A command which runs too long is interrupted"
+        for usePty in True, False:
+            host = Host( 'h2', usePty=usePty )
+            try:
+                start = time()
+                _output, status = host.cmd( 'echo before; sleep 10',
+                                            timeout=.3, exitcode=True )
+                self.assertTrue( time() - start < 5 )
+                self.assertEqual( status, 130 )
+                # Nothing from the interrupted command is left over
+                self.assertEqual( host.cmd( 'echo next' ).strip(), 'next' )
+            finally:
+                host.terminate()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test the OVSDB client: operation construction and JSON-RPC calls,
+   against a fake ovsdb-server."""
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from mininet import ovsdb
+
+
+class FakeServer( threading.Thread ):
+    """Answers the requests of one client over a unix socket.
+       Transactions are answered by a handler, which is passed the
+       operations and returns the results."""
+
+    def __init__( self, path, handler ):
+        threading.Thread.__init__( self )
+        self.daemon = True
+        self.handler = handler
+        self.requests = []
+        self.echoed = []
+        self.listener = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        self.listener.bind( path )
+        self.listener.listen( 1 )
+
+    def run( self ):
+        conn, _ = self.listener.accept()
+        decoder, buf = json.JSONDecoder(), ''
+        while True:
+            data = conn.recv( 65536 )
+            if not data:
+                break
+            buf += data
+            while buf.strip():
+                try:
+                    message, end = decoder.raw_decode( buf.lstrip() )
+                except ValueError:
+                    break
+                buf = buf.lstrip()[ end: ]
+                if 'method' not in message:
+                    # Reply to our echo
+                    self.echoed.append( message[ 'result' ] )
+                    continue
+                self.requests.append( message )
+                # Ask for a keepalive before every reply
+                conn.sendall( json.dumps( { 'method': 'echo', 'id': 'e',
+                                            'params': [ 'ping' ] } ) )
+                ops = message[ 'params' ][ 1: ]
+                conn.sendall( json.dumps( {
+                    'id': message[ 'id' ], 'error': None,
+                    'result': self.handler( ops ) } ) )
+        conn.close()
+
+
+class testOps( unittest.TestCase ):
+    "Construction of Open_vSwitch database operations."
+
+    def setUp( self ):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join( self.dir, 'db.sock' )
+        self.results = []
+        self.server = FakeServer( self.path, self.handle )
+        self.server.start()
+        self.db = ovsdb.OVSDB( self.path )
+
+    def tearDown( self ):
+        self.db.close()
+        self.server.join( 5 )
+        self.server.listener.close()
+        shutil.rmtree( self.dir )
+
+    def handle( self, ops ):
+        "Return the next canned result, or empty results."
+        if self.results:
+            return self.results.pop( 0 )
+        return [ {} for _op in ops ]
+
+    def testValues( self ):
+        "Sets and maps are encoded, and atoms decoded"
+        self.assertEqual( ovsdb.ovsSet( [ 1, 2 ] ), [ 'set', [ 1, 2 ] ] )
+        self.assertEqual( ovsdb.ovsMap( { 'b': '2', 'a': '1' } ),
+                          [ 'map', [ [ 'a', '1' ], [ 'b', '2' ] ] ] )
+        self.assertEqual( ovsdb.atoms( [ 'set', [ 'x', 'y' ] ] ),
+                          [ 'x', 'y' ] )
+        self.assertEqual( ovsdb.atoms( 'x' ), [ 'x' ] )
+
+    def testAddBridgeOps( self ):
+        "A bridge is inserted with its ports and controllers"
+        ops = self.db.addBridgeOps( 'mn-dp0', [ 's1-eth1', 's1-eth2' ],
+                                    'secure', { 'datapath-id': '1' },
+                                    [ 'tcp:127.0.0.1:6633' ] )
+        inserts = dict( ( op[ 'uuid-name' ], op ) for op in ops
+                        if op[ 'op' ] == 'insert' )
+        bridge = [ op for op in ops if op.get( 'table' ) == 'Bridge' ][ 0 ]
+        ports = [ inserts[ name ][ 'row' ][ 'name' ] for _kind, name
+                  in ovsdb.atoms( bridge[ 'row' ][ 'ports' ] ) ]
+        self.assertEqual( ports, [ 'mn-dp0', 's1-eth1', 's1-eth2' ] )
+        self.assertEqual( bridge[ 'row' ][ 'fail_mode' ], 'secure' )
+        controller = ovsdb.atoms( bridge[ 'row' ][ 'controller' ] )[ 0 ]
+        self.assertEqual( inserts[ controller[ 1 ] ][ 'row' ],
+                          { 'target': 'tcp:127.0.0.1:6633' } )
+        # The bridge's own port has an internal interface
+        internal = [ op[ 'row' ] for op in inserts.values()
+                     if op[ 'table' ] == 'Interface' and
+                     op[ 'row' ][ 'name' ] == 'mn-dp0' ]
+        self.assertEqual( internal[ 0 ][ 'type' ], 'internal' )
+        self.assertEqual( ops[ -1 ][ 'mutations' ][ 0 ][ :2 ],
+                          [ 'bridges', 'insert' ] )
+
+    def testDelBridgesOps( self ):
+        "Bridges are deleted by removing them from the root table"
+        self.assertEqual( self.db.delBridgesOps( [] ), [] )
+        uuid = [ 'uuid', '1234' ]
+        ops = self.db.delBridgesOps( [ uuid ] )
+        self.assertEqual( ops[ 0 ][ 'mutations' ],
+                          [ [ 'bridges', 'delete', [ 'set', [ uuid ] ] ] ] )
+
+    def testAddPortOps( self ):
+        "Ports which exist already are not added again"
+        self.results = [ [ { 'rows': [ { '_uuid': [ 'uuid', '1' ] } ] } ],
+                         [ { 'rows': [] } ] ]
+        self.assertEqual( self.db.addPortOps( 'mn-dp0', 's1-eth1' ), [] )
+        ops = self.db.addPortOps( 'mn-dp0', 's1-eth1' )
+        self.assertEqual( [ op[ 'table' ] for op in ops ],
+                          [ 'Interface', 'Port', 'Bridge' ] )
+        self.assertEqual( ops[ -1 ][ 'where' ],
+                          [ [ 'name', '==', 'mn-dp0' ] ] )
+
+    def testTransact( self ):
+        "Transactions are sent to the database, and errors raised"
+        self.results = [ [ { 'rows': [ { 'name': 'mn-dp0',
+                                         '_uuid': [ 'uuid', '1' ] } ] } ] ]
+        self.assertEqual( self.db.bridges(), { 'mn-dp0': [ 'uuid', '1' ] } )
+        request = self.server.requests[ -1 ]
+        self.assertEqual( request[ 'method' ], 'transact' )
+        self.assertEqual( request[ 'params' ][ 0 ], 'Open_vSwitch' )
+        self.results = [ [ { 'error': 'constraint violation' } ] ]
+        self.assertRaises( ovsdb.OVSDBError, self.db.transact,
+                           { 'op': 'comment', 'comment': 'x' } )
+        # The keepalive before our first reply was answered before
+        # our second request
+        self.assertEqual( self.server.echoed[ 0 ], [ 'ping' ] )
+
+    def testApply( self ):
+        "apply() bumps next_cfg and waits for ovs-vswitchd to catch up"
+        ops = self.db.delBridgesOps( [ [ 'uuid', '1' ] ] )
+        self.results = [ [ {}, {}, { 'rows': [ { 'next_cfg': 3 } ] } ],
+                         [ { 'rows': [ { 'cur_cfg': 2 } ] } ],
+                         [ { 'rows': [ { 'cur_cfg': 3 } ] } ] ]
+        self.assertTrue( self.db.apply( ops ) )
+        self.assertEqual( len( self.server.requests ), 3 )
+        sent = self.server.requests[ 0 ][ 'params' ][ 1: ]
+        self.assertEqual( sent[ 1 ][ 'mutations' ],
+                          [ [ 'next_cfg', '+=', 1 ] ] )
+        self.assertTrue( self.db.apply( [] ) )
+        self.assertEqual( len( self.server.requests ), 3 )
+
+
+if __name__ == '__main__':
+    unittest.main()
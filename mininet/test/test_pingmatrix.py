@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test parsing of ping output and the PingMatrix loss computation."""
+
+import unittest
+
+from mininet.pingmatrix import PingMatrix, parsePing, parsePingRTT, recordPings
+
+PINGOK = ( 'PING 10.0.0.2 (10.0.0.2) 56(84) bytes of data. '
+           '64 bytes from 10.0.0.2: icmp_req=1 ttl=64 time=0.512 ms '
+           '--- 10.0.0.2 ping statistics --- '
+           '1 packets transmitted, 1 received, 0% packet loss, time 0ms '
+           'rtt min/avg/max/mdev = 0.512/0.512/0.512/0.000 ms ' )
+
+PINGLOST = ( 'PING 10.0.0.3 (10.0.0.3) 56(84) bytes of data. '
+             '--- 10.0.0.3 ping statistics --- '
+             '1 packets transmitted, 0 received, 100% packet loss, time 0ms ' )
+
+
+class testPingParsing( unittest.TestCase ):
+    "Parsing of ping output."
+
+    def testParsePing( self ):
+        "Packets sent and received are parsed"
+        self.assertEqual( parsePing( PINGOK ), ( 1, 1 ) )
+        self.assertEqual( parsePing( PINGLOST ), ( 1, 0 ) )
+        self.assertEqual( parsePing(
+            'connect: Network is unreachable' ), ( 1, 0 ) )
+
+    def testParsePingRTT( self ):
+        "The average RTT is parsed, and is None without replies"
+        self.assertEqual( parsePingRTT( PINGOK ), 0.512 )
+        self.assertEqual( parsePingRTT( PINGLOST ), None )
+
+    def testRecordPings( self ):
+        "Each keyed line of output is recorded for its destination"
+        matrix = PingMatrix( [ 'h1', 'h2', 'h3' ] )
+        output = '1 %s\n2 %s\n' % ( PINGOK, PINGLOST )
+        recordPings( matrix, 0, output )
+        self.assertTrue( matrix.reachable( 'h1', 'h2' ) )
+        self.assertFalse( matrix.reachable( 'h1', 'h3' ) )
+        self.assertEqual( matrix.pairRTT( 'h1', 'h2' ), 0.512 )
+        self.assertEqual( matrix.pairRTT( 'h1', 'h3' ), None )
+
+
+class testPingMatrix( unittest.TestCase ):
+    "Loss computation and summaries."
+
+    def testLoss( self ):
+        "Loss is computed over the pairs that were pinged"
+        matrix = PingMatrix( [ 'h1', 'h2' ] )
+        self.assertEqual( matrix.loss(), 0 )
+        matrix.record( 0, 1, 4, 4, 0.1 )
+        matrix.record( 1, 0, 4, 2 )
+        self.assertEqual( matrix.packets(), ( 8, 2 ) )
+        self.assertEqual( matrix.loss(), 25 )
+        rows = list( matrix.rows() )
+        self.assertEqual( rows[ 0 ], ( 'h1', 'h2', 4, 4, 0, 0.1 ) )
+        self.assertEqual( rows[ 1 ], ( 'h2', 'h1', 4, 2, 50, None ) )
+
+    def testSummary( self ):
+        "The summary lists replying destinations and overall loss"
+        matrix = PingMatrix( [ 'h1', 'h2' ] )
+        matrix.record( 0, 1, 1, 1, 0.5 )
+        matrix.record( 1, 0, 1, 0 )
+        self.assertEqual( matrix.summary(),
+                          'h1 -> h2 \nh2 -> X \n'
+                          '*** Results: 50% dropped (1/2 lost)\n' )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test parsing of the framed shell protocol."""
+
+import unittest
+
+from mininet.shell import FrameParser, FRAME
+
+
+def frame( ftype, payload ):
+    "Return an encoded frame."
+    return FRAME + ftype + '%04x' % len( payload ) + payload
+
+
+class testFrameParser( unittest.TestCase ):
+    "Splitting node output into output data and control frames."
+
+    def testFrames( self ):
+        "Output and frames are returned in order"
+        parser = FrameParser()
+        items = parser.feed( 'hello\n' + frame( 'E', '3 0 0' ) +
+                             frame( 'P', '1234' ) + 'bye' )
+        self.assertEqual( items, [ 'hello\n', ( 'E', '3 0 0' ),
+                                   ( 'P', '1234' ), 'bye' ] )
+
+    def testExitStatus( self ):
+        "E frames carry serial, exit status and background pid"
+        parser = FrameParser()
+        items = parser.feed( frame( 'E', '7 130 4321' ) )
+        self.assertEqual( items, [ ( 'E', '7 130 4321' ) ] )
+        serial, status, bgPid = [ int( f ) for f in items[ 0 ][ 1 ].split() ]
+        self.assertEqual( ( serial, status, bgPid ), ( 7, 130, 4321 ) )
+
+    def testSplitFrame( self ):
+        "A frame split across reads is completed by the next read"
+        parser = FrameParser()
+        data = 'out' + frame( 'E', '12 1 0' ) + 'more'
+        for split in range( 1, len( data ) ):
+            items = parser.feed( data[ :split ] ) + parser.feed( data[ split: ] )
+            frames = [ item for item in items if isinstance( item, tuple ) ]
+            output = ''.join( item for item in items
+                              if not isinstance( item, tuple ) )
+            self.assertEqual( frames, [ ( 'E', '12 1 0' ) ] )
+            self.assertEqual( output, 'outmore' )
+
+    def testStrayRecordSeparator( self ):
+        "An RS which doesn't start a valid frame is just output"
+        parser = FrameParser()
+        items = parser.feed( 'a' + FRAME + 'xyz\n' )
+        self.assertEqual( ''.join( items ), 'a' + FRAME + 'xyz\n' )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,10 +2,13 @@
 
 from time import sleep
 from resource import setrlimit, RLIMIT_NPROC, RLIMIT_NOFILE
-import select
-from subprocess import call, check_call, Popen, PIPE, STDOUT
+from subprocess import call, check_call
+from errno import ENODEV
 import os
+import re
 
+from mininet import netlink
+from mininet.helper import runCmd, RootHelper
 from mininet.log import error
 
 # Command execution support
@@ -23,31 +26,31 @@ def checkRun( cmd ):
 # pylint doesn't understand explicit type checking
 # pylint: disable-msg=E1103
 
-def quietRun( *cmd ):
-    """Run a command, routing stderr to stdout, and return the output.
-       cmd: list of command params"""
+def quietRun( *cmd, **kwargs ):
+    """Run a command as root, routing stderr to stdout, and return the output.
+       cmd: list of command params
+       input: string to send to the command's stdin (optional)"""
+    return errRun( *cmd, **kwargs )[ 0 ]
+
+def errRun( *cmd, **kwargs ):
+    """Run a command as root, routing stderr to stdout.
+       cmd: list of command params
+       input: string to send to the command's stdin (optional)
+       returns: output, exit status"""
     if len( cmd ) == 1:
         cmd = cmd[ 0 ]
         if isinstance( cmd, str ):
             cmd = cmd.split()
-    cmd = ["sudo", "-E", "env", "PATH=%s" % os.environ["PATH"]] + cmd
-    popen = Popen( cmd, stdout=PIPE, stderr=STDOUT )
-    # We can't use Popen.communicate() because it uses
-    # select(), which can't handle
-    # high file descriptor numbers! poll() can, however.
-    output = ''
-    readable = select.poll()
-    readable.register( popen.stdout )
-    while True:
-        while readable.poll():
-            data = popen.stdout.read( 1024 )
-            if len( data ) == 0:
-                break
-            output += data
-        popen.poll()
-        if popen.returncode != None:
-            break
-    return output
+    cmd = list( cmd )
+    input = kwargs.get( 'input' )
+    if os.geteuid() == 0:
+        # Fast path: no need for sudo
+        return runCmd( cmd, input )
+    if errRun.helper is None:
+        errRun.helper = RootHelper()
+    return errRun.helper.run( cmd, input )
+
+errRun.helper = None  # RootHelper, started on first use
 
 # pylint: enable-msg=E1103
 # pylint: disable-msg=E1101,W0612
@@ -63,6 +66,18 @@ def isShellBuiltin( cmd ):
 
 isShellBuiltin.builtIns = None
 
+SHELLKEYWORDS = set( 'if then else elif fi case esac for select while until '
+                     'do done in function time coproc'.split() )
+
+def isSimpleCommand( cmd ):
+    """Return True if cmd starts with a program to run (which can
+       be run via mnexec), rather than a builtin, keyword, subshell,
+       variable assignment, etc."""
+    match = re.match( r'([\w./+-]+)(\s|$)', cmd )
+    if not match or match.group( 1 ) in SHELLKEYWORDS:
+        return False
+    return not isShellBuiltin( cmd )
+
 # pylint: enable-msg=E1101,W0612
 
 # Interface management
@@ -78,17 +93,17 @@ isShellBuiltin.builtIns = None
 # live in the root namespace and thus do not have to be
 # explicitly moved.
 
-def makeIntfPair( intf1, intf2 ):
-    """Make a veth pair connecting intf1 and intf2.
+def makeIntfPair( intf1, intf2, mac1=None, mac2=None, mtu=None ):
+    """Make a veth pair connecting intf1 and intf2, in the root namespace.
+       (createLinks() makes links between nodes.)
        intf1: string, interface
        intf2: string, interface
-       returns: success boolean"""
-    # Delete any old interfaces with the same names
-    quietRun( 'ip link del ' + intf1 )
-    quietRun( 'ip link del ' + intf2 )
-    # Create new pair
-    cmd = 'ip link add name ' + intf1 + ' type veth peer name ' + intf2
-    return quietRun( cmd )
+       mac1: intf1 MAC address (optional)
+       mac2: intf2 MAC address (optional)
+       mtu: MTU of both interfaces (optional)
+       returns: error output, or '' on success"""
+    return _createPairs( [ ( intf1, intf2, None, None,
+                             dict( mac1=mac1, mac2=mac2, mtu=mtu ) ) ] )
 
 def retry( retries, delaySecs, fn, *args, **keywords ):
     """Try something several times before giving up.
@@ -112,7 +127,8 @@ def moveIntfNoRetry( intf, node, printError=False ):
     cmd = 'ip link set ' + intf + ' netns ' + repr( node.pid )
     quietRun( cmd )
     links = node.cmd( 'ip link show' )
-    if not ( ' %s:' % intf ) in links:
+    # Newer versions of ip show veth interfaces as intf@peer
+    if not ( ' %s:' % intf ) in links and not ( ' %s@' % intf ) in links:
         if printError:
             error( '*** Error: moveIntf: ' + intf +
                 ' not successfully moved to ' + node.name + '\n' )
@@ -126,14 +142,124 @@ def moveIntf( intf, node, printError=False, retries=3, delaySecs=0.001 ):
        printError: if true, print error"""
     retry( retries, delaySecs, moveIntfNoRetry, intf, node, printError )
 
-def createLink( node1, node2, port1=None, port2=None ):
+def createLink( node1, node2, port1=None, port2=None, **params ):
     """Create a link between nodes, making an interface for each.
        node1: Node object
        node2: Node object
        port1: node1 port number (optional)
        port2: node2 port number (optional)
+       params: mac1, mac2, mtu (optional; see Node.linkTo())
        returns: intf1 name, intf2 name"""
-    return node1.linkTo( node2, port1, port2 )
+    return node1.linkTo( node2, port1, port2, **params )
+
+def _createPairs( pairs ):
+    """Create veth pairs, via netlink if we can.
+       pairs: list of ( intf1, intf2, node1, node2, params ), where
+              a node of None stands for the root namespace
+       returns: error output, or '' on success"""
+    if not netlink.available():
+        return _ipCreatePairs( pairs )
+    try:
+        _nlCreatePairs( pairs )
+    except netlink.NetlinkError, e:
+        return '%s\n' % e
+    return ''
+
+def _nlCreatePairs( pairs ):
+    """Create veth pairs in place via netlink, and bring them up.
+       pairs: list of ( intf1, intf2, node1, node2, params )"""
+    msgs = []
+    for intf1, intf2, node1, node2, params in pairs:
+        # Delete any old interfaces with the same names
+        msgs += [ netlink.delLink( intf1 ), netlink.delLink( intf2 ) ]
+        msgs.append( netlink.newVeth( intf1, intf2,
+                                      node1 and node1.nsPid(),
+                                      node2 and node2.nsPid(),
+                                      params.get( 'mac1' ),
+                                      params.get( 'mac2' ),
+                                      params.get( 'mtu' ) ) )
+    netlink.rootSocket().check( msgs, ignore=[ ENODEV ] )
+    # Peers can only be brought up once they are complete;
+    # do this with one batch per namespace
+    peers = {}
+    for _intf1, intf2, _node1, node2, _params in pairs:
+        peers.setdefault( node2, [] ).append( netlink.setLink( intf2, up=True ) )
+    for node2, msgs in peers.iteritems():
+        nl = node2.nlSocket() if node2 else netlink.rootSocket()
+        nl.check( msgs )
+
+def _ipCreatePairs( pairs ):
+    """Create veth pairs via two ip -batch commands: one to create them
+       and one to move them into their namespaces.
+       pairs: list of ( intf1, intf2, node1, node2, params )
+       returns: error output, or '' on success"""
+    def linkParams( intf, mac, mtu ):
+        "Return ip link parameters for one end of a pair."
+        return ( 'name ' + intf + ( ' address ' + mac if mac else '' ) +
+                 ( ' mtu %d' % mtu if mtu else '' ) )
+    # Delete any old interfaces with the same names
+    existing = set( line.split( ':' )[ 1 ].strip().split( '@' )[ 0 ]
+                    for line in quietRun( 'ip -o link show' ).splitlines()
+                    if ':' in line )
+    delete, create, move = [], [], []
+    for intf1, intf2, node1, node2, params in pairs:
+        mtu = params.get( 'mtu' )
+        delete += [ 'link del ' + intf for intf in intf1, intf2
+                    if intf in existing ]
+        create.append( 'link add ' +
+                       linkParams( intf1, params.get( 'mac1' ), mtu ) +
+                       ' type veth peer ' +
+                       linkParams( intf2, params.get( 'mac2' ), mtu ) )
+        move += [ 'link set %s netns %d' % ( intf, node.pid )
+                  for intf, node in ( intf1, node1 ), ( intf2, node2 )
+                  if node and node.inNamespace ]
+    if delete:
+        # Deleting one end of a pair deletes the other, so some of
+        # these may fail
+        quietRun( 'ip -force -batch -', input='\n'.join( delete ) + '\n' )
+    errors = ''
+    for batch in create, move:
+        if batch:
+            errors += quietRun( 'ip -force -batch -',
+                                input='\n'.join( batch ) + '\n' )
+    return errors
+
+def createLinks( links ):
+    """Create many links at once, amortizing the cost of creating the
+       interfaces and moving them into their namespaces.
+       links: list of ( node1, node2, port1, port2, params ), where
+              ports are optional (None) and params is a dict with
+              optional mac1, mac2 and mtu (see Node.linkTo())
+       returns: list of ( intf1 name, intf2 name )"""
+    nextPorts = {}
+    def allocPort( node, port ):
+        "Allocate a port on node, if necessary."
+        if port is None:
+            port = nextPorts.get( node, node.newPort() )
+        nextPorts[ node ] = max( port + 1, nextPorts.get( node, 0 ) )
+        return port
+    pairs, ports = [], []
+    for node1, node2, port1, port2, params in links:
+        port1, port2 = allocPort( node1, port1 ), allocPort( node2, port2 )
+        ports.append( ( port1, port2 ) )
+        pairs.append( ( node1.intfName( port1 ), node2.intfName( port2 ),
+                        node1, node2, params ) )
+    errors = _createPairs( pairs )
+    if errors:
+        error( '*** Error creating links:\n' + errors )
+    # The interfaces are in place, so we just have to register them
+    for ( intf1, intf2, node1, node2, params ), ( port1, port2 ) in zip(
+            pairs, ports ):
+        for node, intf, port, mac in ( ( node1, intf1, port1,
+                                         params.get( 'mac1' ) ),
+                                       ( node2, intf2, port2,
+                                         params.get( 'mac2' ) ) ):
+            node.addIntf( intf, port, move=False )
+            if mac:
+                node.macs[ intf ] = mac
+        node1.registerIntf( intf1, node2, intf2 )
+        node2.registerIntf( intf2, node1, intf1 )
+    return [ pair[ :2 ] for pair in pairs ]
 
 
 # IP and Mac address formatting and parsing
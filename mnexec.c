@@ -5,37 +5,269 @@
  *
  *  - closing all file descriptors except stdin/out/error
  *  - detaching from a controlling tty using setsid
- *  - running in a network namespace
+ *  - running in a new network namespace, or in the network namespace
+ *    of an existing process (such as a node's shell)
  *  - printing out the pid of a process so we can identify it later
+ *  - holding a network namespace open without running anything,
+ *    for as long as stdin stays open
+ *  - serving requests to start node processes (see mininet/forkserver.py)
  *
  * Partially based on public domain setsid(1)
 */
 
+#define _GNU_SOURCE
+#include <errno.h>
+#include <fcntl.h>
+#include <sched.h>
+#include <signal.h>
 #include <stdio.h>
-#include <linux/sched.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/ioctl.h>
+#include <sys/socket.h>
+#include <sys/syscall.h>
+#include <termios.h>
 #include <unistd.h>
 
-void usage(char *name) 
+void usage(char *name)
 {
     printf("Execution utility for Mininet.\n"
-           "usage: %s [-cdnp]\n"
+           "usage: %s [-cdnpw] [-a pid] | -s\n"
            "-c: close all file descriptors except stdin/out/error\n"
            "-d: detach from tty by calling setsid()\n"
            "-n: run in new network namespace\n"
-           "-p: print ^A + pid\n", name);
+           "-a pid: run in the network namespace of process pid\n"
+           "-p: print pid (as a framed record, see mininet/shell.py)\n"
+           "-w: if no program is given, wait until killed or stdin is closed\n"
+           "-s: serve requests to start processes on the socket on stdin\n",
+           name);
+}
+
+/* close all file descriptors from first on */
+void closeFds(int first)
+{
+    int fd;
+
+#ifdef SYS_close_range
+    /* one system call, instead of one per possible fd */
+    if (syscall(SYS_close_range, first, ~0U, 0) == 0)
+        return;
+#endif
+    for (fd = getdtablesize(); fd >= first; fd--)
+        close(fd);
+}
+
+/* join the network namespace of process pid; returns -1 on error */
+int joinNetns(int pid)
+{
+    char path[64];
+    int fd, result;
+
+    snprintf(path, sizeof(path), "/proc/%d/ns/net", pid);
+    fd = open(path, O_RDONLY);
+    if (fd == -1)
+        return -1;
+    result = setns(fd, CLONE_NEWNET);
+    close(fd);
+    return result;
+}
+
+/* Fork server
+ *
+ * With -s, we read requests from the unix SOCK_SEQPACKET socket on
+ * stdin, one per message, until it is closed. A request is a list of
+ * NUL-terminated fields:
+ *
+ *   opts nspid nenv env... argv...
+ *
+ * where opts contains 'n' to start the process in a new network
+ * namespace and 't' to give it a pty (rather than a socketpair),
+ * nspid is the pid of a process whose network namespace it should
+ * join (or 0), and nenv is the number of environment settings which
+ * follow. The process is started in a new session, with its stdin,
+ * stdout and stderr connected to the pty or socketpair. We reply
+ * with the process's pid, along with the other end of its pty or
+ * socketpair as SCM_RIGHTS ancillary data, or with -errno if the
+ * process couldn't be started. We say hello when we start, so that
+ * clients can tell whether we support -s at all.
+ */
+
+#define MAXREQUEST 65536
+#define MAXFIELDS 1024
+
+/* child side of spawn(): report errno on fd and exit */
+void spawnFailed(int fd)
+{
+    int err = errno;
+
+    if (write(fd, &err, sizeof(err)) < 0)
+        _exit(126);
+    _exit(127);
+}
+
+/* start a process for a request; returns its pid, or -errno */
+int spawn(char *opts, int nspid, char **env, char **args, int *master)
+{
+    int slave, sv[2], status[2], statusFd, err, pid, n;
+    struct termios attrs;
+
+    if (strchr(opts, 't')) {
+        *master = posix_openpt(O_RDWR | O_NOCTTY);
+        if (*master == -1 || grantpt(*master) || unlockpt(*master))
+            return -errno;
+        slave = open(ptsname(*master), O_RDWR | O_NOCTTY);
+        if (slave == -1) {
+            err = errno;
+            close(*master);
+            return -err;
+        }
+        /* turn off echo so that we only read back command output */
+        tcgetattr(slave, &attrs);
+        attrs.c_lflag &= ~ECHO;
+        tcsetattr(slave, TCSANOW, &attrs);
+    } else {
+        if (socketpair(AF_UNIX, SOCK_STREAM, 0, sv) == -1)
+            return -errno;
+        *master = sv[0];
+        slave = sv[1];
+    }
+    /* the child closes its end of this pipe when it execs, or
+       writes errno to it if it fails */
+    if (pipe2(status, O_CLOEXEC) == -1) {
+        err = errno;
+        close(*master);
+        close(slave);
+        return -err;
+    }
+    pid = fork();
+    if (pid == 0) {
+        statusFd = status[1];
+        signal(SIGCHLD, SIG_DFL);
+        signal(SIGINT, SIG_DFL);
+        setsid();
+        if (strchr(opts, 'n') && unshare(CLONE_NEWNET) == -1)
+            spawnFailed(statusFd);
+        if (nspid && joinNetns(nspid) == -1)
+            spawnFailed(statusFd);
+        if (dup2(slave, 0) == -1 || dup2(slave, 1) == -1 ||
+            dup2(slave, 2) == -1)
+            spawnFailed(statusFd);
+        /* make the pty our controlling terminal, so that ^C written
+           to it interrupts the running command */
+        if (isatty(0))
+            ioctl(0, TIOCSCTTY, 0);
+        if (dup2(statusFd, 3) == -1)
+            spawnFailed(statusFd);
+        statusFd = 3;
+        fcntl(statusFd, F_SETFD, FD_CLOEXEC);
+        closeFds(4);
+        for (; *env; env++)
+            putenv(*env);
+        execvp(args[0], args);
+        spawnFailed(statusFd);
+    }
+    err = errno;
+    close(slave);
+    close(status[1]);
+    if (pid == -1) {
+        close(status[0]);
+        close(*master);
+        return -err;
+    }
+    n = read(status[0], &err, sizeof(err));
+    close(status[0]);
+    if (n > 0) {
+        close(*master);
+        return -err;
+    }
+    return pid;
+}
+
+/* send a reply, with fd attached if it isn't -1 */
+void reply(int sock, int result, int fd)
+{
+    char text[16];
+    char control[CMSG_SPACE(sizeof(int))];
+    struct iovec iov;
+    struct msghdr msg;
+    struct cmsghdr *cmsg;
+
+    snprintf(text, sizeof(text), "%d", result);
+    iov.iov_base = text;
+    iov.iov_len = strlen(text);
+    memset(&msg, 0, sizeof(msg));
+    msg.msg_iov = &iov;
+    msg.msg_iovlen = 1;
+    if (fd != -1) {
+        msg.msg_control = control;
+        msg.msg_controllen = sizeof(control);
+        cmsg = CMSG_FIRSTHDR(&msg);
+        cmsg->cmsg_level = SOL_SOCKET;
+        cmsg->cmsg_type = SCM_RIGHTS;
+        cmsg->cmsg_len = CMSG_LEN(sizeof(int));
+        memcpy(CMSG_DATA(cmsg), &fd, sizeof(int));
+    }
+    sendmsg(sock, &msg, 0);
+}
+
+int serve(int sock)
+{
+    static char request[MAXREQUEST];
+    char *fields[MAXFIELDS + 1];
+    int n, count, nenv, master, result;
+    char *p;
+
+    /* children are reaped for us; ^C is for the client, not us */
+    signal(SIGCHLD, SIG_IGN);
+    signal(SIGINT, SIG_IGN);
+    closeFds(3);
+    if (send(sock, "mnexec", 6, 0) == -1) {
+        perror("send");
+        return 1;
+    }
+    for (;;) {
+        n = recv(sock, request, sizeof(request) - 1, 0);
+        if (n == -1 && errno == EINTR)
+            continue;
+        if (n <= 0)
+            return 0;
+        /* split the request into fields */
+        request[n] = '\0';
+        count = 0;
+        for (p = request; p < request + n && count < MAXFIELDS;
+             p += strlen(p) + 1)
+            fields[count++] = p;
+        fields[count] = NULL;
+        nenv = count >= 3 ? atoi(fields[2]) : -1;
+        if (nenv < 0 || count < 4 + nenv) {
+            reply(sock, -EINVAL, -1);
+            continue;
+        }
+        /* the environment list is NULL-terminated in place, by
+           moving its entries up over nenv itself */
+        memmove(&fields[2], &fields[3], nenv * sizeof(char *));
+        fields[2 + nenv] = NULL;
+        result = spawn(fields[0], atoi(fields[1]), &fields[2],
+                       &fields[3 + nenv], &master);
+        reply(sock, result, result > 0 ? master : -1);
+        if (result > 0)
+            close(master);
+    }
 }
 
 int main(int argc, char *argv[])
 {
     char c;
-    int fd;
-    
-    while ((c = getopt(argc, argv, "+cdnp")) != -1)
+    char pid[16];
+    char buf[64];
+    int hold = 0;
+    ssize_t n;
+
+    while ((c = getopt(argc, argv, "+cdnpwsa:")) != -1)
         switch(c) {
         case 'c':
             /* close file descriptors except stdin/out/error */
-            for (fd = getdtablesize(); fd > 2; fd--)
-                close(fd);
+            closeFds(3);
             break;
         case 'd':
             /* detach from tty */
@@ -51,6 +283,10 @@ int main(int argc, char *argv[])
                 }
             }
             setsid();
+            /* make our tty (if any) the controlling terminal, so
+               that ^C written to it interrupts the running command */
+            if (isatty(0))
+                ioctl(0, TIOCSCTTY, 0);
             break;
         case 'n':
             /* run in network namespace */
@@ -59,11 +295,26 @@ int main(int argc, char *argv[])
                 return 1;
             }
             break;
+        case 'a':
+            /* join the network namespace of an existing process */
+            if (joinNetns(atoi(optarg)) == -1) {
+                perror("setns");
+                return 1;
+            }
+            break;
         case 'p':
-            /* print pid */
-            printf("\001%d\n", getpid());
+            /* print pid as a framed record: RS 'P' length pid */
+            snprintf(pid, sizeof(pid), "%d", getpid());
+            printf("\036P%04x%s", (unsigned) strlen(pid), pid);
             fflush(stdout);
             break;
+        case 'w':
+            /* hold our namespace until we are killed */
+            hold = 1;
+            break;
+        case 's':
+            /* fork server */
+            return serve(0);
         default:
             usage(argv[0]);
             break;
@@ -74,6 +325,21 @@ int main(int argc, char *argv[])
 		perror(argv[optind]);
 		return 1;
 	}
-    
+
+    if (hold) {
+        /* stdin is our link to mininet: when it is closed, because
+           mininet has exited (or crashed), let the namespace go */
+        for (;;) {
+            n = read(0, buf, sizeof(buf));
+            if (n == 0)
+                return 0;
+            if (n == -1 && errno != EINTR)
+                break;
+        }
+        /* no usable stdin, so wait until we are killed */
+        for (;;)
+            pause();
+    }
+
     usage(argv[0]);
 }